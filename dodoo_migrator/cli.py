@@ -23,17 +23,19 @@
 from __future__ import print_function
 
 import logging
+import os
 import sys
 import threading
 import time
 from contextlib import contextmanager
+from multiprocessing import cpu_count
 
 import click
 import dodoo
 import semver
 from dodoo import odoo
 
-from . import migration
+from . import metrics, migration, profiling
 
 _logger = logging.getLogger(__name__)
 
@@ -68,6 +70,8 @@ class ApplicationLock(threading.Thread):
         self.acquired = False
         self.cr = cr
         self.stop = False
+        # held while the connection is in use, see _before_fork
+        self.mutex = threading.Lock()
         super(ApplicationLock, self).__init__()
 
     def run(self):
@@ -85,7 +89,8 @@ class ApplicationLock(threading.Thread):
                 # keep the connection alive to maintain the advisory
                 # lock by running a query every 30 seconds
                 if idx == 60:
-                    self.cr.execute("SELECT 1")
+                    with self.mutex:
+                        self.cr.execute("SELECT 1")
                     idx = 0
                 idx += 1
                 # keep the sleep small to be able to exit quickly
@@ -93,30 +98,59 @@ class ApplicationLock(threading.Thread):
                 time.sleep(0.5)
 
 
+def _before_fork():
+    # a process forked (e.g. by the parallel mode of recompute_fields) while
+    # the lock thread runs a query would inherit its connection mid-statement
+    if LOCK is not None:
+        LOCK.mutex.acquire()
+
+
+def _after_fork():
+    if LOCK is not None:
+        LOCK.mutex.release()
+
+
+if hasattr(os, "register_at_fork"):  # Python >= 3.7
+    os.register_at_fork(
+        before=_before_fork, after_in_parent=_after_fork, after_in_child=_after_fork
+    )
+
+
 @contextmanager
 def MigrationEnvironment(self):
-    conn = odoo.sql_db.db_connect(self.database)
-    global LOCK_CR
-    LOCK_CR = conn.cursor()
-    global LOCK
-    LOCK = ApplicationLock(LOCK_CR)
-    LOCK.start()
-    while not LOCK.acquired:
-        time.sleep(0.5)
-    with odoo.api.Environment.manage():
-        try:
-            # we are not in the replica: go on for the migration
-            yield conn
-        finally:
-            LOCK.stop = True
-            LOCK.join()
-            LOCK_CR.close()
-            if odoo.release.version_info[0] < 10:
-                odoo.modules.registry.RegistryManager.delete(self.database)
-            else:
-                odoo.modules.registry.Registry.delete(self.database)
-            odoo.sql_db.close_db(self.database)
-            odoo.sql_db.close_all()
+    params = click.get_current_context().params
+    if params.get("serve_metrics"):
+        metrics.start()
+    try:
+        conn = odoo.sql_db.db_connect(self.database)
+        if params.get("watch"):
+            # neither the lock nor the Odoo environment are needed to wait
+            migration.wait_for_service(conn)
+        global LOCK_CR
+        LOCK_CR = conn.cursor()
+        global LOCK
+        LOCK = ApplicationLock(LOCK_CR)
+        LOCK.start()
+        with metrics.timed(metrics.LOCK_WAIT_SECONDS):
+            while not LOCK.acquired:
+                time.sleep(0.5)
+        with odoo.api.Environment.manage():
+            try:
+                # we are not in the replica: go on for the migration
+                yield conn
+            finally:
+                LOCK.stop = True
+                LOCK.join()
+                LOCK_CR.close()
+                if odoo.release.version_info[0] < 10:
+                    odoo.modules.registry.RegistryManager.delete(self.database)
+                else:
+                    odoo.modules.registry.Registry.delete(self.database)
+                odoo.sql_db.close_db(self.database)
+                odoo.sql_db.close_all()
+    finally:
+        if params.get("serve_metrics"):
+            metrics.stop()
 
 
 @click.command(
@@ -157,12 +191,43 @@ def MigrationEnvironment(self):
 )
 @click.option(
     "--metrics/--no-metrics",
+    "serve_metrics",
     default=False,
     show_default=True,
     help="Prometheus metrics endpoint for migration progress. "
     "Can be consumed by a status page or monitoring solution.",
 )
-def migrate(env, file, mig_directory, since, until, metrics):
+@click.option(
+    "--watch/--no-watch",
+    default=False,
+    show_default=True,
+    help="Wait for pending migration service results instead of exiting, "
+    "polling their status with an exponential backoff.",
+)
+@click.option(
+    "--profile-sql",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Profile the SQL statements of the migration scripts into this json "
+    "report (and PATH.folded, a flame graph input).",
+)
+@click.option(
+    "--explain-slowest",
+    default=0,
+    show_default=True,
+    help="With --profile-sql, EXPLAIN ANALYZE the N slowest statements "
+    "(running them a second time, rolled back).",
+)
+def migrate(
+    env,
+    file,
+    mig_directory,
+    since,
+    until,
+    serve_metrics,
+    watch,
+    profile_sql,
+    explain_slowest,
+):
     """ Apply migration paths specified by a descriptive yaml migration file.
 
     Persists applied migrations within the target database.
@@ -180,9 +245,79 @@ def migrate(env, file, mig_directory, since, until, metrics):
 
     global MIGRATION_SCRIPTS_PATH
     MIGRATION_SCRIPTS_PATH = mig_directory
-    mig_spec = migration.MigrationSpec(env, file, since, until)
+    if profile_sql:
+        profiling.start(explain_slowest)
+    mig_spec = migration.MigrationSpec(env, file, since, until, profile=profile_sql)
     mig_spec.run()
 
 
+@contextmanager
+def BackupEnvironment(self):
+    yield self.database
+
+
+@click.command(
+    cls=dodoo.CommandWithOdooEnv,
+    env_options={"environment_manager": BackupEnvironment},
+)
+@dodoo.options.db_opt(True)
+@click.option(
+    "--jobs",
+    "-j",
+    default=cpu_count(),
+    show_default=True,
+    help="Number of threads compressing the dump.",
+)
+@click.argument("dest", type=click.Path(dir_okay=False, writable=True))
+def backup(env, jobs, dest):
+    """ Dump the database into a gzipped tar format dump.
+
+    Same format as the backups submitted to the migration service with
+    DODOO_MIGRATOR_BACKUP_JOBS: the dump is compressed by several threads.
+    """
+
+    # env is just the database name, here
+
+    try:
+        from .migration import upgradeservice
+    except ImportError:
+        raise click.ClickException("upgrade service dependencies are missing.")
+    upgradeservice.db.backup(env, dest, jobs)
+
+
+@contextmanager
+def IndexEnvironment(self):
+    yield None
+
+
+@click.command(
+    cls=dodoo.CommandWithOdooEnv,
+    env_options={"environment_manager": IndexEnvironment},
+)
+@dodoo.options.addons_path_opt(True)
+@click.option(
+    "--mig-directory",
+    "-m",
+    type=click.Path(exists=True, file_okay=False),
+    help="The migration directory shim used with migrate.",
+)
+def index_scripts(env, mig_directory):
+    """ Build the index of the migration scripts ahead of migrating.
+
+    Migration scripts are looked up in this index, which is otherwise built
+    lazily, folder by folder. It is stored into DODOO_MIGRATOR_SCRIPT_INDEX,
+    by default into the data directory.
+    """
+
+    global MIGRATION_SCRIPTS_PATH
+    MIGRATION_SCRIPTS_PATH = mig_directory
+    from .migration_manager import build_script_index
+
+    index = build_script_index()
+    click.echo(
+        "{} migrations folders indexed into {}.".format(len(index.entries), index.path)
+    )
+
+
 if __name__ == "__main__":  # pragma: no cover
     migrate()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 XOE Corp. SAS
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+"""Prometheus metrics of the migration progress.
+
+The metrics are recorded in their own registry, served over http by a
+background thread once `start` is called. When the port is not available,
+or `DODOO_MIGRATOR_METRICS_TEXTFILE` is set, they are also written to a file
+for the textfile collector of the node exporter.
+
+Without `prometheus_client` installed, recording metrics does nothing.
+"""
+from __future__ import absolute_import
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+_logger = logging.getLogger(__name__)
+
+# port of the http endpoint
+METRICS_PORT = int(os.getenv("DODOO_MIGRATOR_METRICS_PORT") or 8000)
+# file for the textfile collector, rewritten every TEXTFILE_INTERVAL seconds
+METRICS_TEXTFILE = os.getenv("DODOO_MIGRATOR_METRICS_TEXTFILE")
+TEXTFILE_INTERVAL = 15
+
+REGISTRY = prometheus_client.CollectorRegistry() if prometheus_client else None
+
+
+class _NoopMetric(object):
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def _metric(kind, name, documentation, labelnames=()):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return getattr(prometheus_client, kind)(
+        name, documentation, labelnames, registry=REGISTRY
+    )
+
+
+PHASE_SECONDS = _metric(
+    "Gauge",
+    "dodoo_migrator_phase_duration_seconds",
+    "Duration of the phases of a migration.",
+    ("version", "phase"),
+)
+SCRIPT_SECONDS = _metric(
+    "Gauge",
+    "dodoo_migrator_script_duration_seconds",
+    "Duration of the migration scripts of the modules.",
+    ("module", "version", "stage", "script"),
+)
+TRANSFER_BYTES = _metric(
+    "Counter",
+    "dodoo_migrator_transfer_bytes",
+    "Bytes transferred from and to the migration service.",
+    ("direction",),
+)
+TRANSFER_THROUGHPUT = _metric(
+    "Gauge",
+    "dodoo_migrator_transfer_throughput_bytes_per_second",
+    "Throughput of the last transfer from or to the migration service.",
+    ("direction",),
+)
+RESTORE_BYTES = _metric(
+    "Counter", "dodoo_migrator_restore_bytes", "Bytes of dump read by the restore."
+)
+RESTORE_SECONDS = _metric(
+    "Gauge",
+    "dodoo_migrator_restore_duration_seconds",
+    "Duration of the steps restoring the migrated database.",
+    ("step",),
+)
+LOCK_WAIT_SECONDS = _metric(
+    "Gauge",
+    "dodoo_migrator_lock_wait_seconds",
+    "Time waited for the application lock.",
+)
+WATCH_POLLS = _metric(
+    "Counter",
+    "dodoo_migrator_watch_polls",
+    "Status polls of the pending migration service request.",
+)
+WATCH_STATE = _metric(
+    "Gauge",
+    "dodoo_migrator_watch_state",
+    "State of the pending migration service request (1 for the current one).",
+    ("state",),
+)
+
+
+@contextmanager
+def timed(metric, **labels):
+    """Set the gauge `metric` to the duration of the block."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        (metric.labels(**labels) if labels else metric).set(time.time() - start)
+
+
+def record_transfer(direction, size, start):
+    """Record the throughput of a transfer of `size` bytes started at `start`."""
+    elapsed = time.time() - start
+    if elapsed > 0:
+        TRANSFER_THROUGHPUT.labels(direction).set(size / elapsed)
+
+
+_stop = threading.Event()
+_textfile = {}
+
+
+def _write_textfile(path):
+    try:
+        prometheus_client.write_to_textfile(path, REGISTRY)
+    except (IOError, OSError) as e:
+        _logger.warning("cannot write metrics to %s: %s", path, e)
+
+
+def _export_textfile(path):
+    while not _stop.wait(TEXTFILE_INTERVAL):
+        _write_textfile(path)
+
+
+def start(port=METRICS_PORT, textfile=METRICS_TEXTFILE):
+    """Serve the metrics from a background thread."""
+    if prometheus_client is None:
+        _logger.warning("prometheus_client is not installed: no metrics.")
+        return
+    try:
+        prometheus_client.start_http_server(port, registry=REGISTRY)
+        _logger.info("metrics served on port %d.", port)
+    except (IOError, OSError) as e:
+        textfile = textfile or os.path.join(
+            tempfile.gettempdir(), "dodoo_migrator.prom"
+        )
+        _logger.warning("cannot serve metrics on port %d: %s", port, e)
+    if textfile:
+        _logger.info("metrics written to %s.", textfile)
+        _stop.clear()
+        thread = threading.Thread(target=_export_textfile, args=(textfile,))
+        thread.daemon = True
+        thread.start()
+        _textfile.update(path=textfile, thread=thread)
+
+
+def stop():
+    """Write the metrics a last time to the textfile, if any."""
+    if not _textfile:
+        return
+    _stop.set()
+    _textfile.pop("thread").join()
+    _write_textfile(_textfile.pop("path"))
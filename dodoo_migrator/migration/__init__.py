@@ -1 +1 @@
-from .migration import MigrationSpec  # noqa: F401
+from .migration import MigrationSpec, wait_for_service  # noqa: F401
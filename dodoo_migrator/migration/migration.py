@@ -14,6 +14,7 @@ import semver
 import yaml
 from dodoo import odoo
 
+from .. import metrics, profiling
 from .database import MigrationTable
 from .exceptions import MigrationErrorGap, MigrationErrorUnfinished, ParseError
 
@@ -177,6 +178,7 @@ class Migration(yaml.YAMLObject):
         if not migration:
             _logger.warning("remove operation is not supported for Odoo < 10.0.")
             return
+        cr = profiling.cursor(cr, "{} remove".format(self.version))
         for name in self.remove:
             _logger.info(u"migrate to %s (Remove Module: %s).", self.version, name)
             migration.remove_module(cr, name)
@@ -184,7 +186,12 @@ class Migration(yaml.YAMLObject):
     def _run_pre_scripts(self, cr):
         for script in self.pre_scripts:
             _logger.info(u"migrate to %s (Pre Script: %s).", self.version, script)
-            exec(open(os.path.abspath(script)).read(), {"cr": cr})
+            context = "{} {}".format(self.version, script)
+            script_cr = profiling.cursor(cr, context)
+            if migration:
+                # the previous steps may have altered the schema
+                migration.invalidate_schema(script_cr)
+            exec(open(os.path.abspath(script)).read(), {"cr": script_cr})
 
     def _run_odoo_reconciliation(self, cr):
         _load_modules = odoo.modules.load_modules
@@ -254,18 +261,28 @@ class Migration(yaml.YAMLObject):
     def _run_post_scripts(self, cr):
         for script in self.post_scripts:
             _logger.info(u"migrate to %s (Post Script: %s).", self.version, script)
-            exec(open(os.path.abspath(script)).read(), {"cr": cr})
+            context = "{} {}".format(self.version, script)
+            script_cr = profiling.cursor(cr, context)
+            if migration:
+                # the previous steps may have altered the schema
+                migration.invalidate_schema(script_cr)
+            exec(open(os.path.abspath(script)).read(), {"cr": script_cr})
+
+    def _timed(self, phase):
+        return metrics.timed(
+            metrics.PHASE_SECONDS, version=str(self.version), phase=phase
+        )
 
     def run(self, conn):
         """ Run the actual migration """
-        with conn.cursor() as cr:
+        with self._timed("pre_scripts"), conn.cursor() as cr:
             self._run_pre_scripts(cr)
         if self.upgrade or self.install or self.uninstall:
-            with conn.cursor() as cr:
+            with self._timed("reconciliation"), conn.cursor() as cr:
                 self._run_odoo_reconciliation(cr)
-        with conn.cursor() as cr:
+        with self._timed("remove"), conn.cursor() as cr:
             self._remove(cr)
-        with conn.cursor() as cr:
+        with self._timed("post_scripts"), conn.cursor() as cr:
             self._run_post_scripts(cr)
 
     def is_noop(self):
@@ -279,7 +296,7 @@ class MigrationSpec(object):
     """ A series of migrations loaded from a yaml file, bound to a database
     coursor. """
 
-    def __init__(self, conn, stream, since, until):
+    def __init__(self, conn, stream, since, until, profile=None):
         self.migrations = sorted(
             {mig for mig in yaml.load_all(stream)}, key=lambda m: m.version
         )
@@ -287,6 +304,7 @@ class MigrationSpec(object):
         self.conn = conn
         self.since = since
         self.until = until
+        self.profile = profile
         self.versions = sorted(self.mig_table.versions())
         self.finished = {v.number for v in filter(lambda v: v.date_done, self.versions)}
         self.started = {v.number for v in self.versions}
@@ -325,6 +343,13 @@ class MigrationSpec(object):
 
     def run(self):
         """ Execute all applicable migrations from the spec """
+        try:
+            self._run()
+        finally:
+            if self.profile:
+                profiling.write_report(self.profile)
+
+    def _run(self):
 
         if self.since and self.since <= self.finished[-1]:
             _logger.error(
@@ -392,3 +417,15 @@ class MigrationSpec(object):
                 datetime.datetime.now(),
                 {op: getattr(mig, op) for op in MIG_OPERATIONS},
             )
+
+
+def wait_for_service(conn):
+    """ Wait for the results of a migration pending at its service.
+
+    Only the status of the request is polled, which is meant to happen
+    before taking the migration lock. """
+    if not upgradeservice:
+        return
+    for version in MigrationTable(conn).versions():
+        if version.service and not version.date_done:
+            upgradeservice.db.wait_until_ready(conn, version.service)
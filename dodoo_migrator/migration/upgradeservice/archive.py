@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 XOE Corp. SAS
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+"""Parallel gzip compression of dumps."""
+
+import zlib
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def _gzip_member(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class ParallelGzipWriter(object):
+    """Write-only file-like object gzipping into `fileobj` with `threads`.
+
+    The data is cut in chunks compressed concurrently as independent gzip
+    members: their concatenation is a valid gzip stream. At most two
+    chunks per thread are held in memory.
+    """
+
+    def __init__(self, fileobj, threads, level=6, chunk_size=CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.threads = threads
+        self.level = level
+        self.chunk_size = chunk_size
+        self.pool = ThreadPool(threads)
+        self.pending = deque()
+        self.buffer = []
+        self.buffered = 0
+
+    def _submit(self):
+        data = b"".join(self.buffer)
+        self.buffer, self.buffered = [], 0
+        self.pending.append(self.pool.apply_async(_gzip_member, (data, self.level)))
+        while len(self.pending) > 2 * self.threads:
+            self.fileobj.write(self.pending.popleft().get())
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.chunk_size:
+            self._submit()
+
+    def close(self):
+        try:
+            if self.buffered:
+                self._submit()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().get())
+        finally:
+            self.pool.close()
+            self.pool.join()
+        self.fileobj.close()
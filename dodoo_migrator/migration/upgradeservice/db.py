@@ -4,20 +4,30 @@
 from __future__ import absolute_import
 
 import gzip
+import json
 import logging
 import os
 import shutil
 import tempfile
+import threading
+import time
 import zipfile
+import zlib
 from contextlib import closing
 
 import psycopg2
 
 import odoo
 
-from . import keys, odoo_service
-from ... import cli
-from .merge_copytree import copytree
+from . import archive, filestore, keys, odoo_service, pipeline, restore, watch
+from .errors import CorruptedArchiveError
+from .manifest import TransferManifest
+from ... import cli, metrics
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
 
 BOLD = u"\033[1m"
 RESET = u"\033[0m"
@@ -26,6 +36,28 @@ BLUE = u"\033[1;34m"
 
 _logger = logging.getLogger(BOLD + u"UPGRADE SERVICE" + RESET)
 
+# pipe pg_dump through gzip right into the upload instead of a temp file
+STREAM_UPLOAD = os.getenv("DODOO_MIGRATOR_STREAM_UPLOAD")
+STREAM_CHUNK_SIZE = 1024 * 1024
+STREAM_QUEUE_SIZE = 16
+# number of concurrent SFTP connections per transfer
+TRANSFER_SEGMENTS = int(os.getenv("DODOO_MIGRATOR_TRANSFER_SEGMENTS") or 1)
+# number of concurrent connections restoring the upgraded database
+RESTORE_JOBS = int(os.getenv("DODOO_MIGRATOR_RESTORE_JOBS") or 1)
+# number of threads compressing the backup
+BACKUP_JOBS = int(os.getenv("DODOO_MIGRATOR_BACKUP_JOBS") or 1)
+# number of threads writing the filestore
+FILESTORE_THREADS = int(os.getenv("DODOO_MIGRATOR_FILESTORE_THREADS") or 8)
+# restore the upgraded database while it is downloaded
+PIPELINED_RETRIEVE = os.getenv("DODOO_MIGRATOR_PIPELINED_RETRIEVE")
+# chunks (of the SFTP read size) buffered between the download and the restore
+PIPELINE_QUEUE_SIZE = 1024
+# restore into a shadow database, swapped with the database once checked
+SHADOW_RESTORE = os.getenv("DODOO_MIGRATOR_SHADOW_RESTORE")
+# seconds between two status polls, doubling up to the max while unchanged
+WATCH_INTERVAL = int(os.getenv("DODOO_MIGRATOR_WATCH_INTERVAL") or 30)
+WATCH_MAX_INTERVAL = int(os.getenv("DODOO_MIGRATOR_WATCH_MAX_INTERVAL") or 900)
+
 
 class DatabaseApi(object):
     def __init__(self, cr):
@@ -39,6 +71,7 @@ class DatabaseApi(object):
         self._sftp_user = None
         self._request = None
         self._token = None
+        self._transfer_state = None
 
     def _set_icp(self, key, value):
         key = getattr(type(self), key).__doc__
@@ -194,6 +227,18 @@ class DatabaseApi(object):
     def token(self, value):
         self._token = self._set_icp("token", value)
 
+    @property
+    def transfer_state(self):
+        """database.upgrade.service.transfer_state"""
+        if self._transfer_state:
+            return self._transfer_state
+        self._transfer_state = self._get_icp("transfer_state")
+        return self._transfer_state
+
+    @transfer_state.setter
+    def transfer_state(self, value):
+        self._transfer_state = self._set_icp("transfer_state", value)
+
 
 def _sync_odoo(Db, Service, mode="persist"):
     if mode == "load":
@@ -212,6 +257,33 @@ def _sync_odoo(Db, Service, mode="persist"):
         raise Exception
 
 
+def _load_transfer_state(conn):
+    with conn.cursor() as cr:
+        state = DatabaseApi(cr).transfer_state
+    return json.loads(state) if state else None
+
+
+def _save_transfer_state(conn):
+    """Return a callable persisting the description of a transfer.
+
+    Each call commits on its own cursor, so that a later run finds the
+    local file (and its manifest) of an interrupted transfer again.
+    """
+
+    def save(state):
+        with conn.cursor() as cr:
+            DatabaseApi(cr).transfer_state = json.dumps(state) if state else ""
+
+    return save
+
+
+def _discard_transfer(fname, keep_file=False):
+    """Remove the manifest of a finished transfer (and the file itself)."""
+    TransferManifest(fname).unlink()
+    if not keep_file and os.path.exists(fname):
+        os.remove(fname)
+
+
 def submit(conn, service, aim, target):
     with conn.cursor() as cr:
         Db = DatabaseApi(cr)
@@ -230,19 +302,59 @@ def submit(conn, service, aim, target):
             _sync_odoo(Db, Service, mode="persist")
             _logger.info(u"request %s created.", Db.request)
         cr.commit()
-    fname = tempfile.mktemp()
-    with gzip.open(fname, "wb") as f:
-        _logger.info(u"creating backup ...")
-        _get_backup(conn.dbname, f)
-    with open(fname, "rb") as f:
-        _logger.info(u"uploading ...")
-        Service.upload(f)
+    if STREAM_UPLOAD:
+        with closing(BackupStream(conn.dbname)) as f:
+            _logger.info(u"streaming backup upload ...")
+            Service.upload_stream(f)
+    else:
+        fname = tempfile.mktemp()
+        if BACKUP_JOBS > 1:
+            _logger.info(u"creating backup (%d threads) ...", BACKUP_JOBS)
+            backup(conn.dbname, fname, BACKUP_JOBS)
+        else:
+            with gzip.open(fname, "wb") as f:
+                _logger.info(u"creating backup ...")
+                _get_backup(conn.dbname, f)
+        if TRANSFER_SEGMENTS > 1:
+            _logger.info(u"uploading (%d segments) ...", TRANSFER_SEGMENTS)
+            Service.upload_segmented(fname, TRANSFER_SEGMENTS)
+            _discard_transfer(fname, keep_file=True)
+        else:
+            with open(fname, "rb") as f:
+                _logger.info(u"uploading ...")
+                Service.upload(f)
     _logger.info(u"request processing...")
     Service.process()
-    f.close()
     _logger.info(u"Now you need patience...")
 
 
+def wait_until_ready(conn, service):
+    """Block until the service has processed the request of the database.
+
+    Only the status endpoint is polled: no SFTP access is requested.
+    """
+    with conn.cursor() as cr:
+        Db = DatabaseApi(cr)
+        if service == "odoo":
+            Service = odoo_service.UpgradeApi(
+                "DodooMigrator",
+                None,
+                None,
+                Db.odoo_contract,
+                Db.email,
+                Db.public_key,
+                Db.private_key,
+            )
+            _sync_odoo(Db, Service, mode="load")
+    _logger.info(
+        u"watching request %s (every %d to %ds) ...",
+        Service.request_id,
+        WATCH_INTERVAL,
+        WATCH_MAX_INTERVAL,
+    )
+    watch.watch(Service, WATCH_INTERVAL, WATCH_MAX_INTERVAL)
+
+
 def retrieve(conn, service):
     with conn.cursor() as cr:
         Db = DatabaseApi(cr)
@@ -263,33 +375,329 @@ def retrieve(conn, service):
             _logger.info(u"persisting state to db ...")
             _sync_odoo(Db, Service, mode="persist")
 
-    _logger.info(u"downloading ...")
-    if Service.has_converted_to_zip():
-        _logger.info(u"was converted to ZIP ...")
-        f = tempfile.NamedTemporaryFile(mode="a+b")
+    if PIPELINED_RETRIEVE:
+        # a zip needs its central directory: spill it to disk first
+        if not Service.has_converted_to_zip():
+            _retrieve_pipelined(conn, Service)
+            return
+        _logger.info(u"zip archive, downloading before restoring ...")
+
+    # resume an interrupted download into the same file
+    state = _load_transfer_state(conn)
+    if state and os.path.exists(state["localpath"]):
+        fname = state["localpath"]
     else:
-        f = gzip.open(tempfile.mktemp(), "a+b")
-    Service.download(f)
+        fname = tempfile.mktemp()
+    _logger.info(u"downloading (%d segments) ...", TRANSFER_SEGMENTS)
+    Service.download_segmented(fname, TRANSFER_SEGMENTS, _save_transfer_state(conn))
+    _logger.info(u"verifying download ...")
+    try:
+        _verify_archive(fname)
+    except CorruptedArchiveError:
+        # start over on next run
+        _discard_transfer(fname)
+        raise
     _logger.info(u"restoring migrated ...")
+    with open(fname, "rb") as f:
+        _restore_database(conn, lambda db: _restore_backup(db, f))
+    _discard_transfer(fname)
+
+
+def _retrieve_pipelined(conn, Service):
+    """Restore the upgraded database while it is being downloaded.
+
+    The download feeds a bounded in-memory pipe which the restore consumes,
+    so that the database is down for about the longest of both instead of
+    their sum. Nothing is kept on disk: an interrupted run downloads again.
+    The restore always goes into a shadow database (see `_restore_database`),
+    whether `SHADOW_RESTORE` is set or not: a failed download must not leave
+    the database dropped with nothing to restore it from.
+    """
+    _logger.info(u"restoring migrated while downloading ...")
+
+    def _restore(db):
+        pipe = pipeline.pipe_from(Service.download, PIPELINE_QUEUE_SIZE)
+        try:
+            _restore_stream(db, pipe)
+        finally:
+            pipe.abandon()
+
+    _restore_database(conn, _restore, shadow=True)
+
+
+def _restore_database(conn, restore_func, shadow=False):
+    """Replace the database of `conn` by the one `restore_func(db)` creates.
+
+    The database is dropped and restored in place, unless `shadow` or
+    `SHADOW_RESTORE` is set: then the restore goes into a shadow database
+    and filestore while the original ones stay available, and only the swap
+    of their names runs without the application lock. A failed restore or
+    check leaves the database and its filestore as they are.
+    """
+    if not (shadow or SHADOW_RESTORE):
+        _release_lock(conn)
+        _drop_database(conn.dbname)
+        with metrics.timed(metrics.RESTORE_SECONDS, step="restore"):
+            restore_func(conn.dbname)
+        _reestablish_lock(conn)
+        return
+
+    shadow_db = _suffixed_name(conn.dbname, "_shadow")
+    _drop_database(shadow_db)
+    _remove_filestore(shadow_db)
+    _logger.info("restoring into shadow database %s ...", shadow_db)
+    try:
+        # the restore only extracts the attachments which changed
+        _link_filestore(conn.dbname, shadow_db)
+        with metrics.timed(metrics.RESTORE_SECONDS, step="restore"):
+            restore_func(shadow_db)
+        _check_database(shadow_db)
+    except Exception:
+        _logger.error("restore failed, %s left untouched", conn.dbname)
+        _drop_database(shadow_db)
+        _remove_filestore(shadow_db)
+        raise
+
+    previous = _suffixed_name(conn.dbname, "_previous")
+    _drop_database(previous)
+    _remove_filestore(previous)
+    _release_lock(conn)
+    with metrics.timed(metrics.RESTORE_SECONDS, step="swap"):
+        _swap_database(conn.dbname, shadow_db, previous)
+        _swap_filestore(conn.dbname, shadow_db, previous)
+    _reestablish_lock(conn)
+    _logger.info("dropping previous database %s ...", previous)
+    _drop_database(previous)
+    _remove_filestore(previous)
+
+
+def _suffixed_name(db_name, suffix):
+    # database names are truncated to 63 bytes by postgres
+    return db_name[: 63 - len(suffix)] + suffix
+
+
+def _check_database(db_name):
+    """Sanity checks of a restored database before it goes live."""
+    db = odoo.sql_db.db_connect(db_name)
+    with closing(db.cursor()) as cr:
+        cr.execute(
+            """
+            SELECT latest_version FROM ir_module_module
+            WHERE name = 'base' AND state = 'installed';
+        """
+        )
+        r = cr.fetchone()
+        if not r:
+            raise Exception("No installed base module in %s" % db_name)
+        cr.execute("SELECT count(*) FROM res_users WHERE active;")
+        if not cr.fetchone()[0]:
+            raise Exception("No active user in %s" % db_name)
+    odoo.sql_db.close_db(db_name)
+    _logger.info(u"%s checked, base %s installed.", db_name, r[0])
+
+
+def _swap_database(db_name, shadow, previous, attempts=5):
+    """Rename `db_name` to `previous` and `shadow` to `db_name` at once.
+
+    Both renames run in the same transaction. Connections to the databases
+    are terminated first: a client connecting in between makes the renames
+    fail, in which case they are attempted again.
+    """
+    odoo.modules.registry.Registry.delete(db_name)
+    odoo.sql_db.close_db(db_name)
+    odoo.sql_db.close_db(shadow)
+
+    db = odoo.sql_db.db_connect("postgres")
+    with closing(db.cursor()) as cr:
+        for attempt in range(1, attempts + 1):
+            odoo.service.db._drop_conn(cr, db_name)
+            odoo.service.db._drop_conn(cr, shadow)
+            try:
+                cr.execute('ALTER DATABASE "%s" RENAME TO "%s"' % (db_name, previous))
+                cr.execute('ALTER DATABASE "%s" RENAME TO "%s"' % (shadow, db_name))
+                cr.commit()
+                break
+            except psycopg2.OperationalError as e:
+                cr.rollback()
+                if attempt == attempts:
+                    raise Exception("Couldn't swap database {}: {}".format(db_name, e))
+                time.sleep(attempt)
+    _logger.info("%s swapped with the restored database.", db_name)
+
+
+def _link_filestore(db_name, shadow):
+    """Start the filestore of `shadow` with the attachments of `db_name`."""
+    src = odoo.tools.config.filestore(db_name)
+    if os.path.isdir(src):
+        count = filestore.link_tree(src, odoo.tools.config.filestore(shadow))
+        _logger.info("%d attachments of %s linked into %s.", count, db_name, shadow)
+
+
+def _swap_filestore(db_name, shadow, previous):
+    """Move the filestore of `db_name` to `previous` and `shadow` to `db_name`."""
+    path = odoo.tools.config.filestore
+    if os.path.isdir(path(db_name)):
+        os.rename(path(db_name), path(previous))
+    if os.path.isdir(path(shadow)):
+        os.rename(path(shadow), path(db_name))
+
+
+def _remove_filestore(db_name):
+    path = odoo.tools.config.filestore(db_name)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+def _release_lock(conn):
     # Release lock and close cursor
     cli.LOCK.stop = True
     cli.LOCK.join()
     cli.LOCK_CR.close()
     odoo.sql_db.close_db(conn.dbname)
 
-    _drop_database(conn.dbname)
-    _restore_backup(conn.dbname, f)
 
+def _reestablish_lock(conn):
     # Reestablish lock and reset cursor
     cli.LOCK_CR = conn.cursor()
     cli.LOCK = cli.ApplicationLock(cli.LOCK_CR)
     cli.LOCK.start()
 
 
-def _get_backup(db, f):
+def _verify_archive(fname):
+    """Check the integrity of a downloaded archive before restoring it.
+
+    The CRCs of zip members and gzip streams are computed by the service,
+    which makes this an end-to-end check of the transfer.
+    """
+    try:
+        if zipfile.is_zipfile(fname):
+            with zipfile.ZipFile(fname) as z:
+                bad = z.testzip()
+            if bad:
+                raise CorruptedArchiveError("Bad CRC for %s in %s" % (bad, fname))
+            return
+        with open(fname, "rb") as f:
+            magic = f.read(2)
+        if magic == b"\x1f\x8b":
+            with gzip.open(fname, "rb") as f:
+                for _ in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+                    pass
+    except (zipfile.BadZipfile, IOError, EOFError, zlib.error) as e:
+        raise CorruptedArchiveError("Corrupted archive %s: %s" % (fname, e))
+
+
+def _pg_dump(db):
     cmd = ["pg_dump", "--no-privileges", "--no-owner", "--format=t", db]
     _, stdout = odoo.tools.exec_pg_command_pipe(*cmd)
-    shutil.copyfileobj(stdout, f)
+    return stdout
+
+
+def _get_backup(db, f):
+    shutil.copyfileobj(_pg_dump(db), f)
+
+
+def backup(db, fname, jobs):
+    """Dump `db` into a gzipped tar format dump, compressed by `jobs` threads.
+
+    The migration service only accepts tar (or custom) format dumps, which
+    `pg_dump --jobs` cannot write: the dump itself is sequential, only its
+    compression is spread over threads.
+    """
+    writer = archive.ParallelGzipWriter(open(fname, "wb"), jobs)
+    with closing(writer), closing(_pg_dump(db)) as stdout:
+        shutil.copyfileobj(stdout, writer, STREAM_CHUNK_SIZE)
+
+
+class BackupStream(object):
+    """Read-only file-like object over the gzipped dump of `db`.
+
+    `pg_dump` output is compressed by a background thread into a bounded
+    queue: at most `queue_size` chunks are held in memory and the dump is
+    throttled to the pace of the reader.
+    """
+
+    def __init__(self, db, queue_size=STREAM_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.chunk = b""
+        self.position = 0
+        self.error = None
+        self.closed = False
+        self.eof = False
+        self.thread = threading.Thread(target=self._produce, args=(db,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _put(self, data):
+        while not self.closed:
+            try:
+                self.queue.put(data, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _produce(self, db):
+        try:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            with closing(_pg_dump(db)) as stdout:
+                for data in iter(lambda: stdout.read(STREAM_CHUNK_SIZE), b""):
+                    if self.closed:
+                        return
+                    data = compressor.compress(data)
+                    if data:
+                        self._put(data)
+            self._put(compressor.flush())
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(None)
+
+    def read(self, size=-1):
+        if self.position >= len(self.chunk):
+            if self.eof:
+                return b""
+            self.chunk, self.position = self.queue.get(), 0
+            if self.chunk is None:
+                self.chunk, self.eof = b"", True
+                if self.error is not None:
+                    raise self.error
+                return b""
+        if size < 0:
+            size = len(self.chunk)
+        data = self.chunk[self.position : self.position + size]
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.closed = True
+        self.thread.join()
+
+
+def _sync_filestore(db, fname):
+    """Start extracting the filestore of zip `fname` in a background thread.
+
+        :return: a callable waiting for the extraction (and raising its error)
+    """
+    result = {}
+
+    def _sync():
+        try:
+            filestore_dest = odoo.tools.config.filestore(db)
+            with metrics.timed(metrics.RESTORE_SECONDS, step="filestore"):
+                filestore.sync_zip(
+                    fname, "filestore/", filestore_dest, FILESTORE_THREADS
+                )
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=_sync)
+    thread.start()
+
+    def wait():
+        thread.join()
+        if "error" in result:
+            raise result["error"]
+
+    return wait
 
 
 def _restore_backup(db, f):
@@ -297,35 +705,39 @@ def _restore_backup(db, f):
     with odoo.tools.osutil.tempdir() as dump_dir:
         if zipfile.is_zipfile(f):
             with zipfile.ZipFile(f, "r") as z:
-                # only extract known members!
-                filestore = [m for m in z.namelist() if m.startswith("filestore/")]
-                z.extractall(dump_dir, ["dump.sql"] + filestore)
+                wait_filestore = None
+                if any(m.startswith("filestore/") for m in z.namelist()):
+                    wait_filestore = _sync_filestore(db, f.name)
+                try:
+                    # dump.sql is streamed, not extracted
+                    with closing(z.open("dump.sql")) as dump:
+                        dump = pipeline.CountingReader(dump, metrics.RESTORE_BYTES.inc)
+                        restore.restore_sql(db, dump, dump_dir, RESTORE_JOBS)
+                finally:
+                    if wait_filestore:
+                        wait_filestore()
+        else:
+            restore.restore_archive(db, f, dump_dir, RESTORE_JOBS)
+    _create_unaccent(db)
 
-                if filestore:
-                    filestore_path = os.path.join(dump_dir, "filestore")
 
-            pg_cmd = "psql"
-            pg_args = ["-q", "-f", os.path.join(dump_dir, "dump.sql")]
-        else:
-            pg_cmd = "pg_restore"
-            pg_args = ["--no-owner", f]
-
-        args = []
-        args.append("--dbname=" + db)
-        pg_args = args + pg_args
-        if odoo.tools.exec_pg_command(pg_cmd, *pg_args):
-            raise Exception("Couldn't restore database")
-        conn = odoo.sql_db.db_connect(db)
-        with closing(conn.cursor()) as cr:
-            if filestore_path:
-                filestore_dest = odoo.tools.config.filestore(db)
-                copytree(filestore_path, filestore_dest)
-            if odoo.tools.config["unaccent"]:
-                try:
-                    with cr.savepoint():
-                        cr.execute("CREATE EXTENSION unaccent")
-                except psycopg2.Error:
-                    pass
+def _restore_stream(db, stream):
+    odoo.service.db._create_empty_database(db)
+    with odoo.tools.osutil.tempdir() as dump_dir:
+        stream = pipeline.CountingReader(stream, metrics.RESTORE_BYTES.inc)
+        restore.restore_stream(db, stream, dump_dir, RESTORE_JOBS)
+    _create_unaccent(db)
+
+
+def _create_unaccent(db):
+    conn = odoo.sql_db.db_connect(db)
+    with closing(conn.cursor()) as cr:
+        if odoo.tools.config["unaccent"]:
+            try:
+                with cr.savepoint():
+                    cr.execute("CREATE EXTENSION unaccent")
+            except psycopg2.Error:
+                pass
 
 
 def _drop_database(db_name):
@@ -22,3 +22,15 @@ class NotUploadedError(Error):
 
 class NotReadyError(Error):
     pass
+
+
+class ResumeError(Error):
+    """Exception raised when a transfer cannot resume where it stopped."""
+
+    pass
+
+
+class CorruptedArchiveError(Error):
+    """Exception raised when a downloaded archive fails its integrity check."""
+
+    pass
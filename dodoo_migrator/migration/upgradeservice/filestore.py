@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 XOE Corp. SAS
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+"""Concurrent synchronization of filestores.
+
+Attachments are stored under the sha1 of their content: a destination
+file with the same size and a matching checksum is kept as is.
+"""
+
+import errno
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+_logger = logging.getLogger(__name__)
+
+SHA1 = re.compile(r"^[0-9a-f]{40}$")
+
+
+def _sha1(path):
+    checksum = hashlib.sha1()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(1024 * 1024), b""):
+            checksum.update(data)
+    return checksum.hexdigest()
+
+
+def is_current(path, size):
+    """Whether `path` already holds the `size` bytes content it is named after.
+
+    Files not named after a sha1 are never considered current.
+    """
+    try:
+        if os.stat(path).st_size != size:
+            return False
+    except OSError:
+        return False
+    name = os.path.basename(path)
+    return bool(SHA1.match(name)) and _sha1(path) == name
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def link_tree(src, dest):
+    """Populate `dest` with hard links to the files of `src`.
+
+    `sync_zip` replaces files by renaming new ones into place, never writes
+    into them: both trees keep sharing the unchanged files only. Files are
+    copied where they cannot be linked.
+
+        :return: the number of files
+    """
+    count = 0
+    for root, _, files in os.walk(src):
+        target = os.path.join(dest, os.path.relpath(root, src))
+        _makedirs(target)
+        for name in files:
+            try:
+                os.link(os.path.join(root, name), os.path.join(target, name))
+            except OSError:
+                shutil.copy2(os.path.join(root, name), os.path.join(target, name))
+            count += 1
+    return count
+
+
+def _run(func, items, threads):
+    pool = ThreadPool(threads)
+    try:
+        stats = {}
+        for result in pool.imap_unordered(func, items):
+            stats[result] = stats.get(result, 0) + 1
+    finally:
+        pool.close()
+        pool.join()
+    _logger.info(
+        "filestore synchronized: %s",
+        ", ".join("%d %s" % (count, key) for key, count in sorted(stats.items())),
+    )
+    return stats
+
+
+def sync_zip(fname, prefix, dest, threads):
+    """Extract the members of zip `fname` under `prefix` right into `dest`.
+
+    Every thread reads the archive through its own handle. Members are
+    extracted next to their destination and renamed into place.
+
+        :return: {"extracted": n, "skipped": n}
+    """
+    local = threading.local()
+    handles = []
+
+    def _extract(info):
+        relpath = os.path.normpath(info.filename[len(prefix) :])
+        # only extract known members!
+        if os.path.isabs(relpath) or relpath.split(os.sep)[0] == os.pardir:
+            raise ValueError("Unsafe zip member %s" % info.filename)
+        path = os.path.join(dest, relpath)
+        if is_current(path, info.file_size):
+            return "skipped"
+        if not hasattr(local, "zip"):
+            local.zip = zipfile.ZipFile(fname, "r")
+            handles.append(local.zip)
+        _makedirs(os.path.dirname(path))
+        tmp = "%s.%d.tmp" % (path, threading.current_thread().ident)
+        with local.zip.open(info) as src, open(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.rename(tmp, path)
+        return "extracted"
+
+    with zipfile.ZipFile(fname, "r") as z:
+        members = [
+            info
+            for info in z.infolist()
+            if info.filename.startswith(prefix) and not info.filename.endswith("/")
+        ]
+    try:
+        return _run(_extract, members, threads)
+    finally:
+        for handle in handles:
+            handle.close()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 XOE Corp. SAS
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+_logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 8 * 1024 * 1024
+
+
+class TransferManifest(object):
+    """Block checksums of a (partially) transferred file.
+
+    The manifest lives in an append-only sidecar file next to the local
+    file: a json header describing the transfer, then one
+    `<block> <sha256>` line per block transferred without error. The sha256
+    is computed locally from the bytes received (or sent): the remote end
+    does not confirm it. It survives the process, so that a later run only
+    transfers the blocks which are missing or whose local data no longer
+    matches; the transfer itself is checked by the CRCs of the archive.
+
+    The header identifies the request and the remote end of the transfer:
+    the manifest of another transfer of the same local file is discarded.
+    """
+
+    def __init__(self, localpath, header=None):
+        self.localpath = localpath
+        self.path = localpath + ".manifest"
+        self.header = header
+        self.block_size = header["block_size"] if header else BLOCK_SIZE
+        self.blocks = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, localpath, header):
+        """Return the manifest of the same transfer or None."""
+        manifest = cls(localpath, header)
+        if not os.path.exists(manifest.path):
+            return None
+        with open(manifest.path) as f:
+            try:
+                if json.loads(f.readline()) != header:
+                    return None
+            except ValueError:
+                return None
+            for line in f:
+                try:
+                    index, digest = line.split()
+                    manifest.blocks[int(index)] = digest
+                except ValueError:
+                    # incomplete last line of an interrupted run
+                    continue
+        return manifest
+
+    @classmethod
+    def create(cls, localpath, header):
+        manifest = cls(localpath, header)
+        with open(manifest.path, "w") as f:
+            f.write(json.dumps(header, sort_keys=True) + "\n")
+        return manifest
+
+    @property
+    def block_count(self):
+        return -(-self.header["size"] // self.block_size)
+
+    def block_range(self, index):
+        start = index * self.block_size
+        return start, min(start + self.block_size, self.header["size"])
+
+    def missing(self):
+        return [i for i in range(self.block_count) if i not in self.blocks]
+
+    def record(self, index, digest):
+        with self._lock:
+            self.blocks[index] = digest
+            with open(self.path, "a") as f:
+                f.write("{} {}\n".format(index, digest))
+
+    def verify(self):
+        """Check the recorded blocks against the local file.
+
+        Blocks not matching anymore are forgotten, to be transferred again.
+
+            :return: indexes of the corrupted blocks
+        """
+        corrupted = []
+        with open(self.localpath, "rb") as f:
+            for index in sorted(self.blocks):
+                start, end = self.block_range(index)
+                f.seek(start)
+                digest = hashlib.sha256(f.read(end - start)).hexdigest()
+                if digest != self.blocks[index]:
+                    corrupted.append(index)
+        if corrupted:
+            _logger.warning(
+                "%d corrupted blocks in %s, transferring them again",
+                len(corrupted),
+                self.localpath,
+            )
+            with self._lock:
+                for index in corrupted:
+                    del self.blocks[index]
+                # rewrite the sidecar without the corrupted blocks
+                with open(self.path, "w") as f:
+                    f.write(json.dumps(self.header, sort_keys=True) + "\n")
+                    for index in sorted(self.blocks):
+                        f.write("{} {}\n".format(index, self.blocks[index]))
+        return corrupted
+
+    def unlink(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -3,14 +3,28 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
 import base64
+import hashlib
 import logging
+import os
+import time
+from collections import deque
+from multiprocessing.pool import ThreadPool
 
 import paramiko
 import pysftp
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 from retrying import retry
 
-from .errors import NotReadyError, NotUploadedError, OdooUpgradeServiceError
+from ... import metrics
+from .errors import (
+    NotReadyError,
+    NotUploadedError,
+    OdooUpgradeServiceError,
+    ResumeError,
+)
+from .manifest import BLOCK_SIZE, TransferManifest
 
 try:
     from StringIO import StringIO
@@ -27,10 +41,24 @@ _logger = logging.getLogger(BOLD + u"ODOO UPGRADE SERVICE" + RESET)
 
 
 HOSTNAME = "upgrade.odoo.com"
-CREATE_URL = "https://{}/database/v1/create".format(HOSTNAME)
-UPLOAD_URL_SFTP = "https://{}/database/v1/request_sftp_access".format(HOSTNAME)
-PROCESS_URL = "https://{}/database/v1/process".format(HOSTNAME)
-STATUS_URL = "https://{}/database/v1/status".format(HOSTNAME)
+API_URL = os.getenv("DODOO_MIGRATOR_UPGRADE_API_URL") or (
+    "https://{}/database/v1".format(HOSTNAME)
+)
+CREATE_URL = "/create"
+UPLOAD_URL_SFTP = "/request_sftp_access"
+PROCESS_URL = "/process"
+STATUS_URL = "/status"
+
+# (connect, read) timeouts of the REST calls, in seconds
+TIMEOUT = (10, 60)
+# attempts of REST calls failing on connection errors or 5xx responses; a
+# call timing out once sent is never retried, it might have been processed
+RETRIES = 5
+# calls not retried on 5xx responses either, which might come once processed
+NON_IDEMPOTENT_URLS = (CREATE_URL, PROCESS_URL)
+RETRY_BACKOFF = 1
+# seconds a fetched status is reused for
+STATUS_TTL = 10
 
 HOSTKEY = (
     "upgrade.odoo.com",
@@ -44,6 +72,57 @@ HOSTKEY = (
 )
 
 
+class ReplayBuffer(object):
+    """Retain the last `window` bytes read from a non seekable stream."""
+
+    def __init__(self, window):
+        self.window = window
+        self.chunks = deque()
+        self.start = 0
+        self.end = 0
+
+    def append(self, data):
+        self.chunks.append(data)
+        self.end += len(data)
+        # drop the oldest chunks not needed to cover `window` bytes
+        while self.end - self.start - len(self.chunks[0]) >= self.window:
+            self.start += len(self.chunks.popleft())
+
+    def since(self, offset):
+        """Yield the retained data from `offset` on."""
+        if not self.start <= offset <= self.end:
+            raise ResumeError(
+                "Cannot resume at offset {} (retained: {} - {})".format(
+                    offset, self.start, self.end
+                )
+            )
+        position = self.start
+        for data in list(self.chunks):
+            if position + len(data) > offset:
+                yield data[max(offset - position, 0) :]
+            position += len(data)
+
+
+def _session(status_forcelist=(500, 502, 503, 504)):
+    """Return a pooled `requests.Session` retrying failed calls with backoff.
+
+    Calls are retried on connection errors, and on the responses of
+    `status_forcelist`.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        max_retries=Retry(
+            total=RETRIES,
+            read=False,
+            backoff_factor=RETRY_BACKOFF,
+            status_forcelist=status_forcelist,
+        )
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 class UpgradeApi(object):
     def __init__(self, name, aim, target, contract, email, public_key, private_key):
         self.name = name
@@ -65,6 +144,11 @@ class UpgradeApi(object):
         self._process = None
         self._submitted = None
         self._ready = None
+        self._status = None
+        self._status_time = 0
+        self.api_url = API_URL
+        self.session = _session()
+        self.non_idempotent_session = _session(status_forcelist=())
 
     def __repr__(self):
         return "{}({!r})".format(self.__class__, self.name)
@@ -129,10 +213,7 @@ class UpgradeApi(object):
             "contract": self.contract,
             "target": self.target,
         }
-        r = requests.get(CREATE_URL, params=payload).json()
-        if r.get("failures"):
-            raise OdooUpgradeServiceError(r.get("failures"))
-        self._request = r.get("request")
+        self._request = self._call("GET", CREATE_URL, params=payload)
         self._request_id = self._request.get("id")
         self._key = self._request.get("key")
 
@@ -141,10 +222,9 @@ class UpgradeApi(object):
             return
         payload = {"request": self.request_id, "key": self.key}
         data = {"ssh_keys": self.public_key}
-        r = requests.post(UPLOAD_URL_SFTP, params=payload, data=data).json()
-        if r.get("failures"):
-            raise OdooUpgradeServiceError(r.get("failures"))
-        self._request_sftp_access = r.get("request")
+        self._request_sftp_access = self._call(
+            "POST", UPLOAD_URL_SFTP, params=payload, data=data
+        )
         self._hostname = self._request_sftp_access.get("hostname")
         self._sftp_port = self._request_sftp_access.get("sftp_port")
         self._sftp_user = self._request_sftp_access.get("sftp_user")
@@ -174,10 +254,62 @@ class UpgradeApi(object):
                         data = fl.read(32768)
                         fr.write(data)
                         state["offset"] += len(data)
+                        metrics.TRANSFER_BYTES.labels("upload").inc(len(data))
                         if len(data) == 0:
                             break
 
+        start = time.time()
         _upload()
+        metrics.record_transfer("upload", state["offset"], start)
+        self._submitted = True
+
+    def upload_stream(self, stream, window=64 * 1024 * 1024):
+        """Upload from a non seekable `stream` (e.g. a pipe).
+
+        The last `window` bytes are retained in memory: after a reconnect,
+        the upload resumes at the size the remote file actually reached.
+        """
+        remotepath = self.filename
+        cinfo = self._cinfo()
+        state = {"offset": 0, "retries": 0}
+        sent = ReplayBuffer(window)
+
+        @retry(
+            stop_max_attempt_number=10,
+            wait_exponential_multiplier=1000,
+            wait_exponential_max=30000,
+            retry_on_exception=lambda e: not isinstance(e, ResumeError),
+        )
+        def _upload():
+            with pysftp.Connection(**cinfo) as sftp:
+                if state["retries"]:
+                    state["offset"] = (
+                        sftp.stat(remotepath).st_size if sftp.exists(remotepath) else 0
+                    )
+                _logger.info(
+                    "Stream upload from offset %s (retry: %d / 10)",
+                    state["offset"],
+                    state["retries"],
+                )
+                replay = sent.since(state["offset"])
+                state["retries"] += 1
+                with sftp.open(remotepath, "a" if state["offset"] else "w") as fr:
+                    fr.set_pipelined(True)
+                    for data in replay:
+                        fr.write(data)
+                        state["offset"] += len(data)
+                    while True:
+                        data = stream.read(32768)
+                        if len(data) == 0:
+                            break
+                        sent.append(data)
+                        fr.write(data)
+                        state["offset"] += len(data)
+                        metrics.TRANSFER_BYTES.labels("upload").inc(len(data))
+
+        start = time.time()
+        _upload()
+        metrics.record_transfer("upload", state["offset"], start)
         self._submitted = True
 
     def process(self):
@@ -186,17 +318,18 @@ class UpgradeApi(object):
         if not self._submitted:
             raise NotUploadedError
         payload = {"request": self.request_id, "key": self.key}
-        r = requests.get(PROCESS_URL, params=payload).json()
-        if r.get("failures"):
-            raise OdooUpgradeServiceError(r.get("failures"))
+        self._call("GET", PROCESS_URL, params=payload)
         self._process = True
+        self._status = None
 
-    def status(self):
+    def status(self, max_age=STATUS_TTL):
+        """Return the status of the request, fetched at most `max_age` ago."""
+        if self._status is not None and time.time() - self._status_time < max_age:
+            return self._status
         payload = {"request": self.request_id, "key": self.key}
-        r = requests.get(STATUS_URL, params=payload).json()
-        if r.get("failures"):
-            raise OdooUpgradeServiceError(r.get("failures"))
-        return r.get("request")
+        self._status = self._call("GET", STATUS_URL, params=payload)
+        self._status_time = time.time()
+        return self._status
 
     def is_ready(self):
         return self.status().get("state") == "done"
@@ -233,10 +366,171 @@ class UpgradeApi(object):
                         data = fr.read(32768)
                         fl.write(data)
                         state["offset"] += len(data)
+                        metrics.TRANSFER_BYTES.labels("download").inc(len(data))
                         if len(data) == 0:
                             break
 
+        start = time.time()
         _download()
+        metrics.record_transfer("download", state["offset"], start)
+
+    def upload_segmented(self, localpath, segments, save_state=None):
+        """Upload `localpath` over `segments` concurrent SFTP connections.
+
+        See `_transfer_segmented` for `save_state`.
+        """
+        self._transfer_segmented(
+            "upload", localpath, self.filename, segments, save_state
+        )
+        self._submitted = True
+
+    def download_segmented(self, localpath, segments, save_state=None):
+        """Download into `localpath` over `segments` concurrent SFTP connections.
+
+        See `_transfer_segmented` for `save_state`.
+        """
+        if not self.is_ready():
+            raise NotReadyError
+        self.request_sftp_access()
+        self._transfer_segmented(
+            "download", localpath, self.upgraded_filename, segments, save_state
+        )
+
+    def _transfer_segmented(
+        self, direction, localpath, remotepath, segments, save_state
+    ):
+        """Transfer the blocks of a file concurrently.
+
+        Progress is tracked by the `TransferManifest` of `localpath`: the
+        blocks of an interrupted transfer of the same file are verified
+        against their checksums and only the missing ones are transferred.
+
+            :param save_state: callable receiving the (json serializable)
+                               description of the transfer before it starts
+        """
+        cinfo = self._cinfo()
+        with pysftp.Connection(**cinfo) as sftp:
+            if direction == "upload":
+                size = os.path.getsize(localpath)
+            else:
+                size = sftp.stat(remotepath).st_size
+
+            header = {
+                "request": self.request_id,
+                "remote": "{username}@{host}:{port}".format(**cinfo),
+                "direction": direction,
+                "localpath": localpath,
+                "remotepath": remotepath,
+                "size": size,
+                "block_size": BLOCK_SIZE,
+            }
+            manifest = TransferManifest.load(localpath, header)
+            if manifest is None or not os.path.exists(localpath):
+                manifest = TransferManifest.create(localpath, header)
+                # (re)create the destination, holes are filled by the segments
+                if direction == "upload":
+                    sftp.open(remotepath, "w").close()
+                else:
+                    with open(localpath, "wb") as fl:
+                        fl.truncate(size)
+            else:
+                manifest.verify()
+        if save_state:
+            save_state(header)
+
+        missing = manifest.missing()
+        _logger.info(
+            "%s %d / %d blocks over %d segments",
+            direction.capitalize(),
+            len(missing),
+            manifest.block_count,
+            segments,
+        )
+        step = -(-len(missing) // max(segments, 1))
+        runs = [missing[i : i + step] for i in range(0, len(missing), step or 1)]
+
+        def _transfer(blocks):
+            self._transfer_blocks(
+                cinfo, direction, localpath, remotepath, manifest, blocks
+            )
+
+        if runs:
+            start = time.time()
+            pool = ThreadPool(len(runs))
+            try:
+                pool.map(_transfer, runs)
+            finally:
+                pool.close()
+                pool.join()
+            size = sum(end - begin for begin, end in map(manifest.block_range, missing))
+            metrics.record_transfer(direction, size, start)
+
+    def _transfer_blocks(
+        self, cinfo, direction, localpath, remotepath, manifest, blocks
+    ):
+        state = {"retries": 0}
+
+        @retry(
+            stop_max_attempt_number=10,
+            wait_exponential_multiplier=1000,
+            wait_exponential_max=30000,
+        )
+        def _transfer():
+            with pysftp.Connection(**cinfo) as sftp:
+                pending = [i for i in blocks if i not in manifest.blocks]
+                _logger.debug(
+                    "%s %d blocks (retry: %d / 10)",
+                    direction.capitalize(),
+                    len(pending),
+                    state["retries"],
+                )
+                state["retries"] += 1
+                for index in pending:
+                    start, end = manifest.block_range(index)
+                    if direction == "upload":
+                        src = open(localpath, "rb")
+                        dst = sftp.open(remotepath, "r+")
+                        dst.set_pipelined(True)
+                    else:
+                        src = sftp.open(remotepath, "r")
+                        dst = open(localpath, "r+b")
+                    checksum = hashlib.sha256()
+                    # the block is only recorded once its handles are closed,
+                    # i.e. all pipelined writes have been acknowledged
+                    with src, dst:
+                        src.seek(start)
+                        dst.seek(start)
+                        if direction == "download":
+                            src.prefetch(end)
+                        offset = start
+                        while offset < end:
+                            data = src.read(min(32768, end - offset))
+                            if not data:
+                                raise IOError("Unexpected end of %s" % remotepath)
+                            dst.write(data)
+                            checksum.update(data)
+                            offset += len(data)
+                            metrics.TRANSFER_BYTES.labels(direction).inc(len(data))
+                    manifest.record(index, checksum.hexdigest())
+
+        start = time.time()
+        _transfer()
+        _logger.debug("%d blocks done in %.1fs", len(blocks), time.time() - start)
+
+    def _call(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", TIMEOUT)
+        if url in NON_IDEMPOTENT_URLS:
+            response = self.non_idempotent_session.request(
+                method, self.api_url + url, **kwargs
+            )
+            if response.status_code >= 500:
+                response.raise_for_status()
+        else:
+            response = self.session.request(method, self.api_url + url, **kwargs)
+        r = response.json()
+        if r.get("failures"):
+            raise OdooUpgradeServiceError(r.get("failures"))
+        return r.get("request")
 
     def _cinfo(self):
         cnopts = pysftp.CnOpts()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 XOE Corp. SAS
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+"""File-like plumbing to pipe a download into a restore."""
+
+import threading
+import zlib
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+
+class BoundedPipe(object):
+    """In-memory pipe between a writer thread and a reader thread.
+
+    At most `maxsize` written chunks are buffered: the writer blocks until
+    the reader catches up. An error of the writer is raised to the reader,
+    and the writer fails once the reader gave up.
+    """
+
+    def __init__(self, maxsize=64):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.chunk = b""
+        self.position = 0
+        self.error = None
+        self.eof = False
+        self.abandoned = False
+
+    # writer side
+
+    def _put(self, data):
+        while not self.abandoned:
+            try:
+                self.queue.put(data, timeout=1)
+                return
+            except queue.Full:
+                continue
+        if data is not None:
+            raise IOError("Reader of the pipe is gone")
+
+    def write(self, data):
+        if data:
+            self._put(data)
+
+    def close(self, error=None):
+        self.error = error
+        self._put(None)
+
+    # reader side
+
+    def read(self, size=-1):
+        if self.position >= len(self.chunk):
+            if self.eof:
+                return b""
+            self.chunk, self.position = self.queue.get(), 0
+            if self.chunk is None:
+                self.chunk, self.eof = b"", True
+                if self.error is not None:
+                    raise self.error
+                return b""
+        if size < 0:
+            size = len(self.chunk)
+        data = self.chunk[self.position : self.position + size]
+        self.position += len(data)
+        return data
+
+    def abandon(self):
+        """Stop reading: the writer fails on its next write."""
+        self.abandoned = True
+
+
+def pipe_from(func, maxsize=64):
+    """Run `func(pipe)` in a thread writing into a new `BoundedPipe`.
+
+    The pipe is closed when `func` returns, with its error if any.
+    """
+    pipe = BoundedPipe(maxsize)
+
+    def _run():
+        try:
+            func(pipe)
+        except Exception as e:
+            pipe.close(e)
+        else:
+            pipe.close()
+
+    thread = threading.Thread(target=_run)
+    thread.daemon = True
+    thread.start()
+    return pipe
+
+
+class PeekableReader(object):
+    """Reader allowing to look at the first bytes of `stream`."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.head = b""
+
+    def peek(self, size):
+        while len(self.head) < size:
+            data = self.stream.read(size - len(self.head))
+            if not data:
+                break
+            self.head += data
+        return self.head[:size]
+
+    def read(self, size=-1):
+        if self.head:
+            data = self.head if size < 0 else self.head[:size]
+            self.head = self.head[len(data) :]
+            return data
+        return self.stream.read(size)
+
+
+class CountingReader(object):
+    """Reader calling `callback(size)` with the size of each read of `stream`."""
+
+    def __init__(self, stream, callback):
+        self.stream = stream
+        self.callback = callback
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.callback(len(data))
+        return data
+
+
+class GunzipReader(object):
+    """Reader decompressing a gzip `stream` (possibly of several members)."""
+
+    def __init__(self, stream, chunk_size=1024 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.chunk = b""
+        self.position = 0
+        self.eof = False
+
+    def _decompress(self):
+        data = self.stream.read(self.chunk_size)
+        if not data:
+            if not self.decompressor.eof:
+                raise EOFError("Truncated gzip stream")
+            self.eof = True
+            return self.decompressor.flush()
+        result = self.decompressor.decompress(data)
+        while self.decompressor.eof and self.decompressor.unused_data:
+            # next gzip member
+            data = self.decompressor.unused_data
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            result += self.decompressor.decompress(data)
+        return result
+
+    def read(self, size=-1):
+        while self.position >= len(self.chunk):
+            if self.eof:
+                return b""
+            self.chunk, self.position = self._decompress(), 0
+        if size < 0:
+            size = len(self.chunk)
+        data = self.chunk[self.position : self.position + size]
+        self.position += len(data)
+        return data
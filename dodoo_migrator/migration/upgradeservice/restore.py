@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 XOE Corp. SAS
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+"""Parallel restore of the dumps returned by the upgrade service."""
+from __future__ import absolute_import
+
+import logging
+import os
+import re
+import subprocess
+import tarfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+import odoo
+
+from .pipeline import GunzipReader, PeekableReader
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+_logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+# members of a directory format dump
+DUMP_MEMBER = re.compile(r"^(toc\.dat|\d+\.dat(\.gz)?|blobs\.toc|blob_\d+\.dat)$")
+
+# TOC entry headers of a plain SQL dump
+ENTRY_HEADER = re.compile(
+    r"^-- (?:Data for )?Name: .*; Type: (?P<type>[A-Z ]+); Schema: [^;]*; Owner: "
+)
+DATA_TYPES = ("TABLE DATA", "SEQUENCE SET", "BLOBS")
+# post-data entries which can be restored concurrently
+PARALLEL_POST_TYPES = ("INDEX", "CONSTRAINT")
+
+# archive format of a dump, as stored in the header of its toc.dat
+# ("PGDMP", version (3), int size, offset size, format)
+FORMAT_OFFSET = 10
+ARCH_CUSTOM = b"\x01"
+ARCH_TAR = b"\x03"
+ARCH_DIRECTORY = b"\x05"
+
+
+def restore_directory(db, path, jobs):
+    """Restore a directory (or custom) format dump with `jobs` connections."""
+    _logger.info("pg_restore (%d jobs) ...", jobs)
+    args = ["--no-owner", "--dbname=" + db, "--jobs=%d" % jobs, path]
+    if odoo.tools.exec_pg_command("pg_restore", *args):
+        raise Exception("Couldn't restore database")
+
+
+def restore_archive(db, f, dump_dir, jobs):
+    """Restore the dump held by the (seekable) file `f`.
+
+    A custom format dump is restored by `pg_restore` with `jobs`
+    connections, which it supports on a file; anything else is restored as
+    by `restore_stream`.
+    """
+    f.seek(0)
+    head = f.read(FORMAT_OFFSET + 1)
+    f.seek(0)
+    if head.startswith(b"PGDMP") and head[FORMAT_OFFSET:] == ARCH_CUSTOM:
+        restore_directory(db, f.name, jobs)
+    else:
+        restore_stream(db, f, dump_dir, jobs)
+
+
+def _run_sql(db, path):
+    args = ["--dbname=" + db, "-q", "-f", path]
+    if odoo.tools.exec_pg_command("psql", *args):
+        raise Exception("Couldn't restore database")
+
+
+class PgSession(object):
+    """A `psql` or `pg_restore` process fed from a bounded queue by a thread."""
+
+    def __init__(self, db, tool="psql", args=("-q",), queue_size=16):
+        self.tool = tool
+        cmd = [odoo.tools.misc.find_pg_tool(tool), "--dbname=" + db] + list(args)
+        with open(os.devnull, "wb") as devnull:
+            self.process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=devnull,
+                stderr=subprocess.STDOUT,
+                env=odoo.tools.misc.exec_pg_environ(),
+            )
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._feed)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _feed(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if self.error is None:
+                try:
+                    self.process.stdin.write(data)
+                except (IOError, OSError) as e:
+                    # keep draining the queue, the error is raised on close
+                    self.error = e
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError) as e:
+            self.error = self.error or e
+
+    def write(self, data):
+        self.queue.put(data)
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.process.wait() or self.error:
+            raise Exception("Couldn't restore database: %s" % (self.error or self.tool))
+
+
+def iter_sql_dump(stream, chunk_size=CHUNK_SIZE):
+    """Iterate over a plain SQL dump without splitting its `COPY` data.
+
+        :return: iterator of (is_line, data), `COPY` data being yielded by
+                 chunks as is and everything else line by line
+    """
+    buf, pos, in_copy, copy_start, eof = b"", 0, False, False, False
+    while True:
+        if in_copy and copy_start and len(buf) - pos < 3 and not eof:
+            # the terminator of a COPY without rows might not be read yet
+            pass
+        elif in_copy:
+            end = -1
+            if copy_start and buf.startswith(b"\\.\n", pos):
+                # no rows
+                end = pos + 3
+            else:
+                end = buf.find(b"\n\\.\n", pos)
+                end = end + 4 if end >= 0 else -1
+            copy_start = False
+            if end >= 0:
+                yield False, buf[pos:end]
+                pos, in_copy = end, False
+                continue
+            if len(buf) - pos > 3:
+                # keep the tail, the terminator might straddle chunks
+                yield False, buf[pos:-3]
+                pos = len(buf) - 3
+        else:
+            end = buf.find(b"\n", pos)
+            if end >= 0:
+                line = buf[pos : end + 1]
+                pos = end + 1
+                yield True, line
+                if line.startswith(b"COPY ") and line.endswith(b"FROM stdin;\n"):
+                    in_copy = copy_start = True
+                continue
+        if eof:
+            if pos < len(buf):
+                yield not in_copy, buf[pos:]
+            return
+        data = stream.read(chunk_size)
+        eof = not data
+        buf, pos = buf[pos:] + data, 0
+
+
+class SqlDumpRestore(object):
+    """Restore a plain SQL dump while reading it, with `jobs` sessions.
+
+    The schema is created first, then the tables are loaded by concurrent
+    `psql` sessions which the dump is streamed into, then the indexes and
+    constraints are built concurrently, and finally the rest (foreign keys,
+    triggers, ...) is restored. Only the pre and post-data sections, which
+    hold no data, are written into `dump_dir`.
+    """
+
+    def __init__(self, db, dump_dir, jobs):
+        self.db = db
+        self.dump_dir = dump_dir
+        self.jobs = jobs
+        self.section = "preamble"
+        self.preamble = []
+        self.pre = open(os.path.join(dump_dir, "pre-data.sql"), "wb")
+        self.post = open(os.path.join(dump_dir, "post-data.sql"), "wb")
+        self.sessions = []
+        self.parallel_post = []
+        self.out = self.pre
+
+    def _start_data(self):
+        self.pre.close()
+        _logger.info("restoring schema ...")
+        _run_sql(self.db, self.pre.name)
+        _logger.info("restoring data (%d jobs) ...", self.jobs)
+        self.sessions = [PgSession(self.db) for _ in range(self.jobs)]
+        for session in self.sessions:
+            session.write(b"".join(self.preamble))
+
+    def _enter(self, kind):
+        """Direct the output to the destination of an entry of type `kind`."""
+        # pg_dump sorts the entries by section
+        if kind in DATA_TYPES and self.section != "post":
+            if self.section != "data":
+                self._start_data()
+            self.section = "data"
+            # the least busy session gets the next table
+            self.out = min(self.sessions, key=lambda session: session.pending())
+        elif self.section in ("data", "post"):
+            self.section = "post"
+            if self.out not in (self.pre, self.post) + tuple(self.sessions):
+                self.out.close()
+            if kind in PARALLEL_POST_TYPES:
+                path = os.path.join(
+                    self.dump_dir, "post-%d.sql" % len(self.parallel_post)
+                )
+                self.parallel_post.append(path)
+                self.out = open(path, "wb")
+                self.out.write(b"".join(self.preamble))
+            else:
+                self.out = self.post
+        else:
+            self.section = "pre"
+
+    def feed(self, stream):
+        for is_line, data in iter_sql_dump(stream):
+            if is_line and data.startswith(b"-- "):
+                match = ENTRY_HEADER.match(data.decode("utf-8", "replace"))
+                if match:
+                    self._enter(match.group("type"))
+            if self.section == "preamble":
+                self.preamble.append(data)
+            self.out.write(data)
+
+    def close(self):
+        """Wait for the data sessions and restore the post-data sections."""
+        for f in (self.out, self.pre, self.post):
+            if f is not None and f not in self.sessions:
+                f.close()
+        try:
+            for session in self.sessions:
+                session.close()
+        finally:
+            self.sessions, self.out = [], None
+
+    def finish(self):
+        if self.section in ("preamble", "pre"):
+            # no data at all
+            _run_sql(self.db, self.pre.name)
+        self.parallel_post.sort(key=os.path.getsize, reverse=True)
+        pool = ThreadPool(self.jobs)
+        try:
+            _logger.info(
+                "building %d indexes (%d jobs) ...", len(self.parallel_post), self.jobs
+            )
+            for _ in pool.imap_unordered(
+                lambda p: _run_sql(self.db, p), self.parallel_post
+            ):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+        _logger.info("restoring constraints ...")
+        _run_sql(self.db, self.post.name)
+
+
+def restore_sql(db, stream, dump_dir, jobs):
+    """Restore a plain SQL dump streamed from `stream` (see `SqlDumpRestore`)."""
+    if jobs <= 1:
+        session = PgSession(db)
+        try:
+            for data in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                session.write(data)
+        finally:
+            session.close()
+        return
+    restore = SqlDumpRestore(db, dump_dir, jobs)
+    try:
+        restore.feed(stream)
+    finally:
+        restore.close()
+    restore.finish()
+
+
+def _is_tar(head):
+    return head[257:262] == b"ustar"
+
+
+def _extract_tar_stream(stream, path):
+    with tarfile.open(fileobj=stream, mode="r|") as tar:
+        for member in tar:
+            # only extract known members!
+            if DUMP_MEMBER.match(member.name):
+                tar.extract(member, path)
+
+
+def restore_stream(db, stream, dump_dir, jobs):
+    """Restore a dump while it is read from the non seekable `stream`.
+
+    The (possibly gzipped) dump is restored as it arrives:
+
+    - a tar or custom format dump is piped into `pg_restore`, which cannot
+      use `--jobs` on its standard input;
+    - the tarball of a directory format dump (whose `toc.dat` comes first)
+      is extracted into `dump_dir` while reading, then restored with `jobs`
+      connections;
+    - a plain SQL dump is split over `jobs` sessions (see `SqlDumpRestore`).
+    """
+    stream = PeekableReader(stream)
+    if stream.peek(2) == b"\x1f\x8b":
+        stream = PeekableReader(GunzipReader(stream))
+    head = stream.peek(tarfile.BLOCKSIZE + FORMAT_OFFSET + 1)
+    if head.startswith(b"PGDMP"):
+        _pipe_pg_restore(db, stream, "--format=c")
+    elif _is_tar(head):
+        toc = head[tarfile.BLOCKSIZE :]
+        if not toc.startswith(b"PGDMP"):
+            raise Exception("Couldn't restore database: unknown tar archive")
+        archive_format = toc[FORMAT_OFFSET : FORMAT_OFFSET + 1]
+        if archive_format == ARCH_TAR:
+            _pipe_pg_restore(db, stream, "--format=t")
+        elif archive_format == ARCH_DIRECTORY:
+            path = os.path.join(dump_dir, "dump")
+            _extract_tar_stream(stream, path)
+            restore_directory(db, path, jobs)
+        else:
+            raise Exception("Couldn't restore database: unknown tar archive")
+    else:
+        restore_sql(db, stream, dump_dir, jobs)
+
+
+def _pipe_pg_restore(db, stream, archive_format):
+    _logger.info("pg_restore (streamed) ...")
+    session = PgSession(db, "pg_restore", ["--no-owner", archive_format])
+    try:
+        for data in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            session.write(data)
+    finally:
+        session.close()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 XOE Corp. SAS
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+"""Polling of the upgrade service until a request is processed."""
+
+import logging
+import time
+
+import requests
+
+from ... import metrics
+from .errors import OdooUpgradeServiceError
+
+_logger = logging.getLogger(__name__)
+
+DONE_STATES = ("done",)
+FAILED_STATES = ("failed", "cancelled")
+
+
+def backoff(interval, max_interval, factor=2):
+    """Yield the delays between polls: `interval` growing up to `max_interval`."""
+    while True:
+        yield interval
+        interval = min(interval * factor, max_interval)
+
+
+def watch(Service, interval, max_interval):
+    """Poll the status of the request of `Service` until it is done.
+
+    The delay between two polls doubles up to `max_interval` and starts over
+    from `interval` whenever the state of the request changes. Failing polls
+    (network, service hiccups) are retried the same way.
+
+        :return: the status of the processed request
+        :raise OdooUpgradeServiceError: when the request failed
+    """
+    previous = None
+    delays = backoff(interval, max_interval)
+    while True:
+        try:
+            status = Service.status(max_age=0) or {}
+        except (requests.RequestException, ValueError) as e:
+            _logger.warning("status poll failed: %s", e)
+            status = {"state": previous}
+        metrics.WATCH_POLLS.inc()
+        state = status.get("state")
+        if state != previous:
+            _logger.info("request %s is %s.", Service.request_id, state)
+            metrics.WATCH_STATE.labels(str(previous)).set(0)
+            metrics.WATCH_STATE.labels(str(state)).set(1)
+            previous = state
+            delays = backoff(interval, max_interval)
+        if state in DONE_STATES:
+            return status
+        if state in FAILED_STATES:
+            raise OdooUpgradeServiceError(
+                "Request {} is {}".format(Service.request_id, state)
+            )
+        time.sleep(next(delays))
@@ -10,14 +10,15 @@
 
 from __future__ import absolute_import, print_function
 
-import glob
 import logging
 import os
 import sys
 
 from dodoo import odoo
 
+from . import metrics, profiling
 from .cli import get_additional_mig_path
+from .script_index import ScriptIndex, root_mtimes
 
 # We need to adopt this strange pattern, as in p27 the import resolution would
 # be fooled by the src.odoo package, meant to blend in with the odoo namespace
@@ -25,6 +26,11 @@ from .cli import get_additional_mig_path
 MigrationManager = odoo.modules.migration.MigrationManager  # noqa
 parse_version = odoo.tools.parse_version  # noqa
 
+if odoo.release.version_info[0] > 10:
+    from odoo import migration
+else:
+    migration = None
+
 if sys.version_info[0] == 2:
     import imp
 
@@ -102,22 +108,73 @@ def _get_additional_migration_path(module, *args):
     return False
 
 
+def _migration_paths(name):
+    """Return the (default, overlay) migrations folders of module `name`."""
+    return {
+        "module": (
+            get_resource_path(name, "migrations"),
+            _get_additional_migration_path(name, "migrations"),
+        ),
+        "maintenance": (
+            get_resource_path("base", "maintenance", "migrations", name),
+            _get_additional_migration_path("base", "maintenance", "migrations", name),
+        ),
+    }
+
+
+_SCRIPT_INDEX = None
+
+
+def get_script_index():
+    """Return the script index of the current addons path and overlay.
+
+    It is stored into `DODOO_MIGRATOR_SCRIPT_INDEX` (by default, into the
+    data directory) and kept in memory while its key does not change.
+    """
+    global _SCRIPT_INDEX
+    addons_path = [
+        p.strip() for p in odoo.tools.config["addons_path"].split(",") if p.strip()
+    ]
+    overlay = get_additional_mig_path()
+    key = {
+        "addons_path": addons_path,
+        "overlay": overlay,
+        "mtimes": root_mtimes(addons_path + ([overlay] if overlay else [])),
+    }
+    if _SCRIPT_INDEX is None or _SCRIPT_INDEX.key != key:
+        path = os.getenv("DODOO_MIGRATOR_SCRIPT_INDEX") or os.path.join(
+            odoo.tools.config["data_dir"], "dodoo_migrator_scripts.json"
+        )
+        _SCRIPT_INDEX = ScriptIndex.load(path, key)
+    return _SCRIPT_INDEX
+
+
+def build_script_index():
+    """Index the migrations folders of all the available modules.
+
+        :return: the script index
+    """
+    index = get_script_index()
+    index.clear()
+    for name in odoo.modules.module.get_modules():
+        for paths in _migration_paths(name).values():
+            for path in paths:
+                if path:
+                    index.scripts(path)
+    index.save()
+    return index
+
+
 class ExtendedMigrationManager(MigrationManager):
     def _get_files(self):
+        index = get_script_index()
+
         def _get_scripts(res, path):
-            for version in os.listdir(path):
-                if not os.path.isdir(os.path.join(path, version)):
-                    continue
-                files = glob.glob1(os.path.join(path, version), "*.py")
-                files.sort()
+            for version, files in index.scripts(path).items():
                 if version not in res:
-                    res[version] = [
-                        os.path.join(path, version) + os.path.sep + f for f in files
-                    ]
+                    res[version] = list(files)
                 else:
-                    res[version].append(
-                        [os.path.join(path, version) + os.path.sep + f for f in files]
-                    )
+                    res[version].append(list(files))
 
         def get_scripts(default, overlay):
             res = {}
@@ -135,18 +192,12 @@ class ExtendedMigrationManager(MigrationManager):
             ):
                 continue
 
-            module = get_scripts(
-                get_resource_path(pkg.name, "migrations"),
-                _get_additional_migration_path(pkg.name, "migrations"),
-            )
-            maintenance = get_scripts(
-                get_resource_path("base", "maintenance", "migrations", pkg.name),
-                _get_additional_migration_path(
-                    "base", "maintenance", "migrations", pkg.name
-                ),
-            )
-
-            self.migrations[pkg.name] = {"module": module, "maintenance": maintenance}
+            paths = _migration_paths(pkg.name)
+            self.migrations[pkg.name] = {
+                "module": get_scripts(*paths["module"]),
+                "maintenance": get_scripts(*paths["maintenance"]),
+            }
+        index.save()
 
     def migrate_module(self, pkg, stage):
         assert stage in ("pre", "post", "end")
@@ -237,7 +288,19 @@ class ExtendedMigrationManager(MigrationManager):
                             ' installed_version)" function' % strfmt
                         )
                     else:
-                        migrate(self.cr, installed_version)
+                        context = "{} {}".format(pkg.name, name)
+                        cr = profiling.cursor(self.cr, context)
+                        if migration:
+                            # the ORM may have altered the schema in between
+                            migration.invalidate_schema(cr)
+                        with metrics.timed(
+                            metrics.SCRIPT_SECONDS,
+                            module=pkg.name,
+                            version=version,
+                            stage=stage,
+                            script=name,
+                        ):
+                            migrate(cr, installed_version)
                     finally:
                         if mod:
                             del mod
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 XOE Corp. SAS
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+"""Opt-in profiling of the SQL statements run by migration scripts.
+
+Once `start` is called, the cursors handed to the pre/post scripts and to
+the module migration scripts are wrapped into a `ProfilingCursor`. Each
+statement is timed and attributed to the script and to the chain of
+`odoo.migration` helpers executing it. `write_report` then writes a json
+report and the same timings as folded stacks (one `frame;frame;... value`
+line per stack, in microseconds), the input format of flamegraph.pl and
+speedscope.
+"""
+from __future__ import absolute_import
+
+import heapq
+import json
+import logging
+import sys
+import time
+import weakref
+
+_logger = logging.getLogger(__name__)
+
+HELPERS_MODULE = "odoo.migration"
+# statements EXPLAIN can be run on
+EXPLAINABLE = ("select", "insert", "update", "delete", "with")
+
+PROFILER = None
+
+
+class Profiler(object):
+    """Timings of the statements of all the profiled cursors.
+
+        :param explain: number of slowest statements to `EXPLAIN (ANALYZE,
+                        BUFFERS)`; they are run a second time for that, in a
+                        savepoint rolled back afterwards
+    """
+
+    def __init__(self, explain=0):
+        self.explain = explain
+        self.statements = {}
+        self.stacks = {}
+        self.slowest = []
+        # the wrapper holds its cursor: both live as long as the wrapper is
+        # used, the schema catalogs of odoo.migration are weakly keyed on it
+        self.cursors = weakref.WeakValueDictionary()
+
+    def cursor(self, cr, context):
+        """Return the profiling cursor of `cr`, running `context`."""
+        wrapper = self.cursors.get(id(cr))
+        if wrapper is None:
+            wrapper = self.cursors[id(cr)] = ProfilingCursor(cr, self)
+        wrapper.context = context
+        return wrapper
+
+    def record(self, cursor, query, params, elapsed, rows):
+        helpers = _helpers(sys._getframe(2))
+        stats = self.statements.get(query)
+        if stats is None:
+            stats = self.statements[query] = {
+                "query": query,
+                "calls": 0,
+                "time": 0.0,
+                "max": 0.0,
+                "rows": 0,
+                "helpers": helpers,
+                "contexts": [],
+            }
+        stats["calls"] += 1
+        stats["time"] += elapsed
+        stats["max"] = max(stats["max"], elapsed)
+        stats["rows"] += max(rows, 0)
+        if cursor.context not in stats["contexts"]:
+            stats["contexts"].append(cursor.context)
+        frames = [cursor.context] + helpers + [_frame_name(query)]
+        stack = ";".join(frames).replace("\n", " ")
+        self.stacks[stack] = self.stacks.get(stack, 0.0) + elapsed
+        if self.explain and query.lstrip()[:6].lower().startswith(EXPLAINABLE):
+            self._maybe_explain(cursor, stats, params, elapsed)
+
+    def _maybe_explain(self, cursor, stats, params, elapsed):
+        if len(self.slowest) >= self.explain:
+            if elapsed <= self.slowest[0]:
+                return
+            heapq.heapreplace(self.slowest, elapsed)
+        else:
+            heapq.heappush(self.slowest, elapsed)
+        if elapsed < stats.get("explain_time", 0.0):
+            return
+        plan = cursor.explain(stats["query"], params)
+        if plan is not None:
+            stats["explain_time"], stats["explain"] = elapsed, plan
+
+    def report(self):
+        statements = sorted(
+            self.statements.values(), key=lambda s: s["time"], reverse=True
+        )
+        helpers = {}
+        for stats in statements:
+            for helper in set(stats["helpers"]) or ["<script>"]:
+                totals = helpers.setdefault(
+                    helper, {"statements": 0, "time": 0.0, "rows": 0}
+                )
+                totals["statements"] += stats["calls"]
+                totals["time"] += stats["time"]
+                totals["rows"] += stats["rows"]
+        return {
+            "total": {
+                "statements": sum(s["calls"] for s in statements),
+                "time": sum(s["time"] for s in statements),
+                "rows": sum(s["rows"] for s in statements),
+            },
+            "helpers": helpers,
+            "statements": statements,
+        }
+
+    def folded(self):
+        for stack, elapsed in sorted(self.stacks.items()):
+            yield "%s %d\n" % (stack, elapsed * 1e6)
+
+
+def _helpers(frame):
+    """Names of the `odoo.migration` functions on the stack, outermost first."""
+    names = []
+    while frame is not None:
+        if frame.f_globals.get("__name__", "").startswith(HELPERS_MODULE):
+            names.append(frame.f_code.co_name)
+        frame = frame.f_back
+    return names[::-1]
+
+
+def _frame_name(query):
+    # one line, without the separators of the folded format
+    return " ".join(query.split())[:80].replace(";", ",")
+
+
+class ProfilingCursor(object):
+    """Cursor timing its statements into a `Profiler`.
+
+    Everything but `execute` is delegated to the wrapped cursor.
+    """
+
+    def __init__(self, cr, profiler):
+        self._cr = cr
+        self._profiler = profiler
+        self.context = None
+
+    def __getattr__(self, name):
+        return getattr(self._cr, name)
+
+    def _query_string(self, query):
+        if hasattr(query, "as_string"):
+            # psycopg2.sql composable
+            return query.as_string(self._cr._cnx)
+        return query
+
+    def execute(self, query, params=None, *args, **kwargs):
+        start = time.time()
+        result = self._cr.execute(query, params, *args, **kwargs)
+        elapsed = time.time() - start
+        self._profiler.record(
+            self, self._query_string(query), params, elapsed, self._cr.rowcount
+        )
+        return result
+
+    def explain(self, query, params):
+        """Return the plan of `query`, executed in a rolled back savepoint.
+
+        A cursor of its own keeps the results of the last statement intact.
+        """
+        cr = self._cr._cnx.cursor()
+        try:
+            cr.execute("SAVEPOINT dodoo_migrator_explain")
+            try:
+                cr.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+                return cr.fetchone()[0]
+            except Exception as e:
+                _logger.debug("cannot explain %s: %s", _frame_name(query), e)
+                return None
+            finally:
+                cr.execute("ROLLBACK TO SAVEPOINT dodoo_migrator_explain")
+                cr.execute("RELEASE SAVEPOINT dodoo_migrator_explain")
+        finally:
+            cr.close()
+
+
+def start(explain=0):
+    global PROFILER
+    PROFILER = Profiler(explain)
+
+
+def cursor(cr, context):
+    """Return `cr` profiled as running `context` if profiling is started."""
+    if PROFILER is None:
+        return cr
+    return PROFILER.cursor(cr, context)
+
+
+def write_report(path):
+    """Write the json report into `path` and the folded stacks next to it."""
+    if PROFILER is None:
+        return
+    report = PROFILER.report()
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    with open(path + ".folded", "w") as f:
+        f.writelines(PROFILER.folded())
+    total = report["total"]
+    _logger.info(
+        "%d statements (%.1fs) profiled into %s.",
+        total["statements"],
+        total["time"],
+        path,
+    )
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 XOE Corp. SAS
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+"""Persistent index of the migration scripts found in migrations folders.
+
+The index is stored as json and bound to a key describing the addons path
+and the migration folder overlay (including the mtimes of their roots):
+another key discards it. Each indexed migrations folder also records the
+mtimes of itself and of its version folders, which change whenever a
+version folder or a script is added or removed, so that a stale entry is
+scanned again. These few `stat` calls are made once per folder and process
+instead of listing and globbing the folders on every lookup.
+
+Only the contents of the folders are indexed: the migrations folders of the
+modules are resolved on every lookup, so that a folder added to a module or
+to the overlay is always found. A folder gone is indexed as empty.
+"""
+from __future__ import absolute_import
+
+import glob
+import json
+import logging
+import os
+
+_logger = logging.getLogger(__name__)
+
+
+def _scan(path):
+    """Return the index entry of migrations folder `path`.
+
+    A folder which does not exist (anymore) gets an empty entry, never fresh.
+    """
+    try:
+        entry = {"mtimes": {path: os.stat(path).st_mtime}, "versions": {}}
+        for version in os.listdir(path):
+            version_path = os.path.join(path, version)
+            if not os.path.isdir(version_path):
+                continue
+            entry["mtimes"][version_path] = os.stat(version_path).st_mtime
+            files = glob.glob1(version_path, "*.py")
+            files.sort()
+            entry["versions"][version] = [version_path + os.path.sep + f for f in files]
+    except OSError:
+        _logger.debug("migrations folder %s is gone.", path)
+        return {"mtimes": {path: None}, "versions": {}}
+    return entry
+
+
+def _is_fresh(entry):
+    try:
+        return all(
+            os.stat(path).st_mtime == mtime for path, mtime in entry["mtimes"].items()
+        )
+    except OSError:
+        return False
+
+
+def root_mtimes(paths):
+    """Return the mtimes of the existing `paths`, for the key of an index."""
+    return {path: os.stat(path).st_mtime for path in paths if os.path.isdir(path)}
+
+
+class ScriptIndex(object):
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.entries = {}
+        # folders whose entry has been checked by this process
+        self.checked = set()
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path, key):
+        """Return the index stored at `path`, empty if not bound to `key`."""
+        index = cls(path, key)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return index
+        if data.get("key") == key:
+            index.entries = data.get("entries", {})
+        else:
+            _logger.info("script index %s is outdated, rebuilding it.", path)
+        return index
+
+    def scripts(self, path):
+        """Return the scripts of migrations folder `path` by version."""
+        entry = self.entries.get(path)
+        if entry is None or (path not in self.checked and not _is_fresh(entry)):
+            entry = self.entries[path] = _scan(path)
+            self.dirty = True
+        self.checked.add(path)
+        return entry["versions"]
+
+    def clear(self):
+        self.entries = {}
+        self.checked.clear()
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.path + ".tmp"
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(tmp, "w") as f:
+                json.dump({"key": self.key, "entries": self.entries}, f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            # the index is only a cache
+            _logger.warning("cannot save script index %s: %s", self.path, e)
+            return
+        self.dirty = False
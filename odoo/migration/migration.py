@@ -3,17 +3,22 @@
 
 import datetime
 import imp
+import io
 import json
 import logging
+import multiprocessing
 import os
+import random
 import re
 import sys
+import threading
 import time
-from collections import namedtuple
+import weakref
+from collections import OrderedDict, namedtuple
 from contextlib import contextmanager
 from functools import reduce
 from inspect import currentframe
-from itertools import chain, islice
+from itertools import chain, count, islice
 from operator import itemgetter
 from textwrap import dedent
 
@@ -33,6 +38,11 @@ from odoo.tools import UnquoteEvalContext
 from odoo.tools.func import frame_codeinfo
 from odoo.tools.mail import html_sanitize
 
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
 try:
     from odoo.addons.base.models.ir_module import MyWriter
 except ImportError:
@@ -200,8 +210,7 @@ def remove_module(cr, module):
                 ).format(**_params)
                 cr.execute(_query, dict(res_ids=tuple(res_ids)))
 
-    for view_id in view_ids:
-        remove_view(cr, view_id=view_id, deactivate_custom=True, silent=True)
+    remove_views(cr, view_ids, deactivate_custom=True, silent=True)
 
     if menu_ids:
         remove_menus(cr, menu_ids)
@@ -252,6 +261,7 @@ def remove_module(cr, module):
             """
             ).format(**_params)
             cr.execute(_query)
+            invalidate_schema(cr, rel, cascade=True)
 
     if model_ids:
         _query = sql.SQL(
@@ -264,8 +274,7 @@ def remove_module(cr, module):
         """
         )
         cr.execute(_query, locals())
-        for (model,) in cr.fetchall():
-            remove_model(cr, model)
+        remove_models(cr, [model for (model,) in cr.fetchall()])
 
     if field_ids:
         _query = sql.SQL(
@@ -413,8 +422,7 @@ def merge_module(cr, old, into, tolerant=False):
                 # we can assume other records have been moved to xml files of the new module
                 # remove the unnecessary data and let the module update do its job
                 if model == "ir.ui.view":
-                    for v in res_ids:
-                        remove_view(cr, view_id=v, deactivate_custom=True, silent=True)
+                    remove_views(cr, res_ids, deactivate_custom=True, silent=True)
                 elif model == "ir.ui.menu":
                     remove_menus(cr, tuple(res_ids))
                 else:
@@ -774,6 +782,7 @@ def create_m2m(cr, m2m, fk1, fk2, col1=None, col2=None):
     """
     ).format(**_params)
     cr.execute(_query)
+    invalidate_schema(cr, m2m)
 
 
 def ensure_m2o_func_field_data(cr, src_table, column, dst_table):
@@ -942,6 +951,7 @@ def remove_field(cr, model, fieldname, cascade=False):
     )
     cr.execute(_query, locals())
     fids = tuple(vals[0] for vals in cr.fetchall())
+    invalidate_reference_columns(cr)
     if fids:
         _query = sql.SQL(
             """
@@ -1000,72 +1010,110 @@ def rename_field(cr, model, old, new, update_references=True):
                                        filters, saved exports, etc. will be
                                        adapted (default: True)
     """
+    rename_fields(cr, model, {old: new}, update_references=update_references)
 
-    _query = sql.SQL(
-        """
 
-        UPDATE ir_model_fields
-        SET name = %(new)s
-        WHERE model = %(model)s
-          AND name = %(old)s RETURNING id
+def rename_fields(cr, model, mapping, update_references=True):
+    """Rename several fields of a model at once.
 
-    """
-    )
-    cr.execute(_query, locals())
-    [fid] = cr.fetchone() or [None]
-    if fid:
-        name = IMD_FIELD_PATTERN % (model.replace(".", "_"), new)
+    Metadata and translations are rewritten with one query each over the
+    whole mapping and all the columns are renamed in a single round trip.
 
-        _query = sql.SQL(
-            """
+        :param dict mapping: {old: new} field names; a new name can neither
+                             be renamed itself (swaps and chains of renames
+                             must be split into several calls) nor be the
+                             target of several fields; fields "renamed" to
+                             their own name are left alone
+        :param bool update_references: if True, references to these fields in
+                                       filters, saved exports, etc. will be
+                                       adapted (default: True)
+    """
+    mapping = {old: new for old, new in mapping.items() if old != new}
+    if not mapping:
+        return
+    chained = set(mapping) & set(mapping.values())
+    if chained:
+        raise ValueError(
+            "Cannot rename fields of %s both from and to %s in one go"
+            % (model, ", ".join(sorted(chained)))
+        )
+    if len(set(mapping.values())) != len(mapping):
+        raise ValueError("Cannot rename several fields of %s to one name" % model)
+    imd_prefix = IMD_FIELD_PATTERN % (model.replace(".", "_"), "")
+    translation_prefix = "{},".format(model)
+    _params = {
+        "names": sql.SQL(", ").join(
+            sql.SQL("({}, {})").format(sql.Literal(old), sql.Literal(new))
+            for old, new in mapping.items()
+        )
+    }
 
-            UPDATE ir_model_data
-            SET name=%(name)s
-            WHERE model='ir.model.fields'
-              AND res_id=%(fid)s;
+    _query = sql.SQL(
+        """
 
+        WITH names(old, new) AS (
+            VALUES {names}
+        ),
+        fields AS (
+            UPDATE ir_model_fields f
+            SET name = n.new
+            FROM names n
+            WHERE f.model = %(model)s
+              AND f.name = n.old
+            RETURNING f.id, n.new
+        ),
+        imd AS (
+            UPDATE ir_model_data d
+            SET name = %(imd_prefix)s || f.new
+            FROM fields f
+            WHERE d.model = 'ir.model.fields'
+              AND d.res_id = f.id
+        )
+        UPDATE ir_property p
+        SET name = f.new
+        FROM fields f
+        WHERE p.fields_id = f.id
 
-            UPDATE ir_property
-            SET name=%(new)s
-            WHERE fields_id=%(fid)s;
+    """
+    ).format(**_params)
+    cr.execute(_query, locals())
+    invalidate_reference_columns(cr)
 
-        """
-        )
-        cr.execute(_query, locals())
     _query = sql.SQL(
         """
 
-
-        UPDATE ir_translation
-        SET name = %s
-        WHERE name = %s
-          AND TYPE IN ('field',
-                       'help',
-                       'model',
-                       'selection') -- ignore wizard_* translations
+        UPDATE ir_translation t
+        SET name = %(translation_prefix)s || n.new
+        FROM (VALUES {names}) AS n(old, new)
+        WHERE t.name = %(translation_prefix)s || n.old
+          AND t.TYPE IN ('field',
+                         'help',
+                         'model',
+                         'selection') -- ignore wizard_* translations
 
     """
-    )
-    cr.execute(_query, ["{},{}".format(model, new), "{},{}".format(model, old)])
+    ).format(**_params)
+    cr.execute(_query, locals())
+
     table = table_of_model(cr, model)
     # NOTE table_exists is needed to avoid altering views
-    if table_exists(cr, table) and column_exists(cr, table, old):
-        _params = {
-            "table": sql.Identifier(table),
-            "old": sql.Identifier(old),
-            "new": sql.Identifier(new),
-        }
-        _query = sql.SQL(
-            """
-
-            ALTER TABLE {table} RENAME COLUMN {old} TO {new}
-
-        """
-        ).format(**_params)
-        cr.execute(_query)
+    if table_exists(cr, table):
+        existing = _existing_columns(cr, ((table, old) for old in mapping))
+        renames = [
+            sql.SQL("ALTER TABLE {table} RENAME COLUMN {old} TO {new}").format(
+                table=sql.Identifier(table),
+                old=sql.Identifier(old),
+                new=sql.Identifier(new),
+            )
+            for old, new in mapping.items()
+            if (table, old) in existing
+        ]
+        if renames:
+            cr.execute(sql.SQL(";\n").join(renames))
+            invalidate_schema(cr, table)
 
     if update_references:
-        update_field_references(cr, old, new, only_models=(model,))
+        update_field_references_batch(cr, mapping, only_models=(model,))
 
 
 def make_field_company_dependent(
@@ -1284,132 +1332,192 @@ def update_field_references(cr, old, new, only_models=None):
 
         :param list only_models: list of models affected by the fieldname change
     """
-    p = {
-        "old": r"\y{}\y".format(old),
-        "new": new,
-        "def_old": r"\ydefault_{}\y".format(old),
-        "def_new": "default_{}".format(new),
-        "models": tuple(only_models) if only_models else (),
-    }
+    update_field_references_batch(cr, {old: new}, only_models=only_models)
 
-    _query = sql.SQL(
-        """
 
-        UPDATE ir_filters
-        SET domain = regexp_replace(domain, %(old)s, %(new)s, 'g'),
-            context = regexp_replace(regexp_replace(context, %(old)s, %(new)s, 'g'), %(def_old)s, %(def_new)s, 'g')
+def _create_replace_words_function(cr):
+    """Create `pg_temp._upgrade_replace_words(value, pattern, words)`.
 
+    Replace all the matches of `pattern` in `value` by their lookup in the
+    json object `words` (matches without lookup are kept as is). Unlike
+    chained `regexp_replace`, all the words are replaced at once, so that
+    e.g. swapping two names is safe.
     """
-    )
-    if column_exists(cr, "ir_filters", "sort"):
-        _query += sql.SQL(", sort = regexp_replace(sort, %(old)s, %(new)s, 'g')")
-
-    if only_models:
-        _query += sql.SQL(" WHERE model_id IN %(models)s")
-
-    cr.execute(_query, p)
-
-    # ir.exports.line
     _query = sql.SQL(
         """
 
-        UPDATE ir_exports_line l
-        SET name = regexp_replace(l.name, %(old)s, %(new)s, 'g')
+        CREATE OR REPLACE FUNCTION pg_temp._upgrade_replace_words(value text, pattern text, words jsonb)
+        RETURNS text LANGUAGE sql IMMUTABLE AS $$
+            SELECT CASE
+                       WHEN value IS NULL OR words IS NULL THEN value
+                       ELSE (
+                           SELECT string_agg(p.part || COALESCE(words ->> m.word[1], m.word[1], ''), '' ORDER BY p.n)
+                           FROM unnest(regexp_split_to_array(value, pattern)) WITH ORDINALITY AS p(part, n)
+                           LEFT JOIN regexp_matches(value, pattern, 'g') WITH ORDINALITY AS m(word, n) ON m.n = p.n
+                       )
+                   END
+        $$
 
     """
     )
-    if only_models:
-        _query += sql.SQL(
-            """
+    cr.execute(_query)
 
-            FROM ir_exports e
-            WHERE e.id = l.export_id
-              AND e.resource IN %(models)s
 
-        """
-        )
-    cr.execute(_query, p)
+def update_field_references_batch(cr, mapping, only_models=None):
+    """Replaces references to several fields at once.
 
-    # ir.action.server
-    col_prefix = ""
-    if not column_exists(cr, "ir_act_server", "condition"):
-        col_prefix = "--"  # sql comment the line
-    _query = sql.SQL(
-        """
+    Same as `update_field_references`, but each table is rewritten in a
+    single pass for all the fields, and only the rows mentioning one of them
+    are updated.
 
-        UPDATE ir_act_server s
-        SET {col_prefix} condition = regexp_replace(condition, %(old)s, %(new)s, 'g'),
-            code = regexp_replace(code, %(old)s, %(new)s, 'g')
+        :param dict mapping: {old: new} field names, or {model: {old: new}}
+                             for fields renamed on specific models
+        :param list only_models: list of models affected by a {old: new}
+                                 mapping
+    """
+    if not mapping:
+        return
+    if all(isinstance(names, dict) for names in mapping.values()):
+        by_model = {model: names for model, names in mapping.items() if names}
+    elif only_models:
+        by_model = {model: mapping for model in only_models}
+    else:
+        by_model = None
+
+    def with_defaults(names):
+        # contexts may also hold `default_<field>` keys
+        result = dict(names)
+        result.update(("default_" + o, "default_" + n) for o, n in names.items())
+        return result
+
+    olds = set(chain.from_iterable(by_model.values())) if by_model else set(mapping)
+    alternation = "|".join(re.escape(old) for old in sorted(olds))
+    if by_model:
+        words = by_model
+        ctx_words = {model: with_defaults(names) for model, names in by_model.items()}
+    else:
+        words, ctx_words = mapping, with_defaults(mapping)
+    p = {
+        "pattern": r"\y(?:{})\y".format(alternation),
+        "ctx_pattern": r"\y(?:default_)?(?:{})\y".format(alternation),
+        "words": json.dumps(words),
+        "ctx_words": json.dumps(ctx_words),
+        "models": list(by_model) if by_model else None,
+    }
 
-    """.format(
-            col_prefix=col_prefix
-        )
-    )
-    if only_models:
-        _query += sql.SQL(
-            """
+    _create_replace_words_function(cr)
 
-            FROM ir_model m
-            WHERE m.id = s.model_id
-              AND m.model IN %(models)s
-              AND
+    def update(table, columns, model=None, join=sql.SQL(""), where=sql.SQL("")):
+        """Rewrite `columns` ({column: is_context}) of `table` in a single query.
 
+            :param model: expression of the model name of a row
+            :param join: FROM clause needed by `model` and `where`
+            :param where: extra (AND-ed) condition
         """
-        )
-    else:
-        _query += sql.SQL(" WHERE ")
+        sets, matches = [], []
+        for column, is_context in columns.items():
+            pattern = sql.Placeholder("ctx_pattern" if is_context else "pattern")
+            lookup = sql.Placeholder("ctx_words" if is_context else "words")
+            if by_model:
+                lookup = sql.SQL("({}::jsonb -> {})").format(lookup, model)
+            _params = {
+                "column": sql.Identifier(column),
+                "pattern": pattern,
+                "lookup": lookup,
+            }
+            sets.append(
+                sql.SQL(
+                    "{column} = pg_temp._upgrade_replace_words(t.{column}, {pattern}, {lookup})"
+                ).format(**_params)
+            )
+            matches.append(sql.SQL("t.{column} ~ {pattern}").format(**_params))
+        if by_model:
+            where += sql.SQL(" AND {} = ANY(%(models)s)").format(model)
 
-    _query += sql.SQL("s.state = 'code'")
-    cr.execute(_query, p)
+        _params = {
+            "table": sql.Identifier(table),
+            "set": sql.SQL(", ").join(sets),
+            "join": join,
+            "match": sql.SQL(" OR ").join(matches),
+            "where": where,
+        }
+        _query = sql.SQL(
+            """
+
+            UPDATE {table} t
+            SET {set}
+            {join}
+            WHERE ({match}) {where}
 
-    # ir.rule
-    _query = sql.SQL(
         """
+        ).format(**_params)
+        cr.execute(_query, p)
 
-        UPDATE ir_rule r
-        SET domain_force = regexp_replace(domain_force, %(old)s, %(new)s, 'g')
+    # ir.filters
+    columns = OrderedDict([("domain", False), ("context", True)])
+    if column_exists(cr, "ir_filters", "sort"):
+        columns["sort"] = False
+    update("ir_filters", columns, model=sql.SQL("t.model_id"))
 
-    """
+    # ir.exports.line
+    update(
+        "ir_exports_line",
+        {"name": False},
+        model=sql.SQL("e.resource"),
+        join=sql.SQL("FROM ir_exports e"),
+        where=sql.SQL("AND e.id = t.export_id"),
     )
-    if only_models:
-        _query += sql.SQL(
-            """
 
-            FROM ir_model m
-            WHERE m.id = r.model_id
-              AND m.model IN %(models)s
+    # ir.action.server
+    columns = OrderedDict([("code", False)])
+    if column_exists(cr, "ir_act_server", "condition"):
+        columns["condition"] = False
+    update(
+        "ir_act_server",
+        columns,
+        model=sql.SQL("m.model"),
+        join=sql.SQL("FROM ir_model m"),
+        where=sql.SQL("AND m.id = t.model_id AND t.state = 'code'"),
+    )
 
-        """
-        )
-    cr.execute(_query, p)
+    # ir.rule
+    update(
+        "ir_rule",
+        {"domain_force": False},
+        model=sql.SQL("m.model"),
+        join=sql.SQL("FROM ir_model m"),
+        where=sql.SQL("AND m.id = t.model_id"),
+    )
 
     # mass mailing
     if column_exists(cr, "mail_mass_mailing", "mailing_domain"):
-        _query = sql.SQL(
-            """
-
-            UPDATE mail_mass_mailing u
-            SET mailing_domain = regexp_replace(u.mailing_domain, %(old)s, %(new)s, 'g')
-
-        """
-        )
-        if only_models:
-            if column_exists(cr, "mail_mass_mailing", "mailing_model_id"):
-                _query += sql.SQL(
-                    """
-
-                    FROM ir_model m
-                    WHERE m.id = u.mailing_model_id
-                      AND m.model IN %(models)s
-
-                """
-                )
-            else:
-                _query += sql.SQL("WHERE u.mailing_model IN %(models)s")
-        cr.execute(_query, p)
+        if column_exists(cr, "mail_mass_mailing", "mailing_model_id"):
+            update(
+                "mail_mass_mailing",
+                {"mailing_domain": False},
+                model=sql.SQL("m.model"),
+                join=sql.SQL("FROM ir_model m"),
+                where=sql.SQL("AND m.id = t.mailing_model_id"),
+            )
+        else:
+            update(
+                "mail_mass_mailing",
+                {"mailing_domain": False},
+                model=sql.SQL("t.mailing_model"),
+            )
 
 
-def recompute_fields(cr, model, fields, ids=None, logger=_logger, chunk_size=256):
+def recompute_fields(
+    cr,
+    model,
+    fields,
+    ids=None,
+    logger=_logger,
+    chunk_size=256,
+    workers=None,
+    max_retries=5,
+    adaptive=False,
+):
     """Recompute fields using the ORM.
 
         :param str model:
@@ -1418,31 +1526,199 @@ def recompute_fields(cr, model, fields, ids=None, logger=_logger, chunk_size=256
                          if not set, will recompute for all records
         :param logger: logger used during the processing (default: current logger)
         :param integer chunk_size: batch size for recomputing (default: 256)
+        :param integer workers: if set, chunks are recomputed in parallel by this
+                                number of worker processes, each one with its own
+                                cursor committing after every chunk; the current
+                                transaction is committed and all the ids are
+                                fetched beforehand
+                                (default: None - sequential, in the current
+                                transaction)
+        :param integer max_retries: number of attempts of a chunk failing on a
+                                    serialization failure or deadlock in
+                                    parallel mode (default: 5)
+        :param bool adaptive: if True, `chunk_size` is only the initial batch
+                              size, adapted afterwards by `adaptive_chunks`;
+                              ignored in parallel mode (default: False)
     """
     if ids is None:
-        _params = {"table": sql.Identifier(table_of_model(cr, model))}
+        # stream the ids instead of holding all of them in memory
+        table = table_of_model(cr, model)
+        count = estimate_count(cr, table)
+        ids = iter_ids(cr, table)
+    else:
+        count = len(ids)
 
-        _query = sql.SQL(
-            """
+    size = (count + chunk_size - 1) / chunk_size
+    qual = "%s %d-bucket" % (model, chunk_size) if chunk_size != 1 else model
+
+    if workers and workers > 1:
+        _recompute_fields_parallel(
+            cr, model, fields, ids, logger, chunk_size, workers, max_retries, qual, size
+        )
+        return
+
+    if adaptive:
+        it = adaptive_chunks(
+            log_progress(ids, qualifier=model, logger=logger, size=count),
+            chunk_size,
+            list,
+            logger=logger,
+            qualifier=model,
+        )
+    else:
+        it = log_progress(
+            chunks(ids, chunk_size, list), qualifier=qual, logger=logger, size=size
+        )
+    for subids in it:
+        _recompute_records(cr, model, fields, subids)
 
-            SELECT id FROM {table}
 
+def iter_ids(cr, table, page_size=10000):
+    """Iterate on the ids of `table` by ascending order, one page at a time.
+
+    Keyset pagination is used, so that memory usage does not depend on the
+    size of the table and the cursor can still be used (or committed)
+    in between.
+
+        :param int page_size: number of ids fetched per query (default: 10000)
+    """
+    _params = {"table": sql.Identifier(table)}
+    _query = sql.SQL(
         """
-        ).format(**_params)
+
+        SELECT id
+        FROM {table}
+        WHERE id > %(last)s
+        ORDER BY id
+        LIMIT %(page_size)s
+
+    """
+    ).format(**_params)
+    last = 0
+    while True:
         cr.execute(_query, locals())
-        ids = tuple(map(itemgetter(0), cr.fetchall()))
+        page = [vals[0] for vals in cr.fetchall()]
+        if not page:
+            return
+        for id_ in page:
+            yield id_
+        last = page[-1]
+
+
+def estimate_count(cr, table):
+    """Return the number of rows of `table`, estimated from the statistics.
+
+    Falls back to an exact count for tables never analyzed.
+    """
+    _query = sql.SQL(
+        """
+
+        SELECT reltuples::bigint
+        FROM pg_class
+        WHERE oid = to_regclass(%(table)s)
+
+    """
+    )
+    cr.execute(_query, {"table": '"{}"'.format(table)})
+    [count] = cr.fetchone() or [None]
+    if count and count > 0:
+        return count
+
+    _params = {"table": sql.Identifier(table)}
+    _query = sql.SQL(
+        """
+
+        SELECT count(1)
+        FROM {table}
+
+    """
+    ).format(**_params)
+    cr.execute(_query)
+    return cr.fetchone()[0]
 
-    Model = env(cr)[model]
-    size = (len(ids) + chunk_size - 1) / chunk_size
-    qual = "%s %d-bucket" % (model, chunk_size) if chunk_size != 1 else model
-    for subids in log_progress(
-        chunks(ids, chunk_size, list), qualifier=qual, logger=logger, size=size
-    ):
-        records = Model.browse(subids)
-        for field in fields:
-            records._recompute_todo(records._fields[field])
-        records.recompute()
-        records.invalidate_cache()
+
+def _recompute_records(cr, model, fields, ids):
+    records = env(cr)[model].browse(ids)
+    for field in fields:
+        records._recompute_todo(records._fields[field])
+    records.recompute()
+    records.invalidate_cache()
+
+
+# connections inherited from the parent of a recompute worker process, kept
+# referenced so that they are never closed from the child: they share their
+# sockets with the connections of the parent
+_INHERITED_CONNECTIONS = []
+
+
+def _recompute_worker_init():
+    """Forget the state a recompute worker inherited from its parent.
+
+    The environments of the parent are bound to its cursor and hold its
+    caches and pending recomputations: the worker starts with none. The
+    pooled connections are dropped from the pool itself, which the database
+    connections of the registries use as well.
+    """
+    Environment._local = type(Environment._local)()
+    pool = odoo.sql_db._Pool
+    if pool is not None:
+        _INHERITED_CONNECTIONS.extend(pool._connections)
+        pool._connections = []
+        # it might have been held by another thread of the parent
+        pool._lock = threading.Lock()
+
+
+def _recompute_worker(args):
+    dbname, model, fields, ids, max_retries = args
+    for attempt in range(1, max_retries + 1):
+        try:
+            with Environment.manage(), db_connect(dbname).cursor() as cr:
+                _recompute_records(cr, model, fields, ids)
+        except psycopg2.extensions.TransactionRollbackError:
+            if attempt == max_retries:
+                raise
+            _logger.info(
+                "recompute of %d %s records failed (attempt %d/%d), retrying",
+                len(ids),
+                model,
+                attempt,
+                max_retries,
+            )
+            time.sleep(random.uniform(0.0, 2 ** attempt))
+        else:
+            return len(ids)
+
+
+def _recompute_fields_parallel(
+    cr, model, fields, ids, logger, chunk_size, workers, max_retries, qual, size
+):
+    # workers cannot see uncommitted data
+    cr.commit()
+    # the tasks are consumed by a thread of the pool: `ids` may be a generator
+    # running queries on `cr`, which must not be used concurrently
+    tasks = [
+        (cr.dbname, model, list(fields), subids, max_retries)
+        for subids in chunks(ids, chunk_size, list)
+    ]
+    pool = multiprocessing.get_context("fork").Pool(
+        workers, initializer=_recompute_worker_init
+    )
+    try:
+        for _ in log_progress(
+            pool.imap_unordered(_recompute_worker, tasks),
+            qualifier=qual,
+            logger=logger,
+            size=size,
+        ):
+            pass
+        pool.close()
+    except Exception:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    # values have been written by other transactions
+    env(cr)[model].invalidate_cache()
 
 
 def fix_wrong_m2o(cr, table, column, target, value=None):
@@ -1481,15 +1757,32 @@ def fix_wrong_m2o(cr, table, column, target, value=None):
 
 def remove_model(cr, model, drop_table=True):
     """Remove a model 😉."""
-    model_underscore = model.replace(".", "_")
+    remove_models(cr, [model], drop_table=drop_table)
 
-    # remove references
-    for ir in indirect_references(cr):
-        if ir.table == "ir_model":
+
+def remove_models(cr, models, drop_table=True):
+    """Remove several models at once.
+
+    Same as `remove_model`, but each cleanup statement is run once for all
+    the given models and their tables are dropped by a single statement.
+
+        :param list models: names of the models to remove
+        :param bool drop_table: if True, the tables (or SQL views) of the
+                                models are dropped (default: True)
+    """
+    models = list(models)
+    if not models:
+        return
+
+    # remove references, one statement per table
+    for table, irs in indirect_references_by_table(cr).items():
+        if table == "ir_model":
             continue
         _params = {
-            "table": sql.Identifier(ir.table),
-            "where_clause": sql.SQL(ir.model_filter(placeholder="%(model)s")),
+            "table": sql.Identifier(table),
+            "where_clause": sql.SQL(" OR ").join(
+                sql.SQL(ir.models_filter(placeholder="%(models)s")) for ir in irs
+            ),
         }
         _query = sql.SQL(
             """
@@ -1502,22 +1795,22 @@ def remove_model(cr, model, drop_table=True):
         ).format(**_params)
         cr.execute(_query, locals())
         ids = tuple(vals[0] for vals in cr.fetchall())
-        remove_refs(cr, model_of_table(cr, ir.table), ids)
+        remove_refs(cr, model_of_table(cr, table), ids)
 
-    remove_refs(cr, model)
+    remove_refs(cr, models)
 
     _query = sql.SQL(
         """
 
         SELECT id
         FROM ir_model
-        WHERE model = %(model)s
+        WHERE model = ANY(%(models)s)
 
     """
     )
     cr.execute(_query, locals())
-    [mod_id] = cr.fetchone() or [None]
-    if mod_id:
+    mod_ids = [vals[0] for vals in cr.fetchall()]
+    if mod_ids:
         # some required fk are "ON DELETE SET NULL".
         for tbl in "base_action_rule google_drive_config".split():
             if column_exists(cr, tbl, "model_id"):
@@ -1527,7 +1820,7 @@ def remove_model(cr, model, drop_table=True):
 
                     DELETE
                     FROM {tbl}
-                    WHERE model_id = %(mod_id)s
+                    WHERE model_id = ANY(%(mod_ids)s)
 
                 """
                 ).format(**_params)
@@ -1539,12 +1832,12 @@ def remove_model(cr, model, drop_table=True):
 
             DELETE
             FROM ir_model_constraint
-            WHERE model=%(mod_id)s;
+            WHERE model = ANY(%(mod_ids)s);
 
 
             DELETE
             FROM ir_model_relation
-            WHERE model=%(mod_id)s;
+            WHERE model = ANY(%(mod_ids)s);
 
              --- Drop XML IDs of ir.rule and ir.model.access records that will be cascade-dropped,
              --- when the ir.model record is dropped - just in case they need to be re-created
@@ -1553,134 +1846,136 @@ def remove_model(cr, model, drop_table=True):
             FROM ir_model_data x USING ir_rule a
             WHERE x.res_id = a.id
               AND x.model='ir.rule'
-              AND a.model_id = %(mod_id)s;
+              AND a.model_id = ANY(%(mod_ids)s);
 
 
             DELETE
             FROM ir_model_data x USING ir_model_access a
             WHERE x.res_id = a.id
               AND x.model='ir.model.access'
-              AND a.model_id = %(mod_id)s;
+              AND a.model_id = ANY(%(mod_ids)s);
 
 
             DELETE
             FROM ir_model
-            WHERE id=%(mod_id)s;
+            WHERE id = ANY(%(mod_ids)s);
 
         """
         )
         cr.execute(_query, locals())
+        # their fields are cascade-dropped
+        invalidate_reference_columns(cr)
 
+    models_underscore = [model.replace(".", "_") for model in models]
     _query = sql.SQL(
         """
 
         DELETE
         FROM ir_model_data
         WHERE model='ir.model'
-          AND name = %(name)s;
+          AND name = ANY(%(names)s);
 
         DELETE
         FROM ir_model_data
         WHERE model='ir.model.fields'
-          AND name LIKE %(name_like)s;
+          AND name LIKE ANY(%(names_like)s);
 
     """
     )
     cr.execute(
         _query,
         dict(
-            name="model_{}".format(model_underscore),
-            name_like=(IMD_FIELD_PATTERN % (model_underscore, "%")).replace("_", r"\_"),
+            names=["model_{}".format(m) for m in models_underscore],
+            names_like=[
+                (IMD_FIELD_PATTERN % (m, "%")).replace("_", r"\_")
+                for m in models_underscore
+            ],
         ),
     )
 
-    table = table_of_model(cr, model)
-    _params = {"table": sql.Identifier(table)}
     if drop_table:
-        if table_exists(cr, table):
-            _query = sql.SQL(
-                """
-
-                DROP TABLE {table} CASCADE
-
-            """
-            ).format(**_params)
-            cr.execute(_query)
-        elif view_exists(cr, table):
-            # For auto=False models...
+        tables, views = [], []
+        for model in models:
+            table = table_of_model(cr, model)
+            if table_exists(cr, table):
+                tables.append(table)
+            elif view_exists(cr, table):
+                # For auto=False models...
+                views.append(table)
+        for kind, relations in (("TABLE", tables), ("VIEW", views)):
+            if not relations:
+                continue
+            _params = {
+                "kind": sql.SQL(kind),
+                "relations": sql.SQL(", ").join(map(sql.Identifier, relations)),
+            }
             _query = sql.SQL(
                 """
 
-                DROP VIEW {table} CASCADE
+                DROP {kind} IF EXISTS {relations} CASCADE
 
             """
             ).format(**_params)
             cr.execute(_query)
+            invalidate_schema(cr, *relations, cascade=True)
 
 
 def remove_refs(cr, model, ids=None):
     """Remove non-sql enforced references pointing to the specified model.
 
     e.g. reference fields, translations, ...
+
+        :param model: name of the model; a list (or tuple) of model names is
+                      accepted when no `ids` are given
+        :param list ids: only remove references to these records
+                         (default: all records of the model)
     """
+    models = list(model) if isinstance(model, (list, tuple)) else [model]
     if ids is None:
-        match = sql.SQL("like %(needle)s")
-        needle = model + ",%"
+        match = sql.SQL("like any(%(needle)s)")
+        needle = [m + ",%" for m in models]
     else:
+        assert len(models) == 1, "`ids` can only be given for a single model"
         if not ids:
             return
         match = sql.SQL("in %(needle)s")
-        needle = tuple("{},{}".format(model, i) for i in ids)
+        needle = tuple("{},{}".format(models[0], i) for i in ids)
 
     # "model-comma" fields
-    _query = sql.SQL(
-        """
-
-        SELECT model,
-               name
-        FROM ir_model_fields
-        WHERE ttype = 'reference'
-        UNION
-        SELECT 'ir.translation',
-               'name'
-
-    """
-    )
-    cr.execute(_query)
-
-    for ref_model, ref_column in cr.fetchall():
-        table = table_of_model(cr, ref_model)
-        # NOTE table_exists is needed to avoid deleting from views
-        if table_exists(cr, table) and column_exists(cr, table, ref_column):
-            _params = {
-                "table": sql.Identifier(table),
-                "ref_column": sql.Identifier(ref_column),
-                "match": match,
-            }
-            query_tail = sql.SQL(
-                """
+    for table, columns in reference_columns(cr, translations=True).items():
+        _params = {
+            "table": sql.Identifier(table),
+            "where": sql.SQL(" OR ").join(
+                sql.SQL("{} {}").format(sql.Identifier(column), match)
+                for column in columns
+            ),
+        }
+        query_tail = sql.SQL(
+            """
 
-                FROM {table}
-                WHERE {ref_column} {match}
+            FROM {table}
+            WHERE {where}
 
-            """
-            ).format(**_params)
-            if ref_model == "ir.ui.view":
-                _query = sql.SQL("""SELECT id """) + query_tail
-                cr.execute(_query, locals())
-                for (view_id,) in cr.fetchall():
-                    remove_view(
-                        cr, view_id=view_id, deactivate_custom=True, silent=True
-                    )
-            elif ref_model == "ir.ui.menu":
-                _query = sql.SQL("""SELECT id """) + query_tail
-                cr.execute(_query, locals())
-                menu_ids = tuple(m[0] for m in cr.fetchall())
-                remove_menus(cr, menu_ids)
-            else:
-                _query = sql.SQL("""DELETE """) + query_tail
-                cr.execute(_query, locals())
-                # TODO make it recursive?
+        """
+        ).format(**_params)
+        if table == "ir_ui_view":
+            _query = sql.SQL("""SELECT id """) + query_tail
+            cr.execute(_query, locals())
+            remove_views(
+                cr,
+                [view_id for (view_id,) in cr.fetchall()],
+                deactivate_custom=True,
+                silent=True,
+            )
+        elif table == "ir_ui_menu":
+            _query = sql.SQL("""SELECT id """) + query_tail
+            cr.execute(_query, locals())
+            menu_ids = tuple(m[0] for m in cr.fetchall())
+            remove_menus(cr, menu_ids)
+        else:
+            _query = sql.SQL("""DELETE """) + query_tail
+            cr.execute(_query, locals())
+            # TODO make it recursive?
 
     if table_exists(cr, "ir_values"):
         column, _ = _ir_values_value(cr)
@@ -1703,7 +1998,7 @@ def remove_refs(cr, model, ids=None):
 
             DELETE
             FROM ir_translation
-            WHERE name = %(model)s
+            WHERE name = ANY(%(models)s)
               AND TYPE IN ('constraint',
                            'sql_constraint',
                            'view',
@@ -1792,6 +2087,7 @@ def rename_model(cr, old, new, rename_table=True):
         """
         ).format(**_params)
         cr.execute(_query, locals())
+        invalidate_schema(cr, old_table, new_table)
 
         # find & rename primary key, may still use an old name from a former migration
         _query = sql.SQL(
@@ -1876,39 +2172,39 @@ def rename_model(cr, old, new, rename_table=True):
         """
         ).format(**_params)
         cr.execute(_query, locals())
+    # ir_model_fields.model is one of them
+    invalidate_reference_columns(cr)
 
     # "model-comma" fields
-    _query = sql.SQL(
-        """
-
-        SELECT model,
-               name
-        FROM ir_model_fields
-        WHERE ttype = 'reference'
-        UNION
-        SELECT 'ir.translation',
-               'name'
-
-    """
-    )
-    cr.execute(_query, locals())
     old_like = "{},%".format(old)
-    substr_from = len(old)
-    for model, column in cr.fetchall():
-        table = table_of_model(cr, model)
-        if column_exists(cr, table, column):
-            _params = {"table": sql.Identifier(table), "column": sql.Identifier(column)}
+    substr_from = len(old) + 1
+    for table, columns in reference_columns(cr, translations=True).items():
+        _params = {
+            "table": sql.Identifier(table),
+            "set": sql.SQL(", ").join(
+                sql.SQL(
+                    """{column} = CASE WHEN {column} LIKE %(old_like)s
+                    THEN %(new)s || substring({column} FROM %(substr_from)s)
+                    ELSE {column} END"""
+                ).format(column=sql.Identifier(column))
+                for column in columns
+            ),
+            "where": sql.SQL(" OR ").join(
+                sql.SQL("{} LIKE %(old_like)s").format(sql.Identifier(column))
+                for column in columns
+            ),
+        }
 
-            _query = sql.SQL(
-                """
+        _query = sql.SQL(
+            """
 
-                UPDATE {table}
-                SET {column} = %(new)s || substring({column} FROM %(substr_from)s)
-                WHERE {column} LIKE %(old_like)s
+            UPDATE {table}
+            SET {set}
+            WHERE {where}
 
-            """
-            ).format(**_params)
-            cr.execute(_query, locals())
+        """
+        ).format(**_params)
+        cr.execute(_query, locals())
 
     if table_exists(cr, "ir_values"):
         column_read, cast_write = _ir_values_value(cr)
@@ -1999,45 +2295,86 @@ def replace_record_references(cr, old, new, replace_xmlid=True):
     )
 
 
+ID_MAPPING_TABLE = "_upgrade_id_mapping"
+# suffixes of the mapping tables, unique so that they can be nested
+_ID_MAPPING_TABLES = count()
+
+
+@contextmanager
+def id_mapping_table(cr, id_mapping):
+    """Load `id_mapping` into an indexed temporary table.
+
+    The mapping is sent once with `COPY`, so that statements can use it
+    through a join (`UPDATE ... FROM {table} m`, with columns `old_id` and
+    `new_id`, `table` being the name yielded) instead of embedding it.
+
+    The table is dropped when leaving the block, or at the latest with the
+    end of the transaction: after an error, the transaction is aborted and
+    left as is.
+    """
+    table = "{}_{}".format(ID_MAPPING_TABLE, next(_ID_MAPPING_TABLES))
+    _params = {"table": sql.Identifier(table)}
+    _query = sql.SQL(
+        """
+
+        CREATE TEMPORARY TABLE {table}(old_id integer PRIMARY KEY, new_id integer NOT NULL)
+        ON COMMIT DROP
+
+    """
+    ).format(**_params)
+    cr.execute(_query)
+    invalidate_schema(cr, table)
+    data = io.StringIO(
+        "".join("%d\t%d\n" % (old, new) for old, new in id_mapping.items())
+    )
+    cr.copy_expert(
+        sql.SQL("COPY {table}(old_id, new_id) FROM STDIN")
+        .format(**_params)
+        .as_string(cr._obj),
+        data,
+    )
+    # temporary tables are never analyzed automatically
+    cr.execute(sql.SQL("ANALYZE {table}").format(**_params))
+    yield table
+    cr.execute(sql.SQL("DROP TABLE {table}").format(**_params))
+    invalidate_schema(cr, table)
+
+
 def replace_record_references_batch(
     cr, id_mapping, model_src, model_dst=None, replace_xmlid=True
 ):
+    """Replace all (in)direct references of records by others.
+
+    The mapping is loaded once into a temporary table, every update is then
+    a join on it.
+
+        :param dict id_mapping: {old_id: new_id}
+        :param str model_src: model of the old records
+        :param str model_dst: model of the new records (default: `model_src`)
+        :param bool replace_xmlid: if True, xmlids of the old records are moved
+                                   to the new ones (default: True)
+    """
     assert id_mapping
     assert all(isinstance(v, int) and isinstance(k, int) for k, v in id_mapping.items())
 
     if model_dst is None:
         model_dst = model_src
 
-    old = tuple(id_mapping.keys())
-    new = tuple(id_mapping.values())
-    jmap = json.dumps(id_mapping)
+    with id_mapping_table(cr, id_mapping) as mapping:
+        _replace_record_references(
+            cr, mapping, model_src, model_dst, replace_xmlid=replace_xmlid
+        )
+
 
-    def genmap(fmt_k, fmt_v=None):
-        # generate map using given format
-        fmt_v = fmt_k if fmt_v is None else fmt_v
-        m = {fmt_k % k: fmt_v % v for k, v in id_mapping.items()}
-        return json.dumps(m), tuple(m.keys())
+def _replace_record_references(cr, mapping, model_src, model_dst, replace_xmlid):
+    mapping = sql.Identifier(mapping)
 
     if model_src == model_dst:
-        # 7 time faster than using pickle.dumps
-        pmap, pmap_keys = genmap("I%d\n.")
-        smap, smap_keys = genmap("%d")
-
         column_read, cast_write = _ir_values_value(cr)
 
         for table, fk, _, _ in get_fk(cr, table_of_model(cr, model_src)):
             _params = {"table": sql.Identifier(table), "fk": sql.Identifier(fk)}
 
-            jmap_query = sql.SQL(
-                """
-
-                UPDATE {table} t
-                SET {fk} = (%(jmap)s::json->>{fk}::varchar)::int4
-                WHERE {fk} IN %(old)s
-
-            """
-            ).format(**_params)
-
             col2 = None
             if not column_exists(cr, table, "id"):
                 # seems to be a m2m table. Avoid duplicated entries
@@ -2048,67 +2385,87 @@ def replace_record_references_batch(
                     "table": sql.Identifier(table),
                     "fk": sql.Identifier(fk),
                     "col2": sql.Identifier(col2),
-                    "jmap_query": jmap_query,
+                    "mapping": mapping,
                 }
 
                 _query = sql.SQL(
                     """
 
-                     WITH _existing AS
-                      ( SELECT {col2}
-                       FROM {table}
-                       WHERE {fk} IN %(new)s ) {jmap_query}
-                    AND NOT EXISTS
-                      (SELECT 1
-                       FROM _existing
-                       WHERE {col2}=t.{col2});
+                    UPDATE {table} t
+                    SET {fk} = m.new_id
+                    FROM {mapping} m
+                    WHERE t.{fk} = m.old_id
+                      AND NOT EXISTS
+                        (SELECT 1
+                         FROM {table} e
+                         WHERE e.{fk} = m.new_id
+                           AND e.{col2} = t.{col2});
 
 
                     DELETE
-                    FROM {table} WHERE {fk} IN %(old)s;
+                    FROM {table} t USING {mapping} m
+                    WHERE t.{fk} = m.old_id;
 
                 """
                 ).format(**_params)
-                cr.execute(_query, locals())
+                cr.execute(_query)
+            else:
+                _params["mapping"] = mapping
+                _query = sql.SQL(
+                    """
+
+                    UPDATE {table} t
+                    SET {fk} = m.new_id
+                    FROM {mapping} m
+                    WHERE t.{fk} = m.old_id
+
+                """
+                ).format(**_params)
+                cr.execute(_query)
 
             if not col2:  # it's a model
                 # update default values
                 # TODO? update all defaults using 1 query (using `WHERE (model, name) IN ...`)
                 model = model_of_table(cr, table)
                 if table_exists(cr, "ir_values"):
+                    # 7 time faster than using pickle.dumps
                     _params = {
                         "cast0": sql.SQL(cast_write.partition("%s")[0]),
                         "cast2": sql.SQL(cast_write.partition("%s")[2]),
-                        "column": sql.Identifier(column_read),
+                        "column": sql.SQL(column_read),
+                        "mapping": mapping,
                     }
 
                     _query = sql.SQL(
                         """
 
                         UPDATE ir_values
-                        SET value = {cast0} %(pmap)s::json->>({column}) {cast2}
+                        SET value = {cast0} 'I' || m.new_id || E'\\n.' {cast2}
+                        FROM {mapping} m
                         WHERE KEY='default'
                           AND model = %(model)s
                           AND name = %(fk)s
-                          AND {column} IN %(pmap_keys)s
+                          AND {column} = 'I' || m.old_id || E'\\n.'
 
                     """
                     ).format(**_params)
                     cr.execute(_query, locals())
                 else:
+                    _params = {"mapping": mapping}
                     _query = sql.SQL(
                         """
 
                         UPDATE ir_default d
-                        SET json_value = %(smap)s::json->>json_value
-                        FROM ir_model_fields f
+                        SET json_value = m.new_id::varchar
+                        FROM ir_model_fields f,
+                             {mapping} m
                         WHERE f.id = d.field_id
-                          AND model = %(model)s
-                          AND name = %(fk)s
-                          AND d.json_value IN %(pmap_keys)s
+                          AND f.model = %(model)s
+                          AND f.name = %(fk)s
+                          AND d.json_value = m.old_id::varchar
 
                     """
-                    )
+                    ).format(**_params)
                     cr.execute(_query, locals())
 
     # indirect references
@@ -2125,7 +2482,7 @@ def replace_record_references_batch(
             upd += sql.SQL(
                 "{model_id} = (SELECT id FROM ir_model WHERE model = %(model_dst)s),"
             ).format(**_params)
-        where = sql.SQL(ir.model_filter(placeholder="%(model_src)s"))
+        where = sql.SQL(ir.model_filter(prefix="t", placeholder="%(model_src)s"))
 
         _params = dict(
             {
@@ -2133,6 +2490,7 @@ def replace_record_references_batch(
                 "res_id": sql.Identifier(ir.res_id),
                 "upd": upd,
                 "where": where,
+                "mapping": mapping,
             },
             **_params
         )
@@ -2140,33 +2498,61 @@ def replace_record_references_batch(
         _query = sql.SQL(
             """
 
-            UPDATE {table}
-            SET {upd} {res_id} = (%(jmap)s::json->>{res_id}::varchar)::int4
+            UPDATE {table} t
+            SET {upd} {res_id} = m.new_id
+            FROM {mapping} m
             WHERE {where}
-              AND {res_id} IN %(old)s
+              AND t.{res_id} = m.old_id
 
         """
         ).format(**_params)
         cr.execute(_query, locals())
 
     # reference fields
-    cmap, cmap_keys = genmap("%s,%%d" % model_src, "%s,%%d" % model_dst)
-    cr.execute("SELECT model, name FROM ir_model_fields WHERE ttype='reference'")
-    for model, column in cr.fetchall():
-        table = table_of_model(cr, model)
-        if column_exists(cr, table, column):
-            _params = {"table": sql.Identifier(table), "column": sql.Identifier(column)}
+    src_prefix = "%s," % model_src
+    dst_prefix = "%s," % model_dst
+    for table, columns in reference_columns(cr).items():
+        # one join on the mapping per column: all the columns of a row are
+        # rewritten at once, even when they reference different records
+        aliases = ["m%d" % i for i in range(len(columns))]
+        _params = {
+            "table": sql.Identifier(table),
+            "mapping": mapping,
+            "set": sql.SQL(", ").join(
+                sql.SQL("{column} = COALESCE({alias}.new_ref, t.{column})").format(
+                    column=sql.Identifier(column), alias=sql.Identifier(alias)
+                )
+                for column, alias in zip(columns, aliases)
+            ),
+            "joins": sql.SQL(" ").join(
+                sql.SQL(
+                    "LEFT JOIN refs {alias} ON {alias}.old_ref = s.{column}"
+                ).format(column=sql.Identifier(column), alias=sql.Identifier(alias))
+                for column, alias in zip(columns, aliases)
+            ),
+            "where": sql.SQL(" OR ").join(
+                sql.SQL("{}.old_ref IS NOT NULL").format(sql.Identifier(alias))
+                for alias in aliases
+            ),
+        }
 
-            _query = sql.SQL(
-                """
+        _query = sql.SQL(
+            """
 
-                UPDATE {table}
-                SET {column} = %(cmap)s::json->>{column}
-                WHERE {column} IN %(cmap_keys)s
+            WITH refs AS (
+                SELECT %(src_prefix)s || old_id AS old_ref,
+                       %(dst_prefix)s || new_id AS new_ref
+                FROM {mapping}
+            )
+            UPDATE {table} t
+            SET {set}
+            FROM {table} s {joins}
+            WHERE s.id = t.id
+              AND ({where})
 
-            """
-            ).format(**_params)
-            cr.execute(_query, locals())
+        """
+        ).format(**_params)
+        cr.execute(_query, locals())
 
 
 # ---------- UI Utilities (Views, Menus) ----------
@@ -2242,87 +2628,177 @@ def remove_view(
             raise ValueError(
                 "{!r} should point to a 'ir.ui.view', not a {!r}".format(xml_id, model)
             )
-    elif not silent or deactivate_custom:
-        # search matching xmlid for logging or renaming of custom views
 
+    remove_views(cr, [view_id], deactivate_custom=deactivate_custom, silent=silent)
+
+
+def remove_views(cr, view_ids, deactivate_custom=DROP_DEPRECATED_CUSTOM, silent=False):
+    """
+    Delete the given views and their inherited views, set-based.
+
+    Same as `remove_view`, but the whole inheritance subtree of all the given
+    views is gathered by a single recursive query and then processed with a
+    fixed number of statements, whatever its size.
+
+        :param list view_ids: ids of the views
+        :param deactivate_custom=False: see `remove_view`
+        :param silent=False: if True, no log output will be generated
+    """
+    view_ids = list(view_ids)
+    if not view_ids:
+        return
+
+    # Built-in views (having an xmlid of a module) are removed along with
+    # their children; custom views stop the recursion. The given views are
+    # removed as long as they have an xmlid.
+    _query = sql.SQL(
+        """
+
+         WITH RECURSIVE xids AS
+          ( SELECT res_id AS id,
+                   min(module || '.' || name) AS xml_id
+           FROM ir_model_data
+           WHERE model = 'ir.ui.view'
+             AND module !~ '^_'
+           GROUP BY res_id ), tree(id, parent_id, root) AS
+          ( SELECT id, NULL::integer, TRUE
+           FROM ir_ui_view
+           WHERE id = ANY(%(view_ids)s)
+           UNION SELECT v.id, v.inherit_id, FALSE
+           FROM ir_ui_view v
+           JOIN tree t ON (v.inherit_id = t.id)
+           WHERE t.root
+             OR EXISTS
+               (SELECT 1
+                FROM xids
+                WHERE xids.id = t.id) )
+        SELECT t.id,
+               t.parent_id,
+               bool_or(t.root),
+               CASE
+                   WHEN bool_or(t.root) THEN
+                          (SELECT min(d.module || '.' || d.name)
+                           FROM ir_model_data d
+                           WHERE d.model = 'ir.ui.view'
+                             AND d.res_id = t.id)
+                   ELSE x.xml_id
+               END
+        FROM tree t
+        LEFT JOIN xids x ON (x.id = t.id)
+        GROUP BY t.id,
+                 t.parent_id,
+                 x.xml_id
+
+    """
+    )
+    cr.execute(_query, locals())
+    nodes = cr.fetchall()
+    xml_ids = {vid: xid for vid, _, _, xid in nodes}
+    roots = {vid for vid, _, root, _ in nodes if root}
+
+    to_remove, customs = [], []
+    for view_id, parent_id, root, xml_id in nodes:
+        if xml_id:
+            if not silent:
+                if view_id in roots:
+                    _logger.info(
+                        "Dropping deprecated built-in view %s (ID %s).",
+                        xml_id,
+                        view_id,
+                    )
+                else:
+                    _logger.info(
+                        "Dropping deprecated built-in view %s (ID %s), "
+                        "as parent %s (ID %s) is going to be removed",
+                        xml_id,
+                        view_id,
+                        xml_ids.get(parent_id),
+                        parent_id,
+                    )
+            to_remove.append(view_id)
+        elif view_id not in roots:
+            customs.append((view_id, parent_id))
+
+    if customs:
+        if not deactivate_custom:
+            child_id, parent_id = customs[0]
+            raise MigrationError(
+                "Deprecated custom view with ID %s needs migration, "
+                "as parent %s (ID %s) is going to be removed"
+                % (child_id, xml_ids.get(parent_id), parent_id)
+            )
+        if not silent:
+            for child_id, parent_id in customs:
+                _logger.warning(
+                    "Deactivating deprecated custom view with "
+                    "ID %s, as parent %s (ID %s) was removed",
+                    child_id,
+                    xml_ids.get(parent_id),
+                    parent_id,
+                )
         _query = sql.SQL(
             """
 
-            SELECT module,
-                   name
-            FROM ir_model_data
-            WHERE model='ir.ui.view'
-              AND res_id = %(view_id)s
+            UPDATE ir_ui_view v
+            SET name = (v.name || ' - old view, inherited from ' || c.parent),
+                model = (v.model || '.disabled'),
+                inherit_id = NULL
+            FROM unnest(%(ids)s, %(parents)s) AS c(id, parent)
+            WHERE v.id = c.id
 
         """
         )
-        cr.execute(_query, locals())
-        if cr.rowcount:
-            xml_id = "%s.%s" % cr.fetchone()
-        else:
-            xml_id = None
+        cr.execute(
+            _query,
+            {
+                "ids": [c for c, _ in customs],
+                "parents": [xml_ids.get(p) or str(p) for _, p in customs],
+            },
+        )
+
+    if not to_remove:
+        return
 
     _query = sql.SQL(
         """
 
+        DELETE
+        FROM ir_model_data
+        WHERE model = 'ir.ui.view'
+          AND res_id = ANY(%(to_remove)s);
+
 
-        SELECT v.id,
-               x.module || '.' || x.name
-        FROM ir_ui_view v
-        LEFT JOIN ir_model_data x ON ( v.id = x.res_id
-                                      AND x.model = 'ir.ui.view'
-                                      AND x.module !~ '^_' )
-        WHERE v.inherit_id = %(view_id)s
+        DELETE
+        FROM ir_ui_view
+        WHERE id = ANY(%(to_remove)s);
 
     """
     )
     cr.execute(_query, locals())
-    for child_id, child_xml_id in cr.fetchall():
-        if child_xml_id:
-            if not silent:
-                _logger.info(
-                    "Dropping deprecated built-in view %s (ID %s), "
-                    "as parent %s (ID %s) is going to be removed",
-                    child_xml_id,
-                    child_id,
-                    xml_id,
-                    view_id,
+
+    # delete all indirect references to the views
+    model = "ir.ui.view"
+    for ir_table, irs in indirect_references_by_table(cr, bound_only=True).items():
+        _params = {
+            "table": sql.Identifier(ir_table),
+            "where_clause": sql.SQL(" OR ").join(
+                sql.SQL("({where} AND {res_id} = ANY(%(to_remove)s))").format(
+                    where=sql.SQL(ir.model_filter(placeholder="%(model)s")),
+                    res_id=sql.Identifier(ir.res_id),
                 )
-            remove_view(
-                cr, child_xml_id, deactivate_custom=deactivate_custom, silent=True
-            )
-        else:
-            if deactivate_custom:
-                if not silent:
-                    _logger.warning(
-                        "Deactivating deprecated custom view with "
-                        "ID %s, as parent %s (ID %s) was removed",
-                        child_id,
-                        xml_id,
-                        view_id,
-                    )
-                disable_view_query = sql.SQL(
-                    """
+                for ir in irs
+            ),
+        }
+        _query = sql.SQL(
+            """
 
-                    UPDATE ir_ui_view
-                    SET name = (name || ' - old view, inherited from ' || %(xml_id)s),
-                        model = (model || '.disabled'),
-                        inherit_id = NULL
-                    WHERE id = %(child_id)s
+            DELETE
+            FROM {table}
+            WHERE {where_clause}
 
-                """
-                )
-                cr.execute(disable_view_query, locals())
-            else:
-                raise MigrationError(
-                    "Deprecated custom view with ID %s needs migration, "
-                    "as parent %s (ID %s) is going to be removed"
-                    % (child_id, xml_id, view_id)
-                )
-    if not silent:
-        _logger.info("Dropping deprecated built-in view %s (ID %s).", xml_id, view_id)
-    if xml_id:
-        remove_record(cr, xml_id)
+        """
+        ).format(**_params)
+        cr.execute(_query, locals())
 
 
 @contextmanager
@@ -2495,6 +2971,9 @@ def table_of_model(cr, model):
 
 def table_exists(cr, table):
     """Check if the specified table exists."""
+    catalog = schema_catalog(cr)
+    if catalog is not None:
+        return catalog.relkind(cr, table) in SchemaCatalog.TABLE_KINDS
     _query = sql.SQL(
         """
 
@@ -2516,6 +2995,9 @@ def column_exists(cr, table, column):
 
 def column_type(cr, table, column):
     """Get the type of the column on the specified table."""
+    catalog = schema_catalog(cr)
+    if catalog is not None:
+        return catalog.column_type(cr, table, column)
     _query = sql.SQL(
         """
 
@@ -2531,6 +3013,169 @@ def column_type(cr, table, column):
     return r[0] if r else None
 
 
+def _existing_columns(cr, columns):
+    """Return the subset of `(table, column)` pairs existing in the database."""
+    columns = set(columns)
+    if not columns:
+        return set()
+    catalog = schema_catalog(cr)
+    if catalog is not None:
+        return {c for c in columns if catalog.column_type(cr, *c) is not None}
+    _query = sql.SQL(
+        """
+
+        SELECT table_name,
+               column_name
+        FROM information_schema.columns
+        WHERE (table_name, column_name) IN %(columns)s
+
+    """
+    )
+    cr.execute(_query, {"columns": tuple(columns)})
+    return set(cr.fetchall())
+
+
+class SchemaCatalog(object):
+    """In-memory snapshot of the relations and columns of a database.
+
+    The whole catalog is loaded with a single query on first use, instead of
+    one `information_schema` round trip per `table_exists` / `column_exists` /
+    `column_type` call. Helpers of this module running DDL invalidate the
+    affected relations, which are then reloaded lazily on their next lookup.
+
+    The catalog is NOT aware of DDL run outside of these helpers: migration
+    scripts altering the schema by hand (`cr.execute("ALTER ...")`) must call
+    `invalidate_schema(cr, table)` before relying on `table_exists`,
+    `column_exists`, `column_type` (or any helper using them) again, else
+    these answer from the schema as it was before. dodoo-migrator invalidates
+    the whole catalog before each migration script runs.
+    """
+
+    TABLE_KINDS = ("r", "p")
+    VIEW_KINDS = ("v",)
+
+    _query = sql.SQL(
+        """
+
+        SELECT c.relname,
+               c.relkind,
+               a.attname,
+               COALESCE(bt.typname, t.typname)
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_attribute a ON ( a.attrelid = c.oid
+                                     AND a.attnum > 0
+                                     AND NOT a.attisdropped )
+        LEFT JOIN pg_type t ON t.oid = a.atttypid
+        LEFT JOIN pg_type bt ON ( bt.oid = t.typbasetype
+                                 AND t.typtype = 'd' )
+        WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f')
+          AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+          AND pg_table_is_visible(c.oid)
+          {where}
+
+    """
+    )
+
+    def __init__(self):
+        # NOTE the cursor is not kept: it is the key of the catalog
+        self._relkinds = None
+        self._columns = None
+        self._stale = set()
+        # derived data, cleared whenever the catalog is invalidated
+        self.memo = {}
+
+    def _load(self, cr, tables=None):
+        if tables is None:
+            where = sql.SQL("")
+        else:
+            where = sql.SQL("AND c.relname IN %(tables)s")
+            tables = tuple(tables)
+            for table in tables:
+                self._relkinds.pop(table, None)
+                self._columns.pop(table, None)
+        cr.execute(self._query.format(where=where), {"tables": tables})
+        for table, relkind, column, udt_name in cr.fetchall():
+            self._relkinds[table] = relkind
+            columns = self._columns.setdefault(table, {})
+            if column:
+                columns[column] = udt_name
+
+    def _ensure(self, cr):
+        if self._relkinds is None:
+            self._relkinds, self._columns = {}, {}
+            self._stale.clear()
+            self._load(cr)
+        elif self._stale:
+            self._load(cr, self._stale)
+            self._stale.clear()
+
+    def relkind(self, cr, table):
+        """Return the `pg_class.relkind` of `table` or None if not found."""
+        self._ensure(cr)
+        return self._relkinds.get(table)
+
+    def column_type(self, cr, table, column):
+        """Return the type name of `table.column` or None if not found."""
+        self._ensure(cr)
+        return self._columns.get(table, {}).get(column)
+
+    def invalidate(self, *tables):
+        """Forget about `tables` (or the whole catalog if none given)."""
+        self.memo.clear()
+        if self._relkinds is None:
+            return
+        if not tables:
+            self._relkinds = self._columns = None
+            return
+        self._stale.update(tables)
+
+    def invalidate_views(self):
+        """Forget about all known views (e.g. after a `DROP ... CASCADE`)."""
+        self.memo.clear()
+        if self._relkinds is None:
+            return
+        self._stale.update(t for t, k in self._relkinds.items() if k in self.VIEW_KINDS)
+
+
+_SCHEMA_CATALOGS = weakref.WeakKeyDictionary()
+
+
+def schema_catalog(cr):
+    """Get the schema catalog bound to `cr` (None if it cannot be cached)."""
+    try:
+        catalog = _SCHEMA_CATALOGS.get(cr)
+        if catalog is None:
+            catalog = _SCHEMA_CATALOGS[cr] = SchemaCatalog()
+    except TypeError:
+        # cursor types not supporting weak references are not cached
+        return None
+    return catalog
+
+
+def invalidate_schema(cr, *tables, **kw):
+    """Invalidate the schema catalog of `cr` after altering the schema.
+
+        :param tables: tables (or views) which have been created, altered or
+                       dropped; if none given, the whole catalog is reloaded
+                       on next use
+        :param bool cascade: if True, dependent views may have been dropped
+                             as well (default: False)
+    """
+    cascade = kw.pop("cascade", False)  # keyword-only argument
+    if kw:
+        raise TypeError("Unknown arguments: %s" % ", ".join(kw))
+    try:
+        catalog = _SCHEMA_CATALOGS.get(cr)
+    except TypeError:
+        return
+    if catalog is None:
+        return
+    catalog.invalidate(*tables)
+    if cascade:
+        catalog.invalidate_views()
+
+
 def create_column(cr, table, column, definition):
     """Create a column on the specified table.
 
@@ -2557,6 +3202,7 @@ def create_column(cr, table, column, definition):
         """
         ).format(**_params)
         cr.execute(_query, locals())
+        invalidate_schema(cr, table)
 
 
 def remove_column(cr, table, column, cascade=False):
@@ -2582,6 +3228,7 @@ def remove_column(cr, table, column, cascade=False):
         """
         ).format(**_params)
         cr.execute(_query, locals())
+        invalidate_schema(cr, table, cascade=cascade)
 
 
 def get_columns(cr, table, ignore=("id",), extra_prefixes=None):
@@ -2659,6 +3306,7 @@ def drop_depending_views(cr, table, column):
         """
         ).format(**_params)
         cr.execute(_query, locals())
+        invalidate_schema(cr, view, cascade=True)
 
 
 def get_fk(cr, table):
@@ -2829,6 +3477,9 @@ def pg_text2html(s):
 
 def view_exists(cr, view):
     """Check if the specified SQL view exists."""
+    catalog = schema_catalog(cr)
+    if catalog is not None:
+        return catalog.relkind(cr, view) in SchemaCatalog.VIEW_KINDS
 
     _query = sql.SQL(
         """
@@ -2898,11 +3549,16 @@ def remove_record(cr, name, deactivate=False, active_field="active"):
         cr.execute(_query, locals())
     else:
         # delete all indirect references to the record (e.g. mail_message entries, etc.)
-        for ir in indirect_references(cr, bound_only=True):
+        for ir_table, irs in indirect_references_by_table(cr, bound_only=True).items():
             _params = {
-                "table": sql.Identifier(ir.table),
-                "where_clause": sql.SQL(ir.model_filter(placeholder="%(model)s")),
-                "res_id": sql.Identifier(ir.res_id),
+                "table": sql.Identifier(ir_table),
+                "where_clause": sql.SQL(" OR ").join(
+                    sql.SQL("({where} AND {res_id} = %(res_id)s)").format(
+                        where=sql.SQL(ir.model_filter(placeholder="%(model)s")),
+                        res_id=sql.Identifier(ir.res_id),
+                    )
+                    for ir in irs
+                ),
             }
             _query = sql.SQL(
                 """
@@ -2910,7 +3566,6 @@ def remove_record(cr, name, deactivate=False, active_field="active"):
                 DELETE
                 FROM {table}
                 WHERE {where_clause}
-                  AND {res_id} = %(res_id)s
 
             """
             ).format(**_params)
@@ -2953,6 +3608,16 @@ class IndirectReference(
 
         return '{}"{}"={}'.format(prefix, column, placeholder)
 
+    def models_filter(self, prefix="", placeholder="%s"):
+        """Same as `model_filter`, with `placeholder` being an array of models."""
+        if prefix and prefix[-1] != ".":
+            prefix += "."
+        if self.res_model_id:
+            return '{}"{}" IN (SELECT id FROM ir_model WHERE model = ANY({}))'.format(
+                prefix, self.res_model_id, placeholder
+            )
+        return '{}"{}" = ANY({})'.format(prefix, self.res_model, placeholder)
+
 
 # allow the class to handle defaults implicitely
 IndirectReference.__new__.__defaults__ = (
@@ -2961,67 +3626,186 @@ IndirectReference.__new__.__defaults__ = (
 )  # https://stackoverflow.com/a/18348004
 
 
-def indirect_references(cr, bound_only=False):
-    IR = IndirectReference
-    each = [
-        IR("ir_attachment", "res_model", "res_id"),
-        IR("ir_cron", "model", None),
-        IR("ir_act_report_xml", "model", None),
-        IR("ir_act_window", "res_model", "res_id"),
-        IR("ir_act_window", "src_model", None),
-        IR("ir_act_server", "wkf_model_name", None),
-        IR("ir_act_server", "crud_model_name", None),
-        IR("ir_act_client", "res_model", None),
-        IR("ir_model", "model", None),
-        IR("ir_model_fields", "model", None),
-        # destination of a relation field
-        IR("ir_model_fields", "relation", None),
-        IR("ir_model_data", "model", "res_id"),
-        IR("ir_filters", "model_id", None),  # YUCK!, not an id
-        IR("ir_exports", "resource", None),
-        IR("ir_ui_view", "model", None),
-        IR("ir_values", "model", "res_id"),
-        IR("wkf_transition", "trigger_model", None),
-        IR("wkf_triggers", "model", None),
-        IR("ir_model_fields_anonymization", "model_name", None),
-        IR("ir_model_fields_anonymization_migration_fix", "model_name", None),
-        IR("base_import_import", "res_model", None),
-        IR("calendar_event", "res_model", "res_id"),  # new in saas~18
-        IR("mail_template", "model", None),
-        IR("mail_activity", "res_model", "res_id", "res_model_id"),
-        IR("mail_alias", None, "alias_force_thread_id", "alias_model_id"),
-        IR("mail_alias", None, "alias_parent_thread_id", "alias_parent_model_id"),
-        IR("mail_followers", "res_model", "res_id"),
-        IR("mail_message_subtype", "res_model", None),
-        IR("mail_message", "model", "res_id"),
-        IR("mail_compose_message", "model", "res_id"),
-        IR("mail_wizard_invite", "res_model", "res_id"),
-        IR("mail_mail_statistics", "model", "res_id"),
-        IR("mail_mass_mailing", "mailing_model", None),
-        IR("project_project", "alias_model", None),
-        IR("rating_rating", "res_model", "res_id", "res_model_id"),
-        IR("rating_rating", "parent_res_model", "parent_res_id", "parent_res_model_id"),
-    ]
-
-    for ir in each:
-        if bound_only and not ir.res_id:
-            continue
-        if ir.res_id and not column_exists(cr, ir.table, ir.res_id):
+INDIRECT_REFERENCES = (
+    IndirectReference("ir_attachment", "res_model", "res_id"),
+    IndirectReference("ir_cron", "model", None),
+    IndirectReference("ir_act_report_xml", "model", None),
+    IndirectReference("ir_act_window", "res_model", "res_id"),
+    IndirectReference("ir_act_window", "src_model", None),
+    IndirectReference("ir_act_server", "wkf_model_name", None),
+    IndirectReference("ir_act_server", "crud_model_name", None),
+    IndirectReference("ir_act_client", "res_model", None),
+    IndirectReference("ir_model", "model", None),
+    IndirectReference("ir_model_fields", "model", None),
+    # destination of a relation field
+    IndirectReference("ir_model_fields", "relation", None),
+    IndirectReference("ir_model_data", "model", "res_id"),
+    IndirectReference("ir_filters", "model_id", None),  # YUCK!, not an id
+    IndirectReference("ir_exports", "resource", None),
+    IndirectReference("ir_ui_view", "model", None),
+    IndirectReference("ir_values", "model", "res_id"),
+    IndirectReference("wkf_transition", "trigger_model", None),
+    IndirectReference("wkf_triggers", "model", None),
+    IndirectReference("ir_model_fields_anonymization", "model_name", None),
+    IndirectReference(
+        "ir_model_fields_anonymization_migration_fix", "model_name", None
+    ),
+    IndirectReference("base_import_import", "res_model", None),
+    IndirectReference("calendar_event", "res_model", "res_id"),  # new in saas~18
+    IndirectReference("mail_template", "model", None),
+    IndirectReference("mail_activity", "res_model", "res_id", "res_model_id"),
+    IndirectReference("mail_alias", None, "alias_force_thread_id", "alias_model_id"),
+    IndirectReference(
+        "mail_alias", None, "alias_parent_thread_id", "alias_parent_model_id"
+    ),
+    IndirectReference("mail_followers", "res_model", "res_id"),
+    IndirectReference("mail_message_subtype", "res_model", None),
+    IndirectReference("mail_message", "model", "res_id"),
+    IndirectReference("mail_compose_message", "model", "res_id"),
+    IndirectReference("mail_wizard_invite", "res_model", "res_id"),
+    IndirectReference("mail_mail_statistics", "model", "res_id"),
+    IndirectReference("mail_mass_mailing", "mailing_model", None),
+    IndirectReference("project_project", "alias_model", None),
+    IndirectReference("rating_rating", "res_model", "res_id", "res_model_id"),
+    IndirectReference(
+        "rating_rating", "parent_res_model", "parent_res_id", "parent_res_model_id"
+    ),
+)
+
+
+def _resolve_indirect_references(cr):
+    """Keep the `INDIRECT_REFERENCES` applicable to the current schema.
+
+    All the columns involved are checked at once.
+    """
+    existing = _existing_columns(
+        cr,
+        (
+            (ir.table, column)
+            for ir in INDIRECT_REFERENCES
+            for column in ir[1:]
+            if column
+        ),
+    )
+    result = []
+    for ir in INDIRECT_REFERENCES:
+        if ir.res_id and (ir.table, ir.res_id) not in existing:
             continue
 
         # some `res_model/res_model_id` combination may change between
         # versions (i.e. rating_rating.res_model_id was added in saas~15).
         # we need to verify existance of columns before using them.
-        if ir.res_model and not column_exists(cr, ir.table, ir.res_model):
+        if ir.res_model and (ir.table, ir.res_model) not in existing:
             ir = ir._replace(res_model=None)
-        if ir.res_model_id and not column_exists(cr, ir.table, ir.res_model_id):
+        if ir.res_model_id and (ir.table, ir.res_model_id) not in existing:
             ir = ir._replace(res_model_id=None)
         if not ir.res_model and not ir.res_model_id:
             continue
 
+        result.append(ir)
+    return result
+
+
+def indirect_references(cr, bound_only=False):
+    """Iterate on the indirect references existing in the database.
+
+    The resolution is memoized in the schema catalog of the cursor.
+
+        :param bool bound_only: if True, only yield references having a
+                                `res_id` column (default: False)
+    """
+    catalog = schema_catalog(cr)
+    if catalog is None:
+        irs = _resolve_indirect_references(cr)
+    else:
+        irs = catalog.memo.get("indirect_references")
+        if irs is None:
+            irs = catalog.memo["indirect_references"] = _resolve_indirect_references(cr)
+
+    for ir in irs:
+        if bound_only and not ir.res_id:
+            continue
         yield ir
 
 
+def indirect_references_by_table(cr, bound_only=False):
+    """Group `indirect_references` by table (keeping their order).
+
+        :rtype: OrderedDict
+        :return: {table: [IndirectReference, ...]}
+    """
+    grouped = OrderedDict()
+    for ir in indirect_references(cr, bound_only=bound_only):
+        grouped.setdefault(ir.table, []).append(ir)
+    return grouped
+
+
+def _resolve_reference_columns(cr):
+    """Group the existing "model-comma" columns by table.
+
+    All the columns involved are checked at once.
+    """
+    _query = sql.SQL(
+        """
+
+        SELECT model,
+               name
+        FROM ir_model_fields
+        WHERE ttype = 'reference'
+        ORDER BY 1,
+                 2
+
+    """
+    )
+    cr.execute(_query)
+    columns = [(table_of_model(cr, model), name) for model, name in cr.fetchall()]
+    existing = _existing_columns(cr, columns)
+    grouped = OrderedDict()
+    for table, column in columns:
+        if (table, column) not in existing:
+            continue
+        # NOTE table_exists is needed to avoid writing into views
+        if table not in grouped and not table_exists(cr, table):
+            continue
+        grouped.setdefault(table, []).append(column)
+    return grouped
+
+
+def reference_columns(cr, translations=False):
+    """Get the existing columns of reference fields, grouped by table.
+
+    The resolution is memoized in the schema catalog of the cursor.
+
+        :param bool translations: if True, also include `ir_translation.name`,
+                                  which holds "model,field" values
+                                  (default: False)
+        :rtype: OrderedDict
+        :return: {table: [column, ...]}
+    """
+    catalog = schema_catalog(cr)
+    if catalog is None:
+        grouped = _resolve_reference_columns(cr)
+    else:
+        grouped = catalog.memo.get("reference_columns")
+        if grouped is None:
+            grouped = catalog.memo["reference_columns"] = _resolve_reference_columns(cr)
+    if translations and column_exists(cr, "ir_translation", "name"):
+        # do not alter the memoized result
+        grouped = OrderedDict(grouped, ir_translation=["name"])
+    return grouped
+
+
+def invalidate_reference_columns(cr):
+    """Forget the memoized `reference_columns`.
+
+    To be called after adding, removing or renaming fields in
+    `ir_model_fields` by hand; the helpers of this module do it themselves.
+    """
+    catalog = schema_catalog(cr)
+    if catalog is not None:
+        catalog.memo.pop("reference_columns", None)
+
+
 def res_model_res_id(cr):
     """Iterate on base models having a field that references records by model/id.
 
@@ -3575,15 +4359,109 @@ def chunks(iterable, size, fmt=None):
         return
 
 
+def adaptive_chunks(
+    iterable,
+    size,
+    fmt=None,
+    target_time=5.0,
+    max_memory=None,
+    min_size=1,
+    max_size=None,
+    logger=_logger,
+    qualifier="elements",
+):
+    """
+    Same as `chunks`, but adapt the size of the chunks on the fly.
+
+    The time spent by the consumer on each chunk and the memory growth of the
+    process meanwhile are measured. The next chunk grows or shrinks (by a
+    factor 2 at most) toward `target_time`, while staying under `max_memory`.
+    Changes of size are logged at debug level, a summary at the end.
+
+        :param int size: size of the first chunk
+        :param fmt: see `chunks`
+        :param float target_time: targeted processing time of a chunk,
+                                  in seconds (default: 5.0)
+        :param int max_memory: memory ceiling (RSS) of the process in bytes;
+                               chunks are halved while it is exceeded
+                               (default: Odoo's `limit_memory_soft`; 0 to
+                               disable); ignored without `psutil`
+        :param int min_size: minimum size of a chunk (default: 1)
+        :param int max_size: maximum size of a chunk (default: 64 * size)
+    """
+    if fmt is None:
+        fmt = "".join
+    if max_memory is None:
+        max_memory = odoo.tools.config.get("limit_memory_soft") or 0
+    max_size = max_size or size * 64
+    if max_memory and _memory_usage() is None:
+        logger.debug("%s: psutil is not installed, no memory ceiling", qualifier)
+        max_memory = 0
+
+    it = iter(iterable)
+    sizes = []
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            break
+        rss0, t0 = _memory_usage() if max_memory else 0, time.time()
+        yield fmt(chunk)
+        elapsed, rss = time.time() - t0, _memory_usage() if max_memory else 0
+        sizes.append(len(chunk))
+
+        new_size = int(size * min(2.0, max(0.5, target_time / (elapsed or 1e-3))))
+        if max_memory:
+            if rss > max_memory:
+                new_size = size // 2
+            elif rss > rss0:
+                per_element = float(rss - rss0) / len(chunk)
+                new_size = min(new_size, int((max_memory - rss) / per_element))
+        new_size = max(min_size, min(max_size, new_size))
+        if new_size != size:
+            logger.debug(
+                "%s: chunk of %d processed in %.2fs (RSS %+d kB), next chunk: %d",
+                qualifier,
+                len(chunk),
+                elapsed,
+                (rss - rss0) // 1024,
+                new_size,
+            )
+        size = new_size
+
+    if sizes:
+        logger.info(
+            "%s: %d adaptive chunks processed (size min: %d, max: %d, last: %d)",
+            qualifier,
+            len(sizes),
+            min(sizes),
+            max(sizes),
+            sizes[-1],
+        )
+
+
+def _memory_usage():
+    """Return the resident memory of the current process in bytes, or None.
+
+    Without `psutil`, the current RSS cannot be measured (the peak RSS of
+    `resource` never decreases).
+    """
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss
+
+
 def iter_browse(model, *args, **kw):
     """
     Iterate and browse through record without filling the cache.
     `args` can be `cr, uid, ids` or just `ids` depending on kind of `model` (old/new api)
+
+    Pass `adaptive=True` to let `adaptive_chunks` adapt `chunk_size` on the fly.
     """
     assert len(args) in [1, 3]  # either (cr, uid, ids) or (ids,)
     cr_uid = args[:-1]
     ids = args[-1]
     chunk_size = kw.pop("chunk_size", 200)  # keyword-only argument
+    adaptive = kw.pop("adaptive", False)  # keyword-only argument
     logger = kw.pop("logger", _logger)
     if kw:
         raise TypeError("Unknow arguments: %s" % ", ".join(kw))
@@ -3598,7 +4476,18 @@ def iter_browse(model, *args, **kw):
         if 0:
             yield
 
-    it = chain.from_iterable(chunks(ids, chunk_size, fmt=browse))
+    if adaptive:
+        it = chain.from_iterable(
+            adaptive_chunks(
+                ids,
+                chunk_size,
+                fmt=browse,
+                logger=logger or _logger,
+                qualifier=model._name,
+            )
+        )
+    else:
+        it = chain.from_iterable(chunks(ids, chunk_size, fmt=browse))
     if logger:
         it = log_progress(it, qualifier=model._name, logger=logger, size=len(ids))
 
@@ -31,6 +31,7 @@ setup(
         "requests",
         "retrying",
     ],
+    extras_require={"metrics": ["prometheus_client"]},
     license="LGPLv3+",
     author="XOE Labs",
     author_email="info@xoe.solutions",
@@ -49,5 +50,7 @@ setup(
     entry_points="""
         [core_package.cli_plugins]
         migrate=dodoo_migrator.cli:migrate
+        backup=dodoo_migrator.cli:backup
+        index-scripts=dodoo_migrator.cli:index_scripts
     """,
 )
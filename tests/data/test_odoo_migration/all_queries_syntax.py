@@ -4,14 +4,39 @@ from odoo import migration
 
 migration.module_installed(cr, "base")  # noqa
 # ALSO TOUCHES: modules_installed
+
+# recompute first, while the schema is still intact
+migration.recompute_fields(
+    cr, "res.partner", ["display_name"], chunk_size=2, workers=2
+)  # noqa
+# ALSO TOUCHES: _recompute_fields_parallel
+migration.recompute_fields(
+    cr, "res.partner", ["display_name"], chunk_size=2, adaptive=True
+)  # noqa
+# ALSO TOUCHES: adaptive_chunks
+for _partner in migration.iter_browse(
+    migration.env(cr)["res.partner"], [1, 2, 3], chunk_size=2, adaptive=True
+):  # noqa
+    pass
+cr.execute("SELECT id FROM res_users ORDER BY id")  # noqa
+_ids = [r[0] for r in cr.fetchall()]  # noqa
+assert list(migration.iter_ids(cr, "res_users", page_size=1)) == _ids  # noqa
+migration.recompute_fields(cr, "res.partner", ["display_name"])  # noqa
+# ALSO TOUCHES: iter_ids
+# ALSO TOUCHES: estimate_count
 migration.remove_module(cr, "iap")  # noqa
 # ALSO TOUCHES: table_of_model
 # ALSO TOUCHES: table_exists
 # ALSO TOUCHES: remove_view
+# ALSO TOUCHES: remove_views
 # ALSO TOUCHES: remove_record
 # ALSO TOUCHES: remove_menus
 # ALSO TOUCHES: remove_model
+# ALSO TOUCHES: remove_models
 # ALSO TOUCHES: indirect_references
+# ALSO TOUCHES: indirect_references_by_table
+# ALSO TOUCHES: reference_columns
+# ALSO TOUCHES: invalidate_reference_columns
 # ALSO TOUCHES: column_exists
 # ALSO TOUCHES: column_type
 # ALSO TOUCHES: table_exists
@@ -59,10 +84,15 @@ migration.move_field_to_module(cr, "res.partner", "color", "base", "web")  # noq
 migration.rename_field(
     cr, "res.partner", "name", "name2", update_references=True
 )  # noqa
+# ALSO TOUCHES: rename_fields
 # ALSO TOUCHES: table_of_model
 # ALSO TOUCHES: table_exists
 # ALSO TOUCHES: column_exists
 # ALSO TOUCHES: update_field_references
+# ALSO TOUCHES: update_field_references_batch
+migration.update_field_references_batch(
+    cr, {"res.partner": {"name2": "name", "ref": "ref2"}}
+)  # noqa
 migration.make_field_company_dependent(
     cr, "res.partner", "title", "many2one", target_model="res.partner.title"
 )  # noqa
@@ -89,9 +119,15 @@ migration.replace_record_references(
     cr, ("res.partner", 2), (None, 1), replace_xmlid=True
 )  # noqa
 # ALSO TOUCHES: replace_record_references_batch
+# ALSO TOUCHES: id_mapping_table
 # ALSO TOUCHES: get_fk
 
 migration.create_column(cr, "res_partner", "new_col", "varchar")  # noqa
+# ALSO TOUCHES: invalidate_schema
+assert migration.column_exists(cr, "res_partner", "new_col")  # noqa
+migration.invalidate_schema(cr)  # noqa
+# ALSO TOUCHES: schema_catalog
+assert migration.column_type(cr, "res_partner", "new_col") == "varchar"  # noqa
 
 # TODO: construe a test case
 # migration.delete_unused(cr, table, xmlids, set_noupdate=True)  # noqa
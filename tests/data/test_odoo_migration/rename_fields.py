@@ -0,0 +1,63 @@
+from odoo import migration
+
+
+def _fetch(query):
+    cr.execute(query)  # noqa
+    return [r[0] for r in cr.fetchall()]  # noqa
+
+
+cr.execute(  # noqa
+    "ALTER TABLE res_partner ADD COLUMN x_old_a varchar, ADD COLUMN x_old_b varchar"
+)
+migration.invalidate_schema(cr, "res_partner")  # noqa
+cr.execute(  # noqa
+    """
+    WITH fields AS (
+        INSERT INTO ir_model_fields (model_id, model, name, field_description,
+                                     ttype, state)
+        SELECT m.id, m.model, n.name, n.name, 'char', 'manual'
+        FROM ir_model m, unnest(ARRAY['x_old_a', 'x_old_b']) AS n(name)
+        WHERE m.model = 'res.partner'
+        RETURNING id, name
+    )
+    INSERT INTO ir_model_data (module, model, name, res_id)
+    SELECT '__test__', 'ir.model.fields', 'field_res_partner__' || name, id
+    FROM fields
+"""
+)
+cr.execute("UPDATE res_partner SET x_old_a = 'a', x_old_b = 'b'")  # noqa
+
+migration.rename_fields(  # noqa
+    cr,  # noqa
+    "res.partner",
+    {"x_old_a": "x_new_a", "x_old_b": "x_new_b", "name": "name"},
+    update_references=False,
+)
+assert _fetch(
+    "SELECT name FROM ir_model_fields WHERE model = 'res.partner' "
+    "AND name LIKE 'x\\_%' ORDER BY name"
+) == ["x_new_a", "x_new_b"]
+assert _fetch(
+    "SELECT name FROM ir_model_data WHERE module = '__test__' ORDER BY name"
+) == ["field_res_partner__x_new_a", "field_res_partner__x_new_b"]
+assert _fetch(
+    "SELECT column_name FROM information_schema.columns "
+    "WHERE table_name = 'res_partner' AND column_name LIKE 'x\\_%' ORDER BY 1"
+) == ["x_new_a", "x_new_b"]
+assert set(_fetch("SELECT x_new_a || x_new_b FROM res_partner")) == {"ab"}
+assert migration.column_exists(cr, "res_partner", "x_new_a")  # noqa
+assert not migration.column_exists(cr, "res_partner", "x_old_a")  # noqa
+
+# renaming a field to its own name does nothing
+migration.rename_field(cr, "res.partner", "x_new_a", "x_new_a")  # noqa
+assert migration.column_exists(cr, "res_partner", "x_new_a")  # noqa
+
+# swaps must be split
+try:
+    migration.rename_fields(  # noqa
+        cr, "res.partner", {"x_new_a": "x_new_b", "x_new_b": "x_new_a"}  # noqa
+    )
+except ValueError:
+    pass
+else:
+    raise AssertionError("swapping fields in one go must fail")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This file is part of the dodoo-migrator (R) project.
+# Copyright (c) 2018 Camptocamp SA and XOE Corp. SAS
+# Authors: Guewen Baconnier, Leonardo Pistone, David Arnold, et al.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import gzip
+import io
+import os
+import zlib
+
+from dodoo_migrator.migration.upgradeservice import archive
+
+
+class Sink(io.BytesIO):
+    def close(self):
+        self.value = self.getvalue()
+        io.BytesIO.close(self)
+
+
+def _members(data):
+    """Return the number of gzip members of `data`."""
+    count = 0
+    while data:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        decompressor.decompress(data)
+        data = decompressor.unused_data
+        count += 1
+    return count
+
+
+def test_parallel_gzip_writer():
+    data = os.urandom(10000) + b"x" * 50000
+    sink = Sink()
+    writer = archive.ParallelGzipWriter(sink, 2, chunk_size=4096)
+    for i in range(0, len(data), 1000):
+        writer.write(data[i : i + 1000])
+    writer.close()
+    assert sink.closed
+    # a chunk is compressed once 4096 bytes are buffered: 5 writes
+    assert _members(sink.value) == 12
+    assert gzip.GzipFile(fileobj=io.BytesIO(sink.value)).read() == data
+
+
+def test_parallel_gzip_writer_small():
+    sink = Sink()
+    writer = archive.ParallelGzipWriter(sink, 4)
+    writer.write(b"SELECT 1;\n")
+    writer.close()
+    assert _members(sink.value) == 1
+    assert gzip.GzipFile(fileobj=io.BytesIO(sink.value)).read() == b"SELECT 1;\n"
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This file is part of the dodoo-migrator (R) project.
+# Copyright (c) 2018 Camptocamp SA and XOE Corp. SAS
+# Authors: Guewen Baconnier, Leonardo Pistone, David Arnold, et al.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+
+import pytest
+
+from dodoo_migrator.migration.upgradeservice import db
+
+
+class Conn(object):
+    dbname = "prod"
+
+
+def _record(calls, name):
+    def func(*args):
+        calls.append((name,) + args)
+
+    return func
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    for name in (
+        "_drop_database",
+        "_release_lock",
+        "_reestablish_lock",
+        "_check_database",
+        "_swap_database",
+    ):
+        monkeypatch.setattr(db, name, _record(calls, name))
+    monkeypatch.setattr(db, "SHADOW_RESTORE", None)
+    return calls
+
+
+class FakeConfig(object):
+    def __init__(self, root):
+        self.root = root
+
+    def filestore(self, db_name):
+        return os.path.join(self.root, db_name)
+
+
+@pytest.fixture
+def filestores(tmpdir, monkeypatch):
+    root = tmpdir.join("filestore")
+
+    class odoo(object):
+        class tools(object):
+            config = FakeConfig(str(root))
+
+    monkeypatch.setattr(db, "odoo", odoo)
+    root.join("prod", "ab", "abc").write("current", ensure=True)
+    root.join("prod", "cd", "cde").write("changed", ensure=True)
+    # left over by an earlier run
+    root.join("prod_previous", "ab", "abc").write("old", ensure=True)
+    return root
+
+
+class Service(object):
+    def __init__(self, error=None):
+        self.error = error
+
+    def download(self, pipe):
+        pipe.write(b"dump")
+        if self.error:
+            raise self.error
+
+
+def _read(stream):
+    return b"".join(iter(lambda: stream.read(1024), b""))
+
+
+def test_pipelined_retrieve_restores_into_shadow(calls, filestores, monkeypatch):
+    restored = []
+    monkeypatch.setattr(
+        db,
+        "_restore_stream",
+        lambda name, stream: restored.append((name, _read(stream))),
+    )
+    conn = Conn()
+    db._retrieve_pipelined(conn, Service())
+    assert restored == [("prod_shadow", b"dump")]
+    assert calls == [
+        ("_drop_database", "prod_shadow"),
+        ("_check_database", "prod_shadow"),
+        ("_drop_database", "prod_previous"),
+        ("_release_lock", conn),
+        ("_swap_database", "prod", "prod_shadow", "prod_previous"),
+        ("_reestablish_lock", conn),
+        ("_drop_database", "prod_previous"),
+    ]
+
+
+def test_pipelined_retrieve_interrupted(calls, filestores, monkeypatch):
+    monkeypatch.setattr(db, "_restore_stream", lambda name, stream: _read(stream))
+    with pytest.raises(IOError):
+        db._retrieve_pipelined(Conn(), Service(IOError("Connection lost")))
+    # the database is left untouched
+    assert calls == [
+        ("_drop_database", "prod_shadow"),
+        ("_drop_database", "prod_shadow"),
+    ]
+
+
+def _restore_filestore(root):
+    def restore(db_name):
+        filestore = root.join(db_name)
+        # attachments are replaced by renames, like sync_zip does
+        tmp = filestore.join("cd", "cde.tmp")
+        tmp.write("new")
+        tmp.rename(filestore.join("cd", "cde"))
+        filestore.join("ef", "efg").write("added", ensure=True)
+
+    return restore
+
+
+def _files(path):
+    return {p.relto(path): p.read() for p in path.visit() if p.check(file=True)}
+
+
+def test_shadow_restore(calls, filestores, monkeypatch):
+    monkeypatch.setattr(db, "SHADOW_RESTORE", "1")
+    conn = Conn()
+    db._restore_database(conn, _restore_filestore(filestores))
+    assert sorted(p.basename for p in filestores.listdir()) == ["prod"]
+    assert _files(filestores.join("prod")) == {
+        os.path.join("ab", "abc"): "current",
+        os.path.join("cd", "cde"): "new",
+        os.path.join("ef", "efg"): "added",
+    }
+    assert calls == [
+        ("_drop_database", "prod_shadow"),
+        ("_check_database", "prod_shadow"),
+        ("_drop_database", "prod_previous"),
+        ("_release_lock", conn),
+        ("_swap_database", "prod", "prod_shadow", "prod_previous"),
+        ("_reestablish_lock", conn),
+        ("_drop_database", "prod_previous"),
+    ]
+
+
+def test_shadow_restore_failed_check(calls, filestores, monkeypatch):
+    def check(db_name):
+        raise Exception("No active user in %s" % db_name)
+
+    monkeypatch.setattr(db, "_check_database", check)
+    monkeypatch.setattr(db, "SHADOW_RESTORE", "1")
+    with pytest.raises(Exception):
+        db._restore_database(Conn(), _restore_filestore(filestores))
+    # the database and its filestore are left untouched
+    assert calls == [
+        ("_drop_database", "prod_shadow"),
+        ("_drop_database", "prod_shadow"),
+    ]
+    assert not filestores.join("prod_shadow").check()
+    assert _files(filestores.join("prod")) == {
+        os.path.join("ab", "abc"): "current",
+        os.path.join("cd", "cde"): "changed",
+    }
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This file is part of the dodoo-migrator (R) project.
+# Copyright (c) 2018 Camptocamp SA and XOE Corp. SAS
+# Authors: Guewen Baconnier, Leonardo Pistone, David Arnold, et al.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import hashlib
+import os
+import zipfile
+
+import pytest
+
+from dodoo_migrator.migration.upgradeservice import filestore
+
+
+def _sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _zip(tmpdir, members):
+    fname = str(tmpdir.join("upgraded.zip"))
+    with zipfile.ZipFile(fname, "w") as z:
+        z.writestr("dump.sql", b"SELECT 1;\n")
+        for name, data in members.items():
+            z.writestr(name, data)
+    return fname
+
+
+def test_is_current(tmpdir):
+    data = b"attachment"
+    path = tmpdir.join(_sha1(data))
+    assert not filestore.is_current(str(path), len(data))
+    path.write_binary(data)
+    assert filestore.is_current(str(path), len(data))
+    assert not filestore.is_current(str(path), len(data) + 1)
+    # same size, other content
+    path.write_binary(b"Attachment")
+    assert not filestore.is_current(str(path), len(data))
+    # not named after its checksum
+    other = tmpdir.join("attachment")
+    other.write_binary(data)
+    assert not filestore.is_current(str(other), len(data))
+
+
+def test_sync_zip(tmpdir):
+    contents = [b"first", b"second", b"third"]
+    members = {
+        "filestore/%s/%s" % (_sha1(data)[:2], _sha1(data)): data for data in contents
+    }
+    fname = _zip(tmpdir, members)
+    dest = tmpdir.join("filestore")
+    # one attachment is already there, another one is corrupted
+    current = dest.join(_sha1(b"first")[:2], _sha1(b"first"))
+    current.write_binary(b"first", ensure=True)
+    corrupted = dest.join(_sha1(b"second")[:2], _sha1(b"second"))
+    corrupted.write_binary(b"SECOND", ensure=True)
+
+    stats = filestore.sync_zip(fname, "filestore/", str(dest), 2)
+    assert stats == {"extracted": 2, "skipped": 1}
+    for name, data in members.items():
+        assert dest.join(name[len("filestore/") :]).read_binary() == data
+    assert not dest.join("dump.sql").check()
+    assert not [p for p in dest.visit() if p.basename.endswith(".tmp")]
+
+    assert filestore.sync_zip(fname, "filestore/", str(dest), 2) == {"skipped": 3}
+
+
+def test_sync_zip_unsafe_member(tmpdir):
+    fname = _zip(tmpdir, {"filestore/../../evil": b"evil"})
+    with pytest.raises(ValueError):
+        filestore.sync_zip(fname, "filestore/", str(tmpdir.join("filestore")), 2)
+    assert not os.path.exists(str(tmpdir.join("evil")))
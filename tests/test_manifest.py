@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This file is part of the dodoo-migrator (R) project.
+# Copyright (c) 2018 Camptocamp SA and XOE Corp. SAS
+# Authors: Guewen Baconnier, Leonardo Pistone, David Arnold, et al.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+import hashlib
+import os
+
+import pytest
+
+from dodoo_migrator.migration.upgradeservice.manifest import TransferManifest
+
+BLOCK = 16
+
+
+@pytest.fixture
+def transfer(tmpdir):
+    data = os.urandom(5 * BLOCK + 3)
+    localpath = tmpdir.join("db.tar.gz")
+    localpath.write_binary(data)
+    header = {
+        "request": 1,
+        "remote": "user@stub:22",
+        "direction": "upload",
+        "localpath": str(localpath),
+        "remotepath": "db.tar.gz",
+        "size": len(data),
+        "block_size": BLOCK,
+    }
+    return str(localpath), header, data
+
+
+def _digest(data, index):
+    return hashlib.sha256(data[index * BLOCK : (index + 1) * BLOCK]).hexdigest()
+
+
+def test_blocks(transfer):
+    localpath, header, data = transfer
+    manifest = TransferManifest.create(localpath, header)
+    assert manifest.block_count == 6
+    assert manifest.block_range(5) == (5 * BLOCK, len(data))
+    assert manifest.missing() == list(range(6))
+
+
+def test_resume(transfer):
+    localpath, header, data = transfer
+    manifest = TransferManifest.create(localpath, header)
+    for index in (0, 2, 3):
+        manifest.record(index, _digest(data, index))
+    with open(manifest.path, "a") as f:
+        # incomplete last lines of an interrupted run
+        f.write("4 ab\n5")
+    manifest = TransferManifest.load(localpath, header)
+    assert manifest.missing() == [1, 5]
+    # the truncated checksum does not match
+    assert manifest.verify() == [4]
+    assert manifest.missing() == [1, 4, 5]
+
+
+def test_other_transfer_is_discarded(transfer):
+    localpath, header, data = transfer
+    TransferManifest.create(localpath, header).record(0, _digest(data, 0))
+    assert TransferManifest.load(localpath, dict(header, request=2)) is None
+    assert TransferManifest.load(localpath, dict(header, remote="u@other:22")) is None
+    assert TransferManifest.load(localpath, dict(header, size=1)) is None
+    assert TransferManifest.load(localpath, header).missing() == list(range(1, 6))
+
+
+def test_verify(transfer):
+    localpath, header, data = transfer
+    manifest = TransferManifest.create(localpath, header)
+    for index in range(6):
+        manifest.record(index, _digest(data, index))
+    with open(localpath, "r+b") as f:
+        f.seek(BLOCK + 1)
+        f.write(b"x" if data[BLOCK + 1 : BLOCK + 2] != b"x" else b"y")
+    assert manifest.verify() == [1]
+    assert manifest.missing() == [1]
+    # the sidecar is rewritten without the corrupted block
+    assert TransferManifest.load(localpath, header).missing() == [1]
+
+
+def test_unlink(transfer):
+    localpath, header, _ = transfer
+    TransferManifest.create(localpath, header)
+    TransferManifest(localpath).unlink()
+    assert not os.path.exists(localpath + ".manifest")
+    assert TransferManifest.load(localpath, header) is None
+    # nothing to remove
+    TransferManifest(localpath).unlink()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This file is part of the dodoo-migrator (R) project.
+# Copyright (c) 2018 Camptocamp SA and XOE Corp. SAS
+# Authors: Guewen Baconnier, Leonardo Pistone, David Arnold, et al.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import socket
+
+import pytest
+
+from dodoo_migrator import metrics
+
+pytest.importorskip("prometheus_client")
+
+
+def _value(name, **labels):
+    return metrics.REGISTRY.get_sample_value(name, labels)
+
+
+def test_timed(monkeypatch):
+    times = iter([100.0, 102.5])
+    monkeypatch.setattr(metrics.time, "time", lambda: next(times))
+    with pytest.raises(RuntimeError):
+        with metrics.timed(metrics.RESTORE_SECONDS, step="test"):
+            raise RuntimeError()
+    assert _value("dodoo_migrator_restore_duration_seconds", step="test") == 2.5
+
+
+def test_record_transfer(monkeypatch):
+    monkeypatch.setattr(metrics.time, "time", lambda: 104.0)
+    metrics.record_transfer("test", 1000, 100.0)
+    name = "dodoo_migrator_transfer_throughput_bytes_per_second"
+    assert _value(name, direction="test") == 250
+    # too fast to be measured
+    metrics.record_transfer("test", 1000, 104.0)
+    assert _value(name, direction="test") == 250
+
+
+def test_textfile_fallback(tmpdir, monkeypatch):
+    monkeypatch.setattr(metrics, "TEXTFILE_INTERVAL", 0.01)
+    busy = socket.socket()
+    busy.bind(("", 0))
+    busy.listen(1)
+    monkeypatch.setattr(metrics.tempfile, "gettempdir", lambda: str(tmpdir))
+    try:
+        # the port is taken: the metrics go to a textfile instead
+        metrics.start(busy.getsockname()[1], None)
+        metrics.WATCH_POLLS.inc()
+    finally:
+        metrics.stop()
+        busy.close()
+    assert "dodoo_migrator_watch_polls" in tmpdir.join("dodoo_migrator.prom").read()
+    assert not metrics._textfile
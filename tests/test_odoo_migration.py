@@ -60,3 +60,40 @@ def test_all_queries_without_validating_result(odoodb, odoocfg):
         ],
     )
     assert result.exit_code == 0
+
+
+def test_rename_fields(odoodb, odoocfg):
+    """ Test what rename_fields changes in the database. """
+    if odoo.release.version_info[0] != 12:
+        pytest.skip("the fields are created as in v12.")
+    result = CliRunner().invoke(
+        migrate,
+        [
+            "-d",
+            odoodb,
+            "-c",
+            str(odoocfg),
+            "--file",
+            DATADIR + ".mig-0.5.0-test-rename-fields.yaml",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+
+def _adaptive_sizes(monkeypatch, psutil):
+    from odoo import migration
+
+    monkeypatch.setattr(migration.migration, "psutil", psutil)
+    chunks = migration.adaptive_chunks(range(100), 2, fmt=list, max_memory=1)
+    return [len(chunk) for chunk in chunks]
+
+
+def test_adaptive_chunks_memory_ceiling(monkeypatch):
+    psutil = pytest.importorskip("psutil")
+    # the ceiling is always exceeded: the chunks are halved
+    assert _adaptive_sizes(monkeypatch, psutil)[:3] == [2, 1, 1]
+
+
+def test_adaptive_chunks_without_psutil(monkeypatch):
+    # the ceiling cannot be checked: the fast chunks double
+    assert _adaptive_sizes(monkeypatch, None) == [2, 4, 8, 16, 32, 38]
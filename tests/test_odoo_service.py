@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This file is part of the dodoo-migrator (R) project.
+# Copyright (c) 2018 Camptocamp SA and XOE Corp. SAS
+# Authors: Guewen Baconnier, Leonardo Pistone, David Arnold, et al.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+import io
+import json
+import os
+import threading
+import time
+
+import pytest
+import requests
+
+from dodoo_migrator.migration.upgradeservice import odoo_service
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+DONE = (200, 0, {"request": {"state": "done"}})
+CINFO = {"host": "stub", "username": "user", "port": 22}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep the connections alive
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.paths.append(self.path.split("?")[0])
+        server.clients.add(self.client_address)
+        status, delay, body = server.responses.pop(0) if server.responses else DONE
+        time.sleep(delay)
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubService(ThreadingMixIn, HTTPServer):
+    """Upgrade service answering the queued (status, delay, body) responses."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), StubHandler)
+        self.responses = []
+        self.paths = []
+        self.clients = set()
+
+    def handle_error(self, request, client_address):
+        # the client went away after a timeout
+        pass
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(odoo_service, "RETRY_BACKOFF", 0)
+    monkeypatch.setattr(odoo_service, "TIMEOUT", (1, 0.5))
+    server = StubService()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    api = odoo_service.UpgradeApi(
+        "test", "test", "12.0", "contract", "email", "public", b"private"
+    )
+    api.api_url = "http://127.0.0.1:%d" % server.server_port
+    api.request_id, api.key = 1, "key"
+    try:
+        yield server, api
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_calls_share_a_connection(service):
+    server, api = service
+    for _ in range(3):
+        assert api.status(max_age=0) == {"state": "done"}
+    assert len(server.paths) == 3
+    assert len(server.clients) == 1
+
+
+def test_status_is_cached(service):
+    server, api = service
+    assert api.is_ready()
+    assert not api.has_converted_to_zip()
+    assert server.paths == ["/status"]
+
+
+def test_retry_on_server_errors(service):
+    server, api = service
+    server.responses = [(503, 0, {}), (502, 0, {}), DONE]
+    assert api.status(max_age=0) == {"state": "done"}
+    assert server.paths == ["/status"] * 3
+
+
+def test_retries_are_bounded(service):
+    server, api = service
+    server.responses = [(503, 0, {})] * (odoo_service.RETRIES + 1)
+    with pytest.raises(requests.exceptions.RetryError):
+        api.status(max_age=0)
+    assert len(server.paths) == odoo_service.RETRIES + 1
+
+
+def test_no_retry_on_client_errors(service):
+    server, api = service
+    server.responses = [(404, 0, {"failures": ["not found"]})]
+    with pytest.raises(odoo_service.OdooUpgradeServiceError):
+        api.status(max_age=0)
+    assert len(server.paths) == 1
+
+
+@pytest.mark.parametrize(
+    "call, path", [("request", "/create"), ("process", "/process")]
+)
+def test_no_retry_on_read_timeout(service, call, path):
+    server, api = service
+    api._submitted = True
+    server.responses = [(200, 2, {"request": {"id": 1, "key": "key"}})]
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        getattr(api, call)()
+    assert server.paths == [path]
+
+
+@pytest.mark.parametrize(
+    "call, path", [("request", "/create"), ("process", "/process")]
+)
+def test_no_retry_on_server_errors(service, call, path):
+    server, api = service
+    api._submitted = True
+    server.responses = [(502, 0, {})]
+    with pytest.raises(requests.exceptions.HTTPError):
+        getattr(api, call)()
+    assert server.paths == [path]
+
+
+class StubFile(object):
+    def __init__(self, connection, path, mode):
+        self.connection = connection
+        self.f = open(path, mode + "b")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def prefetch(self, size):
+        pass
+
+    def seek(self, offset):
+        self.f.seek(offset)
+
+    def _spend(self, size):
+        """Return how much of `size` bytes can go through the connection."""
+        budget = self.connection.budget
+        if budget is None:
+            return size
+        self.connection.budget = max(budget - size, 0)
+        return min(size, budget)
+
+    def read(self, size):
+        if self._spend(size) < size:
+            raise IOError("Connection lost")
+        return self.f.read(size)
+
+    def write(self, data):
+        size = self._spend(len(data))
+        self.f.write(data[:size])
+        if size < len(data):
+            raise IOError("Connection lost")
+
+
+class StubConnection(object):
+    """`pysftp.Connection` to the local directory `root`.
+
+    Each connection pops the number of bytes it can transfer before breaking
+    from `budgets` (None: unlimited).
+    """
+
+    root = None
+    budgets = []
+    opened = []
+
+    def __init__(self, **cinfo):
+        self.budget = self.budgets.pop(0) if self.budgets else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def exists(self, path):
+        return os.path.exists(os.path.join(self.root, path))
+
+    def stat(self, path):
+        return os.stat(os.path.join(self.root, path))
+
+    def open(self, path, mode):
+        self.opened.append((path, mode))
+        return StubFile(self, os.path.join(self.root, path), mode)
+
+
+class StubPysftp(object):
+    Connection = StubConnection
+
+
+@pytest.fixture
+def sftp(tmpdir, monkeypatch):
+    remote = tmpdir.mkdir("remote")
+    monkeypatch.setattr(StubConnection, "root", str(remote))
+    monkeypatch.setattr(StubConnection, "budgets", [])
+    monkeypatch.setattr(StubConnection, "opened", [])
+    monkeypatch.setattr(odoo_service, "pysftp", StubPysftp)
+    api = odoo_service.UpgradeApi(
+        "test", "test", "12.0", "contract", "email", "public", b"private"
+    )
+    api.request_id, api.key = 1, "key"
+    api._cinfo = lambda: dict(CINFO)
+    return remote, api
+
+
+def test_replay_buffer_retains_window():
+    buf = odoo_service.ReplayBuffer(10)
+    for data in (b"abcd", b"efgh", b"ijkl", b"mnop"):
+        buf.append(data)
+    # the oldest chunk is not needed to cover the last 10 bytes
+    assert (buf.start, buf.end) == (4, 16)
+    assert b"".join(buf.since(6)) == b"ghijklmnop"
+    assert b"".join(buf.since(16)) == b""
+    with pytest.raises(odoo_service.ResumeError):
+        list(buf.since(3))
+
+
+def test_upload_stream_resumes(sftp):
+    remote, api = sftp
+    data = os.urandom(200 * 1024)
+    # the first connection breaks after 50000 bytes
+    StubConnection.budgets = [50000]
+    api.upload_stream(io.BytesIO(data), window=1024 * 1024)
+    assert remote.join(api.filename).read_binary() == data
+    assert [mode for _, mode in StubConnection.opened] == ["w", "a"]
+
+
+@pytest.fixture
+def segmented(sftp, tmpdir, monkeypatch):
+    remote, api = sftp
+    monkeypatch.setattr(odoo_service, "BLOCK_SIZE", 1024)
+    api._status, api._status_time = {"state": "done"}, time.time()
+    api._request_sftp_access = {"hostname": "stub"}
+    data = os.urandom(10 * 1024 + 100)
+    remote.join(api.upgraded_filename).write_binary(data)
+    return api, data, str(tmpdir.join("upgraded.zip"))
+
+
+def _downloaded_blocks():
+    return len([mode for _, mode in StubConnection.opened if mode == "r"])
+
+
+def test_segmented_download(segmented):
+    api, data, localpath = segmented
+    states = []
+    api.download_segmented(localpath, 3, save_state=states.append)
+    with open(localpath, "rb") as f:
+        assert f.read() == data
+    assert _downloaded_blocks() == 11
+    assert states[0]["localpath"] == localpath
+    assert states[0]["size"] == len(data)
+
+
+def test_segmented_download_resumes(segmented):
+    api, data, localpath = segmented
+    # the connection transferring the blocks breaks during the third one
+    StubConnection.budgets = [None, 3000]
+    api.download_segmented(localpath, 1)
+    assert _downloaded_blocks() == 11 + 1
+    with open(localpath, "rb") as f:
+        assert f.read() == data
+
+
+def test_segmented_download_from_manifest(segmented):
+    api, data, localpath = segmented
+    api.download_segmented(localpath, 2)
+    # a later run finds a corrupted block and a block never confirmed
+    with open(localpath, "r+b") as f:
+        f.seek(2 * 1024)
+        f.write(b"corrupted")
+    with open(localpath + ".manifest") as f:
+        lines = f.readlines()
+    with open(localpath + ".manifest", "w") as f:
+        f.writelines(line for line in lines if not line.startswith("5 "))
+    del StubConnection.opened[:]
+    api.download_segmented(localpath, 2)
+    assert _downloaded_blocks() == 2
+    with open(localpath, "rb") as f:
+        assert f.read() == data
+
+
+def test_segmented_upload(sftp, tmpdir, monkeypatch):
+    remote, api = sftp
+    monkeypatch.setattr(odoo_service, "BLOCK_SIZE", 1024)
+    data = os.urandom(5 * 1024)
+    localpath = tmpdir.join("db.tar.gz")
+    localpath.write_binary(data)
+    api.upload_segmented(str(localpath), 4)
+    assert remote.join(api.filename).read_binary() == data
+    assert api._submitted
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This file is part of the dodoo-migrator (R) project.
+# Copyright (c) 2018 Camptocamp SA and XOE Corp. SAS
+# Authors: Guewen Baconnier, Leonardo Pistone, David Arnold, et al.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import gzip
+import io
+import threading
+
+import pytest
+
+from dodoo_migrator.migration.upgradeservice import pipeline
+
+
+def _gzip(data):
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode="wb") as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def _read(reader, size=-1):
+    chunks = []
+    for data in iter(lambda: reader.read(size), b""):
+        chunks.append(data)
+    return b"".join(chunks)
+
+
+def test_pipe_from():
+    def download(pipe):
+        for i in range(100):
+            pipe.write(b"%03d" % i)
+
+    pipe = pipeline.pipe_from(download, maxsize=2)
+    assert _read(pipe, 2) == b"".join(b"%03d" % i for i in range(100))
+    assert pipe.read() == b""
+
+
+def test_pipe_from_error():
+    def download(pipe):
+        pipe.write(b"data")
+        raise IOError("Connection lost")
+
+    pipe = pipeline.pipe_from(download)
+    assert pipe.read() == b"data"
+    with pytest.raises(IOError):
+        pipe.read()
+    assert pipe.read() == b""
+
+
+def test_pipe_abandoned():
+    failed = threading.Event()
+
+    def download(pipe):
+        try:
+            while True:
+                pipe.write(b"data")
+        except IOError:
+            failed.set()
+            raise
+
+    pipe = pipeline.pipe_from(download, maxsize=1)
+    assert pipe.read() == b"data"
+    pipe.abandon()
+    assert failed.wait(5)
+
+
+def test_peekable_reader():
+    reader = pipeline.PeekableReader(io.BytesIO(b"PGDMP and the rest"))
+    assert reader.peek(5) == b"PGDMP"
+    assert reader.peek(3) == b"PGD"
+    assert reader.read(3) == b"PGD"
+    assert reader.peek(2) == b"MP"
+    assert _read(reader) == b"MP and the rest"
+    assert reader.peek(5) == b""
+
+
+def test_counting_reader():
+    sizes = []
+    reader = pipeline.CountingReader(io.BytesIO(b"x" * 10), sizes.append)
+    assert _read(reader, 4) == b"x" * 10
+    assert sizes == [4, 4, 2, 0]
+
+
+def test_gunzip_reader():
+    data = _gzip(b"first member\n") + _gzip(b"") + _gzip(b"second member\n")
+    reader = pipeline.GunzipReader(io.BytesIO(data), chunk_size=7)
+    assert _read(reader) == b"first member\nsecond member\n"
+
+
+def test_gunzip_reader_size():
+    data = b"".join(b"%06d\n" % i for i in range(10000))
+    reader = pipeline.GunzipReader(io.BytesIO(_gzip(data)), chunk_size=1024)
+    assert reader.read(10) == data[:10]
+    assert reader.read(0) == b""
+    chunks = list(iter(lambda: reader.read(10), b""))
+    assert all(len(chunk) <= 10 for chunk in chunks)
+    assert b"".join(chunks) == data[10:]
+
+
+def test_gunzip_reader_truncated():
+    data = _gzip(b"x" * 1000)
+    reader = pipeline.GunzipReader(io.BytesIO(data[:-4]), chunk_size=7)
+    with pytest.raises(EOFError):
+        _read(reader)
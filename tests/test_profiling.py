@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This file is part of the dodoo-migrator (R) project.
+# Copyright (c) 2018 Camptocamp SA and XOE Corp. SAS
+# Authors: Guewen Baconnier, Leonardo Pistone, David Arnold, et al.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import gc
+import itertools
+import json
+import weakref
+
+import pytest
+
+from dodoo_migrator import profiling
+
+
+class FakeCursor(object):
+    def __init__(self, cnx=None):
+        self._cnx = cnx
+        self.queries = []
+        self.rowcount = -1
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+        self.rowcount = 3 if query.startswith("UPDATE") else -1
+
+    def fetchone(self):
+        return [{"Plan": {"Node Type": "Seq Scan"}}]
+
+    def dictfetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.cursors = []
+
+    def cursor(self):
+        self.cursors.append(FakeCursor(self))
+        return self.cursors[-1]
+
+
+# a helper of odoo.migration, as seen by the profiler
+HELPERS = {"__name__": "odoo.migration.migration"}
+exec(
+    "def rename_field(cr):\n"
+    "    cr.execute('UPDATE ir_model_fields SET name = name')\n",
+    HELPERS,
+)
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    # every statement lasts one second
+    clock = itertools.count()
+    monkeypatch.setattr(profiling.time, "time", lambda: next(clock))
+    monkeypatch.setattr(profiling, "PROFILER", None)
+    profiling.start()
+    return profiling.PROFILER
+
+
+def test_cursor_not_profiled(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILER", None)
+    cr = FakeCursor()
+    assert profiling.cursor(cr, "pre") is cr
+
+
+def test_profiling_cursor(profiler):
+    cr = FakeCursor()
+    pre = profiling.cursor(cr, "pre.py")
+    assert profiling.cursor(cr, "base/12.0.1.0/post-x.py") is pre
+    assert pre.context == "base/12.0.1.0/post-x.py"
+    pre.execute("SELECT 1")
+    HELPERS["rename_field"](pre)
+    HELPERS["rename_field"](pre)
+    # everything else is delegated
+    assert pre.dictfetchall() == []
+    assert cr.queries == ["SELECT 1"] + ["UPDATE ir_model_fields SET name = name"] * 2
+
+    report = profiler.report()
+    assert report["total"]["statements"] == 3
+    assert report["total"]["rows"] == 6
+    assert report["helpers"]["rename_field"]["statements"] == 2
+    assert report["helpers"]["<script>"]["statements"] == 1
+    update = report["statements"][0]
+    assert update["query"].startswith("UPDATE")
+    assert update["calls"] == 2
+    assert update["helpers"] == ["rename_field"]
+    assert update["contexts"] == ["base/12.0.1.0/post-x.py"]
+
+    assert list(profiler.folded()) == [
+        "base/12.0.1.0/post-x.py;SELECT 1 1000000\n",
+        "base/12.0.1.0/post-x.py;rename_field;"
+        "UPDATE ir_model_fields SET name = name 2000000\n",
+    ]
+
+
+def test_profiling_cursor_collected(profiler):
+    migration = pytest.importorskip("odoo.migration")
+    cr = FakeCursor()
+    wrapper = profiling.cursor(cr, "pre.py")
+    # the helpers cache the schema per (wrapped) cursor
+    assert migration.schema_catalog(wrapper) is not None
+    refs = [weakref.ref(cr), weakref.ref(wrapper)]
+    # the script is done with its cursor
+    cr.close()
+    del cr, wrapper
+    gc.collect()
+    assert [ref() for ref in refs] == [None, None]
+    assert not profiler.cursors
+
+
+def test_explain_slowest(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILER", None)
+    profiling.start(explain=1)
+    cnx = FakeConnection()
+    cr = profiling.cursor(FakeCursor(cnx), "pre.py")
+    cr.execute("SELECT 1")
+    cr.execute("CREATE INDEX foo ON bar (baz)")
+    stats = profiling.PROFILER.statements
+    assert "explain" in stats["SELECT 1"]
+    assert "explain" not in stats["CREATE INDEX foo ON bar (baz)"]
+    # explained on a cursor of its own, rolled back
+    queries = cnx.cursors[0].queries
+    assert queries[1] == "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) SELECT 1"
+    assert queries[2].startswith("ROLLBACK TO SAVEPOINT")
+
+
+def test_write_report(profiler, tmpdir):
+    profiling.cursor(FakeCursor(), "pre.py").execute("SELECT 1")
+    path = tmpdir.join("profile.json")
+    profiling.write_report(str(path))
+    assert json.loads(path.read())["total"]["statements"] == 1
+    (line,) = tmpdir.join("profile.json.folded").readlines()
+    assert line == "pre.py;SELECT 1 1000000\n"
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This file is part of the dodoo-migrator (R) project.
+# Copyright (c) 2018 Camptocamp SA and XOE Corp. SAS
+# Authors: Guewen Baconnier, Leonardo Pistone, David Arnold, et al.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import gzip
+import io
+import os
+import tarfile
+
+import pytest
+
+from dodoo_migrator.migration.upgradeservice import restore
+
+
+def _toc(archive_format):
+    # "PGDMP", version, int size, offset size, format
+    return b"PGDMP\x01\x0e\x00\x04\x08" + archive_format + b"..."
+
+
+def _read(stream):
+    return b"".join(iter(lambda: stream.read(1024), b""))
+
+
+def _gzip(data):
+    f = io.BytesIO()
+    with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+        gz.write(data)
+    return f.getvalue()
+
+
+def _tarball(archive_format):
+    f = io.BytesIO()
+    with tarfile.open(fileobj=f, mode="w") as tar:
+        for name, data in (("toc.dat", _toc(archive_format)), ("3000.dat", b"1\n")):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return f.getvalue()
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        restore,
+        "_pipe_pg_restore",
+        lambda db, stream, fmt: calls.append(("pg_restore", fmt, _read(stream))),
+    )
+    monkeypatch.setattr(
+        restore,
+        "restore_directory",
+        lambda db, path, jobs: calls.append(("directory", path)),
+    )
+    monkeypatch.setattr(
+        restore,
+        "restore_sql",
+        lambda db, stream, dump_dir, jobs: calls.append(("sql", _read(stream))),
+    )
+    return calls
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_stream_custom_format(calls, tmpdir, compress):
+    dump = _toc(restore.ARCH_CUSTOM)
+    stream = io.BytesIO(_gzip(dump) if compress else dump)
+    restore.restore_stream("db", stream, str(tmpdir), 4)
+    assert calls == [("pg_restore", "--format=c", dump)]
+
+
+def test_stream_tar_format(calls, tmpdir):
+    dump = _tarball(restore.ARCH_TAR)
+    restore.restore_stream("db", io.BytesIO(dump), str(tmpdir), 4)
+    assert calls == [("pg_restore", "--format=t", dump)]
+
+
+def test_stream_directory_format(calls, tmpdir):
+    dump = _tarball(restore.ARCH_DIRECTORY)
+    restore.restore_stream("db", io.BytesIO(dump), str(tmpdir), 4)
+    assert calls == [("directory", str(tmpdir.join("dump")))]
+    assert sorted(os.listdir(calls[0][1])) == ["3000.dat", "toc.dat"]
+
+
+def test_stream_unknown_tar(calls, tmpdir):
+    with pytest.raises(Exception, match="unknown tar archive"):
+        restore.restore_stream("db", io.BytesIO(_tarball(b"\x09")), str(tmpdir), 4)
+    assert calls == []
+
+
+def test_stream_sql(calls, tmpdir):
+    restore.restore_stream("db", io.BytesIO(b"SELECT 1;\n"), str(tmpdir), 4)
+    assert calls == [("sql", b"SELECT 1;\n")]
+
+
+def test_archive_custom_format(calls, tmpdir):
+    dump = tmpdir.join("dump")
+    dump.write_binary(_toc(restore.ARCH_CUSTOM))
+    with open(str(dump), "rb") as f:
+        restore.restore_archive("db", f, str(tmpdir), 4)
+    # pg_restore --jobs reads the file itself
+    assert calls == [("directory", str(dump))]
+
+
+def test_archive_tar_format(calls, tmpdir):
+    dump = tmpdir.join("dump")
+    dump.write_binary(_tarball(restore.ARCH_TAR))
+    with open(str(dump), "rb") as f:
+        restore.restore_archive("db", f, str(tmpdir), 4)
+    assert calls == [("pg_restore", "--format=t", dump.read_binary())]
+
+
+SQL_DUMP = b"""\
+SET statement_timeout = 0;
+--
+-- Name: res_partner; Type: TABLE; Schema: public; Owner: odoo
+--
+CREATE TABLE res_partner (id integer, name varchar);
+--
+-- Data for Name: res_partner; Type: TABLE DATA; Schema: public; Owner: odoo
+--
+COPY res_partner (id, name) FROM stdin;
+1\tCOPY x FROM stdin;
+2\t-- Name: fake; Type: INDEX; Schema: public; Owner: odoo
+\\.
+--
+-- Data for Name: res_users; Type: TABLE DATA; Schema: public; Owner: odoo
+--
+COPY res_users (id) FROM stdin;
+\\.
+--
+-- Name: res_partner_pkey; Type: CONSTRAINT; Schema: public; Owner: odoo
+--
+ALTER TABLE res_partner ADD CONSTRAINT res_partner_pkey PRIMARY KEY (id);
+--
+-- Name: res_partner_name_index; Type: INDEX; Schema: public; Owner: odoo
+--
+CREATE INDEX res_partner_name_index ON res_partner (name);
+--
+-- Name: res_users_fk; Type: FK CONSTRAINT; Schema: public; Owner: odoo
+--
+ALTER TABLE res_users ADD CONSTRAINT res_users_fk FOREIGN KEY (id) REFERENCES res_partner(id);
+"""
+
+COPY_DATA = [
+    b"1\tCOPY x FROM stdin;\n2\t-- Name: fake; Type: INDEX; Schema: public; "
+    b"Owner: odoo\n\\.\n",
+    b"\\.\n",
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024])
+def test_iter_sql_dump(chunk_size):
+    parts = list(restore.iter_sql_dump(io.BytesIO(SQL_DUMP), chunk_size))
+    assert b"".join(data for _, data in parts) == SQL_DUMP
+    lines = [data for is_line, data in parts if is_line]
+    assert all(line.endswith(b"\n") and line.count(b"\n") == 1 for line in lines)
+    # COPY data may be yielded in several chunks
+    copies, copy = [], b""
+    for is_line, data in parts:
+        if is_line and copy:
+            copies.append(copy)
+            copy = b""
+        elif not is_line:
+            copy += data
+    assert copies == COPY_DATA
+
+
+class StubSession(object):
+    def __init__(self, db):
+        self.data = []
+        self.closed = False
+
+    def write(self, data):
+        self.data.append(data)
+
+    def pending(self):
+        return len(self.data)
+
+    def close(self):
+        self.closed = True
+
+
+def test_sql_dump_sections(monkeypatch, tmpdir):
+    sessions, scripts = [], []
+
+    def session(db):
+        sessions.append(StubSession(db))
+        return sessions[-1]
+
+    def run_sql(db, path):
+        with open(path, "rb") as f:
+            scripts.append((os.path.basename(path), f.read()))
+
+    monkeypatch.setattr(restore, "PgSession", session)
+    monkeypatch.setattr(restore, "_run_sql", run_sql)
+    restore.restore_sql("db", io.BytesIO(SQL_DUMP), str(tmpdir), 2)
+
+    preamble = b"SET statement_timeout = 0;\n"
+    name, pre = scripts[0]
+    assert name == "pre-data.sql"
+    assert pre.startswith(preamble) and b"CREATE TABLE res_partner" in pre
+    assert b"COPY" not in pre
+
+    # each table went to one of the sessions, all of them got the preamble
+    assert len(sessions) == 2 and all(s.closed for s in sessions)
+    assert all(s.data[0].startswith(preamble) for s in sessions)
+    data = b"".join(b"".join(s.data) for s in sessions)
+    for copy in COPY_DATA:
+        assert copy in data
+    assert b"CREATE INDEX" not in data and b"CONSTRAINT" not in data
+
+    # indexes and constraints are built concurrently, the rest comes last
+    parallel = dict(scripts[1:-1])
+    assert sorted(parallel) == ["post-0.sql", "post-1.sql"]
+    assert all(sql.startswith(preamble) for sql in parallel.values())
+    assert b"PRIMARY KEY" in b"".join(parallel.values())
+    assert b"CREATE INDEX" in b"".join(parallel.values())
+    name, post = scripts[-1]
+    assert name == "post-data.sql"
+    assert b"FOREIGN KEY" in post and b"PRIMARY KEY" not in post
+
+
+def test_sql_dump_single_session(monkeypatch, tmpdir):
+    sessions = []
+
+    def session(db):
+        sessions.append(StubSession(db))
+        return sessions[-1]
+
+    monkeypatch.setattr(restore, "PgSession", session)
+    restore.restore_sql("db", io.BytesIO(SQL_DUMP), str(tmpdir), 1)
+    assert len(sessions) == 1
+    assert b"".join(sessions[0].data) == SQL_DUMP
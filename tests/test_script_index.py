@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This file is part of the dodoo-migrator (R) project.
+# Copyright (c) 2018 Camptocamp SA and XOE Corp. SAS
+# Authors: Guewen Baconnier, Leonardo Pistone, David Arnold, et al.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+
+from dodoo_migrator.script_index import ScriptIndex, root_mtimes
+
+KEY = {"addons_path": ["addons"], "mtimes": {}}
+
+
+def _migrations(tmpdir):
+    migrations = tmpdir.mkdir("base").mkdir("migrations")
+    migrations.join("12.0.1.0", "post-a.py").write("", ensure=True)
+    migrations.join("12.0.1.0", "pre-b.py").write("")
+    migrations.join("12.0.1.0", "README").write("")
+    migrations.join("12.0.1.1", "post-c.py").write("", ensure=True)
+    migrations.join("notes.txt").write("")
+    return migrations
+
+
+def _touch(path, mtime):
+    os.utime(str(path), (mtime, mtime))
+
+
+def test_scripts(tmpdir):
+    migrations = _migrations(tmpdir)
+    index = ScriptIndex(str(tmpdir.join("index.json")), KEY)
+    versions = index.scripts(str(migrations))
+    assert versions == {
+        "12.0.1.0": [
+            str(migrations.join("12.0.1.0", "post-a.py")),
+            str(migrations.join("12.0.1.0", "pre-b.py")),
+        ],
+        "12.0.1.1": [str(migrations.join("12.0.1.1", "post-c.py"))],
+    }
+    assert index.dirty
+
+
+def test_stale_entry(tmpdir):
+    migrations = _migrations(tmpdir)
+    path = str(tmpdir.join("index.json"))
+    index = ScriptIndex(path, KEY)
+    index.scripts(str(migrations))
+    index.save()
+    assert not index.dirty
+
+    migrations.join("12.0.1.1", "pre-d.py").write("")
+    # checked once per process
+    assert len(index.scripts(str(migrations))["12.0.1.1"]) == 1
+    _touch(migrations.join("12.0.1.1"), 1000)
+    index = ScriptIndex.load(path, KEY)
+    assert len(index.scripts(str(migrations))["12.0.1.1"]) == 2
+    assert index.dirty
+
+
+def test_fresh_entry(tmpdir):
+    migrations = _migrations(tmpdir)
+    path = str(tmpdir.join("index.json"))
+    index = ScriptIndex(path, KEY)
+    index.scripts(str(migrations))
+    index.save()
+    # a script changed in place: the index is still current
+    migrations.join("12.0.1.0", "post-a.py").write("cr.execute('SELECT 1')")
+    index = ScriptIndex.load(path, KEY)
+    index.scripts(str(migrations))
+    assert not index.dirty
+
+
+def test_load_other_key(tmpdir):
+    migrations = _migrations(tmpdir)
+    path = str(tmpdir.join("cache", "index.json"))
+    index = ScriptIndex(path, KEY)
+    index.scripts(str(migrations))
+    index.save()
+
+    index = ScriptIndex.load(path, KEY)
+    assert list(index.entries) == [str(migrations)]
+    index = ScriptIndex.load(path, dict(KEY, addons_path=["other"]))
+    assert index.entries == {}
+    assert ScriptIndex.load(str(tmpdir.join("missing.json")), KEY).entries == {}
+
+
+def test_removed_folder(tmpdir):
+    migrations = _migrations(tmpdir)
+    path = str(tmpdir.join("index.json"))
+    index = ScriptIndex(path, KEY)
+    index.scripts(str(migrations))
+    index.save()
+    migrations.remove()
+    index = ScriptIndex.load(path, KEY)
+    assert index.scripts(str(migrations)) == {}
+    index.save()
+
+    # the folder comes back
+    migrations.join("12.0.1.2", "post-e.py").write("", ensure=True)
+    index = ScriptIndex.load(path, KEY)
+    assert list(index.scripts(str(migrations))) == ["12.0.1.2"]
+
+
+def test_clear(tmpdir):
+    index = ScriptIndex(str(tmpdir.join("index.json")), KEY)
+    index.scripts(str(_migrations(tmpdir)))
+    index.save()
+    index.clear()
+    assert index.entries == {} and index.dirty
+
+
+def test_root_mtimes(tmpdir):
+    addons = tmpdir.mkdir("addons")
+    _touch(addons, 1000)
+    mtimes = root_mtimes([str(addons), str(tmpdir.join("missing"))])
+    assert mtimes == {str(addons): 1000}
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This file is part of the dodoo-migrator (R) project.
+# Copyright (c) 2018 Camptocamp SA and XOE Corp. SAS
+# Authors: Guewen Baconnier, Leonardo Pistone, David Arnold, et al.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import itertools
+
+import pytest
+import requests
+
+from dodoo_migrator.migration.upgradeservice import watch
+from dodoo_migrator.migration.upgradeservice.errors import OdooUpgradeServiceError
+
+
+class StubService(object):
+    request_id = 1
+
+    def __init__(self, states):
+        self.states = list(states)
+
+    def status(self, max_age=None):
+        state = self.states.pop(0)
+        if isinstance(state, Exception):
+            raise state
+        return {"state": state}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(watch.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_backoff():
+    delays = watch.backoff(1, 10)
+    assert list(itertools.islice(delays, 6)) == [1, 2, 4, 8, 10, 10]
+
+
+def test_watch(sleeps):
+    states = ["pending"] * 4 + ["progress"] * 3 + ["done"]
+    service = StubService(states)
+    assert watch.watch(service, 1, 4) == {"state": "done"}
+    assert not service.states
+    # the backoff starts over when the state changes
+    assert sleeps == [1, 2, 4, 4, 1, 2, 4]
+
+
+def test_watch_failed(sleeps):
+    with pytest.raises(OdooUpgradeServiceError):
+        watch.watch(StubService(["pending", "failed"]), 1, 4)
+    assert sleeps == [1]
+
+
+def test_watch_poll_errors(sleeps):
+    states = [
+        "pending",
+        requests.ConnectionError("unreachable"),
+        ValueError("not json"),
+        "done",
+    ]
+    assert watch.watch(StubService(states), 1, 4) == {"state": "done"}
+    # failing polls keep the state and back off
+    assert sleeps == [1, 2, 4]